@@ -8,14 +8,13 @@ django.setup()
 # Django設定後にインポート
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
 from tracker.routing import websocket_urlpatterns
 
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
-        URLRouter(
-            websocket_urlpatterns
-        )
+    # 認証は使わないため、接続ごとにDBセッションを読み込む AuthMiddlewareStack は通さない
+    # （参加者は共有ページが発行する署名付きトークンで識別）
+    "websocket": URLRouter(
+        websocket_urlpatterns
     ),
 })
\ No newline at end of file
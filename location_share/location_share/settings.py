@@ -31,6 +31,26 @@ CONTACT_EMAIL = 'hujisimariku33@gmail.com'
 CELERY_BROKER_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
 
+# レート制限のバケットを共有するRedis（未設定ならプロセス内で制限）
+RATE_LIMIT_REDIS_URL = os.environ.get('REDIS_URL')
+
+# キャッシュ（名簿バージョン・チャットキャッシュ・統計は全プロセスとCeleryワーカーで共有する）
+# REDIS_URL が未設定の場合はプロセス内キャッシュとなり、名簿の304応答は行わない
+if RATE_LIMIT_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': RATE_LIMIT_REDIS_URL,
+            'KEY_PREFIX': 'location_share',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # Celery設定
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
@@ -98,6 +118,8 @@ TEMPLATES = [
     },
 ]
 
+HOME_PAGE_CACHE_SECONDS = 300  # トップページ（CSRFトークンは送信時に取得）
+
 WSGI_APPLICATION = 'location_share.wsgi.application'
 
 DATABASES = {
@@ -159,6 +181,15 @@ USE_TZ = True
 # Static files (CSS, JavaScript, Images)
 STATIC_URL = '/static/'
 STATIC_ROOT = '/usr/share/nginx/html/static'
+# collectstatic で縮小・ハッシュ付きファイル名・gzip/brotli版を出力（nginx で長期キャッシュ）
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'tracker.storage.CompressedManifestStaticFilesStorage',
+    },
+}
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
@@ -169,7 +200,9 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Session settings
 SESSION_COOKIE_AGE = 24 * 60 * 60  # 24時間
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
-SESSION_SAVE_EVERY_REQUEST = True
+# 参加者IDは署名付きCookieで管理するため、DBセッションは管理画面のみで使用
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_SAVE_EVERY_REQUEST = False
 # HTTPS設定
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 USE_TLS = True
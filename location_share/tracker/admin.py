@@ -1,6 +1,6 @@
 # tracker/admin.py
 from django.contrib import admin
-from .models import LocationSession, LocationData, SessionLog, WebSocketConnection, ChatMessage, ChatUnreadCount
+from .models import LocationSession, LocationData, SessionLog, WebSocketConnection, ChatMessage
 
 @admin.register(LocationSession)
 class LocationSessionAdmin(admin.ModelAdmin):
@@ -0,0 +1,252 @@
+# tracker/chat_cache.py - セッションごとの最近のチャット（リングバッファ）
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, NamedTuple, Iterable
+
+from django.core.cache import cache
+
+
+class CachedMessage(NamedTuple):
+    """キャッシュ上のチャットメッセージ（ChatMessage と同じ属性名）"""
+    id: int
+    chat_type: str
+    sender_id: str
+    sender_name: str
+    target_id: Optional[str]
+    text: str
+    timestamp: datetime
+
+    @classmethod
+    def from_model(cls, message) -> 'CachedMessage':
+        return cls(
+            message.id, message.chat_type, message.sender_id, message.sender_name,
+            message.target_id, message.text, message.timestamp,
+        )
+
+
+class _Buffer:
+    """1会話分のリングバッファ
+
+    complete は「期間内のメッセージをすべて保持している」ことを表す。
+    あふれて古いメッセージを捨てた場合は False になる。
+    """
+    __slots__ = ('messages', 'complete')
+
+    def __init__(self, max_messages: int, complete: bool = False):
+        self.messages: deque = deque(maxlen=max_messages)
+        self.complete = complete
+
+    def append(self, message: CachedMessage):
+        if len(self.messages) == self.messages.maxlen:
+            self.complete = False
+        self.messages.append(message)
+
+    def merge(self, messages: Iterable[CachedMessage], complete: bool):
+        """DBから読み込んだメッセージと統合（未保存の新しいメッセージは残す）"""
+        merged = {m.id: m for m in messages}
+        merged.update((m.id, m) for m in self.messages)
+        ordered = sorted(merged.values(), key=lambda m: (m.timestamp, m.id))
+        overflow = len(ordered) > self.messages.maxlen
+        self.messages.clear()
+        self.messages.extend(ordered)
+        self.complete = complete and not overflow
+
+    def snapshot(self) -> Tuple[List[CachedMessage], bool]:
+        return list(self.messages), self.complete
+
+
+class _SessionChat:
+    __slots__ = ('group', 'group_primed', 'pairs', 'primed', 'version', 'expires_at')
+
+    def __init__(self, max_messages: int, version: int, expires_at: float):
+        self.group = _Buffer(max_messages)
+        self.group_primed = False
+        self.pairs: Dict[Tuple[str, str], _Buffer] = {}
+        self.primed = set()  # 個別チャットをDBから読み込み済みの参加者
+        self.version = version  # 反映済みの書き込みバージョン
+        self.expires_at = expires_at
+
+    def unprime(self):
+        """次の読み込みでDBの内容と統合し直す（追記済みのメッセージは残す）"""
+        self.group_primed = False
+        self.primed.clear()
+
+
+def _pair_key(a: str, b: str) -> Tuple[str, str]:
+    return (a, b) if a <= b else (b, a)
+
+
+def _partner(key: Tuple[str, str], participant_id: str) -> str:
+    a, b = key
+    return b if a == participant_id else a
+
+
+class RecentChatCache:
+    """アクティブなセッションの最近のチャットをプロセス内に保持
+
+    書き込み時に追記し、最新ページの履歴要求をDBに問い合わせずに返す。
+    セッション・参加者ごとに初回のみDBから読み込み（prime）、それより古い
+    ページはDBから取得する。セッション数はLRUで制限し、作成から ttl 秒後
+    （読み込みでは延長しない）やセッション期限切れ時に破棄する。
+
+    他のプロセスでの追記を検出するため、セッションごとの書き込みバージョンを
+    Djangoのキャッシュ（複数プロセス構成では共有キャッシュ）に持つ。知らない
+    書き込みがあれば次の読み込みでDBと統合し直し、保存待ちだったメッセージを
+    取り込むため settle 秒後にもう一度読み込み直す。
+    """
+
+    def __init__(self, max_messages: int = 200, max_sessions: int = 256, ttl: float = 3600.0,
+                 settle: float = 2.0, version_timeout: int = 86400, prefix: str = 'chat_cache_version'):
+        self.max_messages = max_messages
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.settle = settle
+        self.version_timeout = version_timeout
+        self.prefix = prefix
+        self._sessions: 'OrderedDict[str, _SessionChat]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stale': 0}
+
+    def append(self, session_id: str, message: CachedMessage):
+        """保存（またはブロードキャスト）したメッセージを追記"""
+        session_id = str(session_id)
+        version = self._bump_version(session_id)
+        with self._lock:
+            chat = self._get(session_id, version - 1, create=True)
+            # 前回の追記以降に他のプロセスが書き込んでいれば、1つ前のバージョンと一致しない
+            self._check_version(chat, version - 1)
+            chat.version = version
+            if message.chat_type == 'group':
+                chat.group.append(message)
+            elif message.target_id:
+                key = _pair_key(message.sender_id, message.target_id)
+                buffer = chat.pairs.get(key)
+                if buffer is None:
+                    # どちらかが読み込み済みなら、この会話は新規（全件保持）
+                    complete = message.sender_id in chat.primed or message.target_id in chat.primed
+                    buffer = chat.pairs[key] = _Buffer(self.max_messages, complete)
+                buffer.append(message)
+
+    def group(self, session_id: str) -> Optional[Tuple[List[CachedMessage], bool]]:
+        """グループチャット（読み込み前なら None）"""
+        session_id = str(session_id)
+        version = self._current_version(session_id)
+        with self._lock:
+            chat = self._get(session_id, version)
+            if chat is not None:
+                self._check_version(chat, version)
+            if chat is None or not chat.group_primed:
+                self._stats['misses'] += 1
+                return None
+            self._stats['hits'] += 1
+            return chat.group.snapshot()
+
+    def conversations(self, session_id: str, participant_id: str) -> Optional[Dict[str, Tuple[List[CachedMessage], bool]]]:
+        """参加者の個別チャット（相手ID -> メッセージ）。読み込み前なら None"""
+        session_id = str(session_id)
+        version = self._current_version(session_id)
+        with self._lock:
+            chat = self._get(session_id, version)
+            if chat is not None:
+                self._check_version(chat, version)
+            if chat is None or participant_id not in chat.primed:
+                self._stats['misses'] += 1
+                return None
+            self._stats['hits'] += 1
+            return {
+                _partner(key, participant_id): buffer.snapshot()
+                for key, buffer in chat.pairs.items()
+                if participant_id in key and key[0] != key[1]
+            }
+
+    def prime_group(self, session_id: str, messages: List[CachedMessage],
+                    complete: bool) -> Tuple[List[CachedMessage], bool]:
+        """グループチャットをDBの内容で初期化し、統合後の内容を返す"""
+        session_id = str(session_id)
+        version = self._current_version(session_id)
+        with self._lock:
+            chat = self._get(session_id, version, create=True)
+            self._check_version(chat, version)
+            chat.group.merge(messages, complete)
+            chat.group_primed = True
+            return chat.group.snapshot()
+
+    def prime_participant(self, session_id: str, participant_id: str,
+                          conversations: Dict[str, Tuple[List[CachedMessage], bool]]
+                          ) -> Dict[str, Tuple[List[CachedMessage], bool]]:
+        """参加者の個別チャットをDBの内容で初期化し、統合後の内容を返す"""
+        session_id = str(session_id)
+        version = self._current_version(session_id)
+        with self._lock:
+            chat = self._get(session_id, version, create=True)
+            self._check_version(chat, version)
+            for partner_id, (messages, complete) in conversations.items():
+                key = _pair_key(participant_id, partner_id)
+                buffer = chat.pairs.get(key)
+                if buffer is None:
+                    buffer = chat.pairs[key] = _Buffer(self.max_messages)
+                buffer.merge(messages, complete)
+            # DBに存在しない会話は追記分がすべて
+            for key, buffer in chat.pairs.items():
+                if participant_id in key and _partner(key, participant_id) not in conversations:
+                    buffer.merge((), True)
+            chat.primed.add(participant_id)
+            return {
+                _partner(key, participant_id): buffer.snapshot()
+                for key, buffer in chat.pairs.items()
+                if participant_id in key and key[0] != key[1]
+            }
+
+    def discard_session(self, session_id: str):
+        """セッションのキャッシュを破棄"""
+        with self._lock:
+            self._sessions.pop(str(session_id), None)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['sessions'] = len(self._sessions)
+        return stats
+
+    # === 内部処理 ===
+
+    def _get(self, session_id: str, version: int, create: bool = False) -> Optional[_SessionChat]:
+        now = time.monotonic()
+        chat = self._sessions.get(session_id)
+        if chat is not None and now >= chat.expires_at:
+            del self._sessions[session_id]
+            chat = None
+        if chat is None:
+            if not create:
+                return None
+            chat = self._sessions[session_id] = _SessionChat(self.max_messages, version, now + self.ttl)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        self._sessions.move_to_end(session_id)
+        return chat
+
+    def _check_version(self, chat: _SessionChat, version: int):
+        """他のプロセスが書き込んでいた（またはバージョンが消えた）場合は読み込み直す"""
+        if version == chat.version:
+            return
+        chat.unprime()
+        chat.expires_at = min(chat.expires_at, time.monotonic() + self.settle)
+        chat.version = version
+        self._stats['stale'] += 1
+
+    def _version_key(self, session_id: str) -> str:
+        return f'{self.prefix}:{session_id}'
+
+    def _current_version(self, session_id: str) -> int:
+        return cache.get(self._version_key(session_id), 0)
+
+    def _bump_version(self, session_id: str) -> int:
+        key = self._version_key(session_id)
+        try:
+            return cache.incr(key)
+        except ValueError:
+            if cache.add(key, 1, self.version_timeout):
+                return 1
+            return cache.incr(key)
@@ -0,0 +1,133 @@
+# tracker/chat_writer.py - チャットメッセージのバッチ保存
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from channels.db import database_sync_to_async
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class ChatIdAllocator:
+    """チャットメッセージIDを事前にまとめて確保
+
+    保存前にIDを付けてブロードキャストするため、PostgreSQLではテーブルの
+    シーケンスからブロック単位で採番する。ブロックはプロセスごとに確保するので
+    IDは送信順にならない（順序は (timestamp, id) で判定する）。
+    シーケンスのないDBでは supported が False になり、保存時にDBが採番する。
+    """
+
+    def __init__(self, model, block_size: int = 50):
+        self.model = model
+        self.block_size = block_size
+        self._ids = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def supported(self) -> bool:
+        return connection.vendor == 'postgresql'
+
+    async def allocate(self) -> int:
+        """IDを1つ取得（手持ちがなければDBから補充）"""
+        while True:
+            with self._lock:
+                if self._ids:
+                    return self._ids.popleft()
+            await database_sync_to_async(self._refill)()
+
+    def _refill(self):
+        with self._lock:
+            if self._ids:
+                return
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                [self.model._meta.db_table, self.block_size]
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+
+        with self._lock:
+            self._ids.extend(ids)
+
+
+class ChatWriteBuffer:
+    """チャットメッセージをまとめて保存するバッファ
+
+    submit() は保存完了時に True（失敗時は False）になる Future を返す。
+    max_batch 件たまるか、最初の1件から max_latency 秒経過した時点で
+    persist にまとめて渡す。
+    """
+
+    def __init__(self, persist: Callable[[List[Any]], None], max_batch: int = 100, max_latency: float = 0.2):
+        self.persist = persist
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self._pending: List[tuple] = []
+        self._timer: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stats = {'submitted': 0, 'persisted': 0, 'failed': 0, 'batches': 0}
+
+    async def submit(self, obj) -> asyncio.Future:
+        """保存対象を追加"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # イベントループが変わった場合（テスト・再起動）は状態を作り直す
+            self._loop = loop
+            self._pending = []
+            self._timer = None
+
+        future = loop.create_future()
+        self._pending.append((obj, future))
+        self._stats['submitted'] += 1
+
+        if len(self._pending) >= self.max_batch:
+            # 保存を待つ間に届いたメッセージは次のバッチに回す
+            batch, self._pending = self._pending, []
+            loop.create_task(self._flush_batch(batch))
+        elif self._timer is None or self._timer.done():
+            self._timer = loop.create_task(self._flush_later())
+        return future
+
+    async def write_now(self, obj) -> bool:
+        """バッファを通さずにすぐ保存（保存時にDBが採番する場合）"""
+        self._stats['submitted'] += 1
+        return await self._persist([obj])
+
+    async def flush(self):
+        """保留中のメッセージを保存"""
+        batch, self._pending = self._pending, []
+        await self._flush_batch(batch)
+
+    def get_stats(self) -> Dict[str, int]:
+        stats = dict(self._stats)
+        stats['pending'] = len(self._pending)
+        return stats
+
+    async def _flush_batch(self, batch: List[tuple]):
+        if not batch:
+            return
+
+        persisted = await self._persist([obj for obj, _ in batch])
+        for _, future in batch:
+            if not future.done():
+                future.set_result(persisted)
+
+    async def _persist(self, objs: List[Any]) -> bool:
+        try:
+            await database_sync_to_async(self.persist)(objs)
+            persisted = True
+            self._stats['persisted'] += len(objs)
+        except Exception as e:
+            logger.error(f"Chat batch save error: {str(e)}")
+            persisted = False
+            self._stats['failed'] += len(objs)
+        self._stats['batches'] += 1
+        return persisted
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.max_latency)
+        await self.flush()
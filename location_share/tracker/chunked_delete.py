@@ -0,0 +1,140 @@
+# tracker/chunked_delete.py - 負荷を抑えた分割削除
+import logging
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Optional
+
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseLoadProbe:
+    """PostgreSQLの負荷（実行中のクエリ数・レプリケーション遅延）が閾値を超えているか
+
+    ChunkedDeleter の load_check に渡す。他のDBでは常に False。
+    確認は check_interval 秒に1回までとし、その間は前回の結果を返す。
+    """
+
+    def __init__(self, max_active_queries: int = 20, max_replication_lag: float = 10.0,
+                 check_interval: float = 1.0, using: str = 'default'):
+        self.max_active_queries = max_active_queries
+        self.max_replication_lag = max_replication_lag
+        self.check_interval = check_interval
+        self.using = using
+        self._checked_at: Optional[float] = None
+        self._overloaded = False
+
+    def __call__(self) -> bool:
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return self._overloaded
+        self._checked_at = now
+        self._overloaded = self._check()
+        return self._overloaded
+
+    def _check(self) -> bool:
+        connection = connections[self.using]
+        if connection.vendor != 'postgresql':
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT count(*) FROM pg_stat_activity "
+                    "WHERE state = 'active' AND datname = current_database() AND pid <> pg_backend_pid()"
+                )
+                active_queries = cursor.fetchone()[0]
+                cursor.execute(
+                    "SELECT COALESCE(MAX(EXTRACT(EPOCH FROM replay_lag)), 0) FROM pg_stat_replication"
+                )
+                replication_lag = float(cursor.fetchone()[0] or 0)
+        except Exception as e:
+            logger.error(f"Database load check error: {str(e)}")
+            return False
+
+        overloaded = active_queries > self.max_active_queries or replication_lag > self.max_replication_lag
+        if overloaded:
+            logger.info(f"DB負荷を検知: 実行中クエリ {active_queries}件, レプリケーション遅延 {replication_lag:.1f}秒")
+        return overloaded
+
+
+class ChunkedDeleter:
+    """主キー範囲ごとに短いトランザクションで削除する
+
+    対象の主キーを昇順に chunk_size 件ずつ取り出し、その範囲だけを削除する。
+    1チャンクの削除に slow_chunk_seconds 以上かかった場合（ロック待ち・I/O負荷）や
+    load_check が True を返した場合は待機時間を倍々に延ばし、落ち着いたら戻す。
+    time_budget を超えた場合は途中で終了し、残りは次回の実行に任せる。
+    """
+
+    def __init__(self, chunk_size: int = 500, pause: float = 0.05, max_pause: float = 5.0,
+                 slow_chunk_seconds: float = 0.5, time_budget: Optional[float] = 240.0,
+                 log_every: int = 20, load_check: Optional[Callable[[], bool]] = None):
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.max_pause = max_pause
+        self.slow_chunk_seconds = slow_chunk_seconds
+        self.time_budget = time_budget
+        self.log_every = log_every
+        self.load_check = load_check
+
+    def delete(self, queryset, label: str = '', chunk_size: Optional[int] = None) -> Dict[str, Any]:
+        """クエリセットの対象を分割削除し、進捗メトリクスを返す"""
+        label = label or queryset.model._meta.label
+        chunk_size = chunk_size or self.chunk_size
+        started = time.monotonic()
+        pause = self.pause
+        deleted_by_model = Counter()
+        metrics = {
+            'label': label,
+            'deleted': 0,
+            'chunks': 0,
+            'throttled': 0,
+            'slowest_chunk': 0.0,
+            'completed': False,
+        }
+
+        last_pk = None
+        while True:
+            if self.time_budget is not None and time.monotonic() - started > self.time_budget:
+                logger.info(f"{label}: 時間上限のため中断（次回に続行） {metrics['deleted']}件削除済み")
+                break
+
+            pks = queryset.order_by('pk')
+            if last_pk is not None:
+                pks = pks.filter(pk__gt=last_pk)
+            pks = list(pks.values_list('pk', flat=True)[:chunk_size])
+            if not pks:
+                metrics['completed'] = True
+                break
+
+            chunk_started = time.monotonic()
+            with transaction.atomic():
+                deleted, per_model = queryset.filter(pk__gte=pks[0], pk__lte=pks[-1]).delete()
+            chunk_elapsed = time.monotonic() - chunk_started
+
+            last_pk = pks[-1]
+            metrics['deleted'] += deleted
+            metrics['chunks'] += 1
+            metrics['slowest_chunk'] = max(metrics['slowest_chunk'], chunk_elapsed)
+            deleted_by_model.update(per_model)
+
+            if metrics['chunks'] % self.log_every == 0:
+                logger.info(f"{label}: {metrics['chunks']}チャンク / {metrics['deleted']}件削除")
+
+            if len(pks) < chunk_size:
+                metrics['completed'] = True
+                break
+
+            # 負荷を検知したら待機を延ばす
+            if chunk_elapsed >= self.slow_chunk_seconds or (self.load_check and self.load_check()):
+                pause = min(self.max_pause, max(pause, self.pause) * 2)
+                metrics['throttled'] += 1
+            else:
+                pause = self.pause
+            time.sleep(pause)
+
+        metrics['deleted_by_model'] = dict(deleted_by_model)
+        metrics['elapsed'] = round(time.monotonic() - started, 3)
+        metrics['slowest_chunk'] = round(metrics['slowest_chunk'], 3)
+        return metrics
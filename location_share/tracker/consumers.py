@@ -1,21 +1,37 @@
 # tracker/consumers.py - リファクタリング版（完全版）
+import asyncio
 import json
 import logging
 import re
-import threading
-import time
 import uuid
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, List
-from django.db.models import Count
+from urllib.parse import parse_qs
+from typing import Dict, Any, Optional, List, Set
+from django.db.models import Case, When, F, CharField, Window, Value
+from django.db.models.functions import RowNumber
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 from django.utils.html import escape
-from django.core.cache import cache
 from django.db.models import Q
-from .models import LocationSession, LocationData, ChatMessage, ChatUnreadCount
+from django.db import transaction, IntegrityError
+from .models import LocationSession, LocationData, ChatMessage, ChatReadCursor
+from .location_filter import LocationJitterFilter, haversine_distance
+from .reporting_rate import ReportingRateController
+from .distance_matrix import DistanceMatrixCache, roster_version
+from .typing_state import TypingStateMachine
+from .chat_cache import RecentChatCache, CachedMessage
+from .chat_writer import ChatIdAllocator, ChatWriteBuffer
+from .session_expiry import SessionExpiryScheduler
+from .presence import PresenceSweeper
+from .session_log import session_log
+from .live_stats import live_stats, update_participant
+from .location_batch import parse_fixes, apply_location_fixes
+from .roster_versions import roster_versions
+from .rate_limit import Limit, rate_limiter
+from .participant_identity import SocketIdentity, verify_socket_token
 
 logger = logging.getLogger(__name__)
 
@@ -24,11 +40,56 @@ class Config:
     MAX_PARTICIPANT_NAME_LENGTH = 30
     MAX_MESSAGE_LENGTH = 200
     MAX_WEBSOCKET_MESSAGE_SIZE = 4096
-    MAX_MESSAGES_PER_MINUTE = 100
+    MAX_MESSAGES_PER_MINUTE = 100     # 参加者（接続）ごと
+    MAX_SESSION_MESSAGES_PER_MINUTE = 1200  # セッション全体
     MAX_CONNECTIONS_PER_SESSION = 20
     DESKTOP_OFFLINE_DELAY = 120  # 2分
     MOBILE_OFFLINE_DELAY = 300   # 5分
+    PAGE_CLOSE_OFFLINE_DELAY = 43200  # ページ閉じ後にオフラインにするまでの時間（12時間）
+    PRESENCE_SWEEP_INTERVAL = 15      # オンライン状態をまとめて見直す間隔（秒）
     STAY_DISTANCE_THRESHOLD = 30  # ★ 30mに変更：滞在地点判定の閾値（メートル）
+    LOCATION_BATCH_MAX_FIXES = 30     # 一括送信1回あたりの測位数（メッセージサイズ上限内）
+    # GPSジッター抑制
+    JITTER_FILTER_ENABLED = True
+    JITTER_MIN_DISTANCE = 5           # この距離（m）未満の移動は破棄
+    JITTER_ACCURACY_FACTOR = 0.5      # 精度（m）に掛けた値もデッドバンドとして使用
+    JITTER_MAX_ACCURACY = 100         # これより悪い精度の更新は改善しない限り破棄
+    JITTER_MAX_SILENCE = 60           # 破棄が続いてもこの秒数ごとに保存する
+    JITTER_SNAP_DISTANCE = 100        # この距離（m）以上の移動は平滑化せず即採用
+    JITTER_PROCESS_NOISE = 10.0       # カルマンフィルターのプロセスノイズ（m²/秒）
+    JITTER_PRESENCE_TOUCH_INTERVAL = 15  # 破棄時の最終確認時刻更新の最小間隔（秒）
+    # サーバー主導の送信間隔（秒）
+    REPORT_INTERVAL_MOVING = 1
+    REPORT_INTERVAL_STATIONARY = 15
+    REPORT_INTERVAL_BACKGROUND = 15
+    REPORT_INTERVAL_UNWATCHED = 60    # 他に閲覧者がいない場合
+    REPORT_INTERVAL_MIN = 1
+    REPORT_INTERVAL_MAX = 120
+    PING_INTERVAL = 60
+    PING_INTERVAL_BACKGROUND = 20
+    PING_INTERVAL_MAX = 90
+    PING_INTERVAL_BACKGROUND_MAX = 30
+    REPORT_SIZE_THRESHOLD = 5         # この人数を超えると間隔を広げる
+    REPORT_SIZE_STEP = 0.1            # 超過1人あたりの倍率増分
+    LOAD_TARGET_MESSAGES_PER_SECOND = 200  # これを超えると負荷に応じて間隔を広げる
+    LOAD_MAX_FACTOR = 4
+    # 参加者間距離
+    DISTANCE_MATRIX_CACHE_SIZE = 256  # キャッシュするセッション行列の上限
+    ETA_WALKING_SPEED_KMH = 4.8       # 到着予想時間の計算に使う最低速度
+    # チャット履歴
+    CHAT_HISTORY_HOURS = 24
+    CHAT_HISTORY_PAGE_SIZE = 50       # 1ページ（1会話あたり）のメッセージ数
+    CHAT_HISTORY_MAX_PAGE_SIZE = 100
+    CHAT_CACHE_MESSAGES = 200         # 会話ごとに保持する最近のメッセージ数（最大ページサイズ以上）
+    CHAT_CACHE_SESSIONS = 256         # 最近のチャットを保持するセッション数の上限
+    CHAT_CACHE_TTL = 3600             # 作成からこの秒数でセッションのキャッシュを破棄（読み込みでは延長しない）
+    CHAT_WRITE_MAX_BATCH = 100        # まとめて保存するメッセージ数の上限
+    CHAT_WRITE_MAX_LATENCY = 0.2      # ブロードキャストから保存までの最大遅延（秒）
+    CHAT_ID_BLOCK_SIZE = 50           # 事前に確保するメッセージIDの数
+    # 入力中インジケーター
+    TYPING_TIMEOUT = 15               # この秒数通知がなければ入力終了とみなす
+    TYPING_REFRESH_INTERVAL = 10      # 入力中が続く場合の再通知間隔（秒）
+    TYPING_TICK = 0.5                 # 状態変化をまとめて送る間隔（秒）
     ALLOWED_MESSAGE_TYPES = [
         'join', 'location_update', 'name_update', 'background_status_update',
         'immediate_foreground_return',
@@ -38,22 +99,368 @@ class Config:
         'mark_as_read',
         'stay_reset',
         'stay_time_update',
-        'single_participant_update'  # ★ 追加
+        'single_participant_update',  # ★ 追加
+        'location_batch'
     ]
     ALLOWED_STATUSES = ['waiting', 'sharing', 'stopped']
     ALLOWED_NOTIFICATION_TYPES = ['info', 'success', 'warning', 'danger', 'secondary']
 
 
+# プロセス内で共有する参加者ごとの位置フィルター
+location_filter = LocationJitterFilter(
+    min_distance=Config.JITTER_MIN_DISTANCE,
+    accuracy_factor=Config.JITTER_ACCURACY_FACTOR,
+    max_accuracy=Config.JITTER_MAX_ACCURACY,
+    max_silence=Config.JITTER_MAX_SILENCE,
+    snap_distance=Config.JITTER_SNAP_DISTANCE,
+    process_noise=Config.JITTER_PROCESS_NOISE,
+    presence_touch_interval=Config.JITTER_PRESENCE_TOUCH_INTERVAL,
+    enabled=Config.JITTER_FILTER_ENABLED,
+)
+
+# 推奨送信間隔の計算（ワーカー負荷はプロセス単位で計測）
+reporting_rate = ReportingRateController(
+    moving_interval=Config.REPORT_INTERVAL_MOVING,
+    stationary_interval=Config.REPORT_INTERVAL_STATIONARY,
+    background_interval=Config.REPORT_INTERVAL_BACKGROUND,
+    unwatched_interval=Config.REPORT_INTERVAL_UNWATCHED,
+    min_interval=Config.REPORT_INTERVAL_MIN,
+    max_interval=Config.REPORT_INTERVAL_MAX,
+    ping_interval=Config.PING_INTERVAL,
+    background_ping_interval=Config.PING_INTERVAL_BACKGROUND,
+    max_ping_interval=Config.PING_INTERVAL_MAX,
+    max_background_ping_interval=Config.PING_INTERVAL_BACKGROUND_MAX,
+    size_threshold=Config.REPORT_SIZE_THRESHOLD,
+    size_step=Config.REPORT_SIZE_STEP,
+    target_messages_per_second=Config.LOAD_TARGET_MESSAGES_PER_SECOND,
+    max_load_factor=Config.LOAD_MAX_FACTOR,
+)
+
+# 名簿バージョンごとの参加者間距離行列（ブロードキャスト1回につき1度だけ計算）
+distance_matrix = DistanceMatrixCache(
+    max_entries=Config.DISTANCE_MATRIX_CACHE_SIZE,
+    walking_speed_kmh=Config.ETA_WALKING_SPEED_KMH,
+)
+
+# セッションごとの最近のチャット（最新ページの履歴要求はDBに問い合わせない）
+chat_cache = RecentChatCache(
+    max_messages=Config.CHAT_CACHE_MESSAGES,
+    max_sessions=Config.CHAT_CACHE_SESSIONS,
+    ttl=Config.CHAT_CACHE_TTL,
+)
+
+
+def get_session_locations(session_id: str) -> List[Dict[str, Any]]:
+    """全位置情報取得（速度情報含む）"""
+    try:
+        session = LocationSession.objects.get(session_id=session_id)
+        
+        locations = LocationData.objects.filter(
+            session=session,
+            is_active=True
+        ).order_by('-last_updated')
+
+        result = []
+        for loc in locations:
+            has_location = (loc.latitude is not None and 
+                        loc.longitude is not None and 
+                        loc.latitude != 999.0 and 
+                        loc.longitude != 999.0)
+            
+            should_display = (
+                getattr(loc, 'has_shared_before', False) or
+                loc.is_online or
+                loc.status == 'waiting'
+            )
+            
+            if should_display:
+                # サーバー側で滞在時間を計算
+                stay_minutes = 0
+                
+                if loc.stay_start_time and loc.is_online and loc.status == 'sharing':
+                    elapsed = (timezone.now() - loc.stay_start_time).total_seconds() / 60
+                    stay_minutes = int(elapsed)
+                elif loc.total_stay_minutes:
+                    stay_minutes = loc.total_stay_minutes
+                
+                location_data = {
+                    'participant_id': loc.participant_id,
+                    'participant_name': escape(loc.participant_name or f'参加者{loc.participant_id[:4]}'),
+                    'latitude': float(loc.latitude) if has_location else None,
+                    'longitude': float(loc.longitude) if has_location else None,
+                    'accuracy': float(loc.accuracy) if (has_location and loc.accuracy) else None,
+                    'last_updated': loc.last_updated.isoformat(),
+                    'last_seen_at': loc.last_seen_at.isoformat() if getattr(loc, 'last_seen_at', None) else None,
+                    'is_background': loc.is_background,
+                    'is_online': loc.is_online,
+                    'is_mobile': getattr(loc, 'is_mobile', False),
+                    'status': loc.status,
+                    'has_shared_before': getattr(loc, 'has_shared_before', False),
+                    'stay_minutes': stay_minutes,
+                    # ★ 追加：速度情報
+                    'current_speed': getattr(loc, 'current_speed', 0),
+                    'is_moving': getattr(loc, 'is_moving', False),
+                }
+                result.append(location_data)
+
+        return result
+
+    except Exception as e:
+        logger.error(f"Location fetch error: {str(e)}")
+        return []
+
+
+def get_participant_data(session_id: str, participant_id: str) -> Optional[Dict[str, Any]]:
+    """特定参加者のデータのみを取得"""
+    try:
+        session = LocationSession.objects.get(session_id=session_id)
+        loc = LocationData.objects.filter(
+            session=session,
+            participant_id=participant_id,
+            is_active=True
+        ).first()
+        
+        if not loc:
+            return None
+        
+        has_location = (loc.latitude is not None and 
+                    loc.longitude is not None and 
+                    loc.latitude != 999.0 and 
+                    loc.longitude != 999.0)
+        
+        # サーバー側で滞在時間を計算
+        stay_minutes = 0
+        if loc.stay_start_time and loc.is_online and loc.status == 'sharing':
+            elapsed = (timezone.now() - loc.stay_start_time).total_seconds() / 60
+            stay_minutes = int(elapsed)
+        elif loc.total_stay_minutes:
+            stay_minutes = loc.total_stay_minutes
+        
+        return {
+            'participant_id': loc.participant_id,
+            'participant_name': escape(loc.participant_name or f'参加者{loc.participant_id[:4]}'),
+            'latitude': float(loc.latitude) if has_location else None,
+            'longitude': float(loc.longitude) if has_location else None,
+            'accuracy': float(loc.accuracy) if (has_location and loc.accuracy) else None,
+            'last_updated': loc.last_updated.isoformat(),
+            'last_seen_at': loc.last_seen_at.isoformat() if getattr(loc, 'last_seen_at', None) else None,
+            'is_background': loc.is_background,
+            'is_online': loc.is_online,
+            'is_mobile': getattr(loc, 'is_mobile', False),
+            'status': loc.status,
+            'has_shared_before': getattr(loc, 'has_shared_before', False),
+            'stay_minutes': stay_minutes,
+        }
+        
+    except Exception as e:
+        logger.error(f"Get single participant data error: {str(e)}")
+        return None
+
+
+async def broadcast_participant(session_id: str, participant_id: str):
+    """特定参加者の最新データのみをブロードキャスト"""
+    participant_data = await database_sync_to_async(get_participant_data)(session_id, participant_id)
+    etag, _ = roster_versions.bump(session_id)
+    if participant_data:
+        await get_channel_layer().group_send(
+            f'location_{session_id}',
+            {
+                'type': 'single_participant_broadcast',
+                'participant_id': participant_id,
+                'participant_data': participant_data,
+                'roster_etag': etag
+            }
+        )
+
+
+def _unread_cursor_filter(message: ChatMessage) -> Q:
+    """メッセージをまだ既読にしていない既読カーソル（(時刻, ID) の順で比較）"""
+    return (
+        Q(last_read_at__isnull=True) |
+        Q(last_read_at__lt=message.timestamp) |
+        Q(last_read_at=message.timestamp, last_read_message_id__lt=message.id)
+    )
+
+
+def _unread_increment(messages: List[ChatMessage], exclude_sender: bool):
+    """既読カーソルごとの未読の増分（バッチ内でカーソルより新しいメッセージ数）"""
+    increment = F('unread_count')
+    for message in messages:
+        condition = _unread_cursor_filter(message)
+        if exclude_sender:
+            condition &= ~Q(participant_id=message.sender_id)
+        increment = increment + Case(When(condition, then=Value(1)), default=Value(0))
+    return increment
+
+
+def persist_chat_messages(messages: List[ChatMessage]):
+    """ブロードキャスト済みのチャットメッセージをまとめて保存し、受信者の未読数に加算"""
+    group_messages: Dict[int, List[ChatMessage]] = {}
+    individual_messages: Dict[tuple, List[ChatMessage]] = {}
+    for message in messages:
+        if message.chat_type == 'group':
+            group_messages.setdefault(message.session_id, []).append(message)
+        elif message.target_id and message.target_id != message.sender_id:
+            key = (message.session_id, message.target_id, message.sender_id)
+            individual_messages.setdefault(key, []).append(message)
+
+    with transaction.atomic():
+        ChatMessage.objects.bulk_create(messages)
+
+        # 保存前に既読になったメッセージ（カーソルより古いもの）は加算しない
+        for session_pk, batch in group_messages.items():
+            ChatReadCursor.objects.filter(
+                session_id=session_pk,
+                conversation='group'
+            ).update(unread_count=_unread_increment(batch, exclude_sender=True))
+
+        for (session_pk, target_id, sender_id), batch in individual_messages.items():
+            ChatReadCursor.objects.get_or_create(
+                session_id=session_pk,
+                participant_id=target_id,
+                conversation=sender_id
+            )
+            ChatReadCursor.objects.filter(
+                session_id=session_pk,
+                participant_id=target_id,
+                conversation=sender_id
+            ).update(unread_count=_unread_increment(batch, exclude_sender=False))
+
+
+# チャットは保存前にIDを付けてブロードキャストし、保存はまとめて行う
+# （シーケンスのないDBでは保存してからブロードキャスト）
+chat_id_allocator = ChatIdAllocator(ChatMessage, block_size=Config.CHAT_ID_BLOCK_SIZE)
+chat_writer = ChatWriteBuffer(
+    persist_chat_messages,
+    max_batch=Config.CHAT_WRITE_MAX_BATCH,
+    max_latency=Config.CHAT_WRITE_MAX_LATENCY,
+)
+
+
+def discard_session_caches(session_id: str):
+    """期限切れ・削除されたセッションのプロセス内キャッシュを破棄"""
+    location_filter.discard_session(session_id)
+    distance_matrix.discard_session(session_id)
+    chat_cache.discard_session(session_id)
+
+
+def count_session_expired(session_id: str):
+    """期限切れを統計に反映（接続のある全プロセスで呼ばれるため1回だけ）"""
+    if not live_stats.claim(f'expired:{session_id}'):
+        return
+    online = LocationData.objects.filter(
+        session__session_id=session_id,
+        is_active=True,
+        is_online=True
+    ).count()
+    live_stats.add('active_sessions_count', -1)
+    live_stats.add('online_participants_count', -online)
+
+
+async def expire_session(session_id: str):
+    """期限切れのセッションの全接続に通知し、プロセス内の状態を解放"""
+    discard_session_caches(session_id)
+    try:
+        await database_sync_to_async(count_session_expired)(session_id)
+    except Exception as e:
+        logger.error(f"Session expiry stats error: {str(e)}")
+    await get_channel_layer().group_send(
+        f'location_{session_id}',
+        {'type': 'session_expired_broadcast'}
+    )
+
+
+# WebSocketメッセージのレート制限（再接続直後の送信に備え、1分あたりの上限の半分まで連続で許可）
+PARTICIPANT_MESSAGE_LIMIT = Limit(Config.MAX_MESSAGES_PER_MINUTE, Config.MAX_MESSAGES_PER_MINUTE // 2)
+SESSION_MESSAGE_LIMIT = Limit(Config.MAX_SESSION_MESSAGES_PER_MINUTE, Config.MAX_SESSION_MESSAGES_PER_MINUTE // 2)
+
+# 接続中のセッションごとに期限切れ時刻のタイマーを設定
+session_expiry = SessionExpiryScheduler(expire_session)
+
+
+def sweep_stale_participants() -> List[str]:
+    """オフライン期限を過ぎた参加者・応答のない参加者を1回のUPDATEでオフライン化（未共有参加者は除外）"""
+    now = timezone.now()
+    stale = LocationData.objects.filter(
+        is_online=True,
+        is_active=True
+    ).exclude(
+        status='waiting'
+    ).filter(
+        # 切断時に記録した期限を過ぎた
+        Q(offline_after__lte=now) |
+        # 切断処理を経ずに途絶えた（猶予はモバイル／デスクトップ別）
+        Q(offline_after__isnull=True, is_mobile=True,
+          last_seen_at__lt=now - timedelta(seconds=Config.MOBILE_OFFLINE_DELAY)) |
+        Q(offline_after__isnull=True, is_mobile=False,
+          last_seen_at__lt=now - timedelta(seconds=Config.DESKTOP_OFFLINE_DELAY))
+    )
+
+    session_ids = [str(sid) for sid in stale.order_by().values_list('session__session_id', flat=True).distinct()]
+    if not session_ids:
+        return []
+
+    # 名前・位置情報は保持したままオフライン化
+    updated = stale.update(
+        is_online=False,
+        status='stopped',
+        offline_after=None,
+        last_updated=now,
+        last_seen_at=now
+    )
+    live_stats.add('online_participants_count', -updated)
+    logger.info(f"プレゼンス・スイープ: {updated}人をオフライン化（{len(session_ids)}セッション）")
+    return session_ids
+
+
+async def broadcast_session_locations(session_id: str):
+    """セッションの名簿をまとめて1回ブロードキャスト"""
+    locations = await database_sync_to_async(get_session_locations)(session_id)
+    etag, _ = roster_versions.bump(session_id)
+    await get_channel_layer().group_send(
+        f'location_{session_id}',
+        {
+            'type': 'location_broadcast',
+            'locations': locations,
+            'roster_version': roster_version(locations),
+            'roster_etag': etag
+        }
+    )
+
+
+# 切断ごとのスレッドの代わりに、定期的にまとめてオフライン化
+presence_sweeper = PresenceSweeper(
+    sweep_stale_participants,
+    broadcast_session_locations,
+    interval=Config.PRESENCE_SWEEP_INTERVAL,
+)
+
 class LocationConsumer(AsyncWebsocketConsumer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.session_id: Optional[str] = None
         self.room_group_name: Optional[str] = None
+        self.participant_group_name: Optional[str] = None  # 個別チャット・入力中表示の宛先
         self.participant_id: Optional[str] = None
+        self.session_pk: Optional[int] = None
+        self.session_expires_at: Optional[datetime] = None
+        self.session_expired: bool = False
         self.client_ip: Optional[str] = None
         self.is_mobile: bool = False
-        self.message_count: int = 0
-        self.last_message_time = timezone.now()
+        self.connection_slot: bool = False  # セッションの同時接続枠を確保済みか
+        # 推奨送信間隔の計算用（最新のping・名簿から更新）
+        self.is_moving: bool = False
+        self.current_speed: float = 0
+        self.is_background: bool = False
+        self.roster_size: int = 0
+        self.viewer_count: int = 0
+        # 入力中状態（状態変化のみブロードキャスト）
+        self.typing_state = TypingStateMachine(
+            timeout=Config.TYPING_TIMEOUT,
+            refresh_interval=Config.TYPING_REFRESH_INTERVAL,
+        )
+        self.typing_task: Optional[asyncio.Task] = None
+        self.background_tasks: Set[asyncio.Task] = set()  # 送信確認など、切断時に取り消すタスク
 
     async def connect(self):
         """WebSocket接続処理"""
@@ -68,7 +475,13 @@ class LocationConsumer(AsyncWebsocketConsumer):
                 await self.close(code=4000)
                 return
 
-            if not await self._check_session_exists():
+            # 共有ページが発行したトークンがあればDBを参照せずに受け付ける
+            identity = self._verify_socket_token()
+            if identity:
+                self.session_pk = identity.session_pk
+                self.session_expires_at = identity.expires_at
+                self.participant_id = identity.participant_id
+            elif not await self._load_session():
                 logger.warning(f"Session not found: {self.session_id}")
                 await self.close(code=4404)
                 return
@@ -78,15 +491,22 @@ class LocationConsumer(AsyncWebsocketConsumer):
                 await self.close(code=4429)
                 return
 
-            # 既存参加者チェック
-            existing_participant = await self._get_participant_by_ip()
-            if existing_participant:
-                self.participant_id = existing_participant['participant_id']
+            # 既存参加者チェック（トークンのない旧ページからの接続のみ）
+            if not identity:
+                existing_participant = await self._get_participant_by_ip()
+                if existing_participant:
+                    self.participant_id = existing_participant['participant_id']
 
             # グループ参加
             await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+            await self._join_participant_group()
             await self.accept()
             
+            # 期限切れはタイマーで全接続にプッシュ（期限切れ済みなら即時）
+            session_expiry.watch(self.session_id, self.session_expires_at)
+            presence_sweeper.ensure_started()
+            self._log_connection('websocket_connected')
+            
             logger.info(f"WebSocket connected: {self.session_id} from {self.client_ip}")
 
         except Exception as e:
@@ -95,7 +515,15 @@ class LocationConsumer(AsyncWebsocketConsumer):
 
     async def disconnect(self, close_code):
         """WebSocket切断処理（退出時の完全削除対応版）"""
-        if self.participant_id:
+        await self._stop_typing_loop()
+        self._cancel_background_tasks()
+        await self._release_connection_slot()
+        if self.session_expires_at:
+            session_expiry.unwatch(self.session_id)
+            self._log_connection('websocket_disconnected', additional_data={'close_code': close_code})
+
+        # 期限切れで閉じた場合は参加者の状態更新は不要
+        if self.participant_id and not self.session_expired:
             try:
                 # 退出処理の場合は参加者を完全削除
                 if close_code == 1000 and hasattr(self, '_is_leaving') and self._is_leaving:
@@ -106,6 +534,7 @@ class LocationConsumer(AsyncWebsocketConsumer):
                     # グループ退出
                     if self.room_group_name:
                         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+                    await self._leave_participant_group()
                     return
                 
                 # 現在の参加者情報を取得して名前を保持
@@ -149,6 +578,49 @@ class LocationConsumer(AsyncWebsocketConsumer):
         # グループ退出
         if self.room_group_name:
             await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        await self._leave_participant_group()
+
+    def _log_connection(self, action: str, **fields):
+        """接続ログをキューに積む（保存はバックグラウンドでまとめて行う）"""
+        headers = dict(self.scope.get('headers', []))
+        session_log.log(
+            self.session_pk,
+            action,
+            participant_id=self.participant_id or '',
+            ip_address=self.client_ip,
+            user_agent=headers.get(b'user-agent', b'').decode('utf-8', 'ignore')[:500],
+            connection_id=self.channel_name,
+            **fields
+        )
+
+    def _participant_group(self, participant_id: str) -> str:
+        """参加者ごとのグループ名"""
+        return f'participant_{self.session_id}_{participant_id}'
+
+    async def _join_participant_group(self):
+        """現在の参加者IDのグループに参加（IDが変わった場合は付け替え）"""
+        if not self.participant_id:
+            return
+        group_name = self._participant_group(self.participant_id)
+        if group_name == self.participant_group_name:
+            return
+        await self._leave_participant_group()
+        await self.channel_layer.group_add(group_name, self.channel_name)
+        self.participant_group_name = group_name
+
+    async def _leave_participant_group(self):
+        """参加者グループから退出"""
+        if self.participant_group_name:
+            await self.channel_layer.group_discard(self.participant_group_name, self.channel_name)
+            self.participant_group_name = None
+
+    async def _send_to_conversation(self, chat_type: str, sender_id: str, target_id: Optional[str], event: Dict[str, Any]):
+        """グループチャットはセッション全体、個別チャットは送信者と宛先の接続のみに配信"""
+        if chat_type == 'individual' and target_id:
+            for participant_id in {sender_id, target_id}:
+                await self.channel_layer.group_send(self._participant_group(participant_id), event)
+        else:
+            await self.channel_layer.group_send(self.room_group_name, event)
 
     # === ：現在の参加者情報取得メソッド ===
     @database_sync_to_async
@@ -187,6 +659,8 @@ class LocationConsumer(AsyncWebsocketConsumer):
             await self.close(code=4429)
             return
 
+        reporting_rate.load_monitor.record()
+
         try:
             data = json.loads(text_data)
             message_type = data.get('type')
@@ -228,6 +702,7 @@ class LocationConsumer(AsyncWebsocketConsumer):
             'stay_reset': self._handle_stay_reset,
             'stay_time_update': self._handle_stay_time_update,
             'single_participant_update': self._handle_single_participant_update,  # ★ 追加
+            'location_batch': self._handle_location_batch,
         }
 
         handler = handlers.get(message_type)
@@ -242,18 +717,26 @@ class LocationConsumer(AsyncWebsocketConsumer):
             latitude, longitude = self._validate_coordinates(data.get('latitude'), data.get('longitude'))
             accuracy = self._validate_accuracy(data.get('accuracy'))
             
-            if not await self._check_session_valid():
+            if not self._is_session_active():
                 await self.send_json({'type': 'session_expired', 'message': 'Session has expired'})
                 return
             
+            is_background = bool(data.get('is_background', False))
+            self.is_background = is_background
+            
+            # ジッター抑制：有意な変化がなければ保存・ブロードキャストしない
+            decision = await self._filter_location(participant_id, participant_name, latitude, longitude, accuracy, is_background)
+            if not decision.accept:
+                return
+            
             # 位置情報を保存
             location_data = await self._save_location_data({
                 'participant_id': participant_id,
                 'participant_name': participant_name,
-                'latitude': latitude,
-                'longitude': longitude,
+                'latitude': decision.latitude,
+                'longitude': decision.longitude,
                 'accuracy': accuracy,
-                'is_background': bool(data.get('is_background', False)),
+                'is_background': is_background,
                 'is_online': True,
                 'status': 'sharing',
                 'has_shared_before': True
@@ -268,65 +751,65 @@ class LocationConsumer(AsyncWebsocketConsumer):
     async def _broadcast_single_participant(self, participant_id: str):
         """特定参加者のみのデータをブロードキャスト"""
         try:
-            participant_data = await self._get_single_participant_data(participant_id)
-            if participant_data:
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'single_participant_broadcast',
-                        'participant_id': participant_id,
-                        'participant_data': participant_data
-                    }
-                )
+            await broadcast_participant(self.session_id, participant_id)
         except Exception as e:
             logger.error(f"Single participant broadcast error: {str(e)}")
 
     @database_sync_to_async
     def _get_single_participant_data(self, participant_id: str) -> Optional[Dict[str, Any]]:
         """特定参加者のデータのみを取得"""
+        return get_participant_data(self.session_id, participant_id)
+
+    async def _handle_location_batch(self, data: Dict[str, Any]):
+        """バックグラウンドでたまった位置情報の一括反映（最新位置のみブロードキャスト）"""
+        try:
+            participant_id = self._validate_participant_id(data.get('participant_id'))
+            participant_name = self._sanitize_participant_name(data.get('participant_name', ''))
+            fixes = parse_fixes(data.get('fixes'), Config.LOCATION_BATCH_MAX_FIXES)
+
+            if not self._is_session_active():
+                await self.send_json({'type': 'session_expired', 'message': 'Session has expired'})
+                return
+
+            is_background = bool(data.get('is_background', False))
+            self.is_background = is_background
+
+            if not await self._save_location_batch(participant_id, participant_name, fixes, is_background):
+                await self._send_error("位置情報の保存に失敗しました")
+                return
+
+            # 一括反映後の位置を基準にジッター判定をやり直す
+            location_filter.reset(self.session_id, participant_id)
+            await self._broadcast_single_participant(participant_id)
+            await self.send_json({
+                'type': 'location_batch_saved',
+                'count': len(fixes),
+                'last_timestamp': fixes[-1].recorded_at.isoformat()
+            })
+
+        except ValidationError as e:
+            await self._send_error(str(e))
+
+    @database_sync_to_async
+    def _save_location_batch(self, participant_id: str, participant_name: str, fixes, is_background: bool) -> bool:
+        """測位を時刻順に反映して1トランザクションで保存"""
         try:
             session = LocationSession.objects.get(session_id=self.session_id)
-            loc = LocationData.objects.filter(
-                session=session,
-                participant_id=participant_id,
-                is_active=True
-            ).first()
-            
-            if not loc:
-                return None
-            
-            has_location = (loc.latitude is not None and 
-                        loc.longitude is not None and 
-                        loc.latitude != 999.0 and 
-                        loc.longitude != 999.0)
-            
-            # サーバー側で滞在時間を計算
-            stay_minutes = 0
-            if loc.stay_start_time and loc.is_online and loc.status == 'sharing':
-                elapsed = (timezone.now() - loc.stay_start_time).total_seconds() / 60
-                stay_minutes = int(elapsed)
-            elif loc.total_stay_minutes:
-                stay_minutes = loc.total_stay_minutes
-            
-            return {
-                'participant_id': loc.participant_id,
-                'participant_name': escape(loc.participant_name or f'参加者{loc.participant_id[:4]}'),
-                'latitude': float(loc.latitude) if has_location else None,
-                'longitude': float(loc.longitude) if has_location else None,
-                'accuracy': float(loc.accuracy) if (has_location and loc.accuracy) else None,
-                'last_updated': loc.last_updated.isoformat(),
-                'last_seen_at': loc.last_seen_at.isoformat() if getattr(loc, 'last_seen_at', None) else None,
-                'is_background': loc.is_background,
-                'is_online': loc.is_online,
-                'is_mobile': getattr(loc, 'is_mobile', False),
-                'status': loc.status,
-                'has_shared_before': getattr(loc, 'has_shared_before', False),
-                'stay_minutes': stay_minutes,
+            defaults = {
+                'is_background': is_background,
+                'is_mobile': self.is_mobile,
+                'ip_address': self.client_ip,
             }
-            
+            if participant_name:
+                defaults['participant_name'] = participant_name
+            apply_location_fixes(
+                session, participant_id, fixes, defaults,
+                stay_radius=Config.STAY_DISTANCE_THRESHOLD
+            )
+            return True
         except Exception as e:
-            logger.error(f"Get single participant data error: {str(e)}")
-            return None
+            logger.error(f"Location batch save error: {str(e)}")
+            return False
 
     # グループメッセージハンドラーを追加
     async def single_participant_broadcast(self, event):
@@ -334,7 +817,8 @@ class LocationConsumer(AsyncWebsocketConsumer):
         await self.send_json({
             'type': 'single_participant_update',
             'participant_id': event['participant_id'],
-            'participant_data': event['participant_data']
+            'participant_data': event['participant_data'],
+            'roster_etag': event.get('roster_etag')
         })
 
 
@@ -368,25 +852,77 @@ class LocationConsumer(AsyncWebsocketConsumer):
 
     # _handle_chat_history_requestメソッドを修正
     async def _handle_chat_history_request(self, data: Dict[str, Any]):
-        """チャット履歴要求処理（未読カウント付き）"""
+        """チャット履歴要求処理（最新Nページ＋スクロール時の過去ページ）"""
         try:
-            session_id = data.get('session_id')
             participant_id = self._validate_participant_id(data.get('participant_id'))
+            limit = self._validate_page_size(data.get('limit'))
+            
+            # 過去ページ要求（会話とカーソル指定）
+            if data.get('before'):
+                before = self._parse_history_cursor(data.get('before'))
+                conversation = data.get('conversation', 'group')
+                if conversation != 'group':
+                    conversation = self._validate_participant_id(conversation)
+                
+                page = await self._get_chat_history_page(participant_id, conversation, before, limit)
+                await self.send_json({
+                    'type': 'chat_history_page',
+                    'conversation': conversation,
+                    **page
+                })
+                return
             
-            # 履歴を取得
-            history = await self._get_chat_history(session_id, participant_id)
+            # 最新ページを取得
+            history, cursors = await self._get_chat_history(participant_id, limit)
             # 未読カウントを取得（participant_id を渡す）
-            unread_counts = await self._get_unread_counts(session_id, participant_id)
+            unread_counts = await self._get_unread_counts(self.session_id, participant_id)
             
             await self.send_json({
                 'type': 'chat_history',
                 'messages': history,
+                'cursors': cursors,
                 'unread_counts': unread_counts
             })
             
+        except ValidationError as e:
+            await self._send_error(str(e))
         except Exception as e:
             logger.error(f"Chat history request error: {str(e)}")
 
+    def _validate_page_size(self, limit) -> int:
+        """履歴ページサイズ検証"""
+        try:
+            limit = int(limit) if limit is not None else Config.CHAT_HISTORY_PAGE_SIZE
+        except (ValueError, TypeError):
+            return Config.CHAT_HISTORY_PAGE_SIZE
+        return max(1, min(limit, Config.CHAT_HISTORY_MAX_PAGE_SIZE))
+
+    def _parse_history_cursor(self, cursor: str) -> tuple:
+        """履歴カーソル（"タイムスタンプ|ID"）を解析"""
+        try:
+            timestamp, message_id = str(cursor).rsplit('|', 1)
+            return datetime.fromisoformat(timestamp), int(message_id)
+        except (ValueError, TypeError):
+            raise ValidationError('無効な履歴カーソルです')
+
+    def _make_history_cursor(self, message) -> str:
+        """メッセージから履歴カーソルを生成"""
+        return f"{message.timestamp.isoformat()}|{message.id}"
+
+    def _serialize_chat_message(self, msg, participant_id: str, read_position: Optional[tuple] = None) -> Dict[str, Any]:
+        """チャットメッセージを送信用に変換（既読は参加者の既読カーソルで判定）"""
+        return {
+            'id': msg.id,
+            'sender_id': msg.sender_id,
+            'sender_name': msg.sender_name,
+            'text': msg.text,
+            'timestamp': msg.timestamp.isoformat(),
+            'target_id': msg.target_id,
+            # 自分が送信したメッセージは常に既読として扱う
+            'is_read': msg.sender_id == participant_id or (
+                read_position is not None and (msg.timestamp, msg.id) <= read_position
+            )
+        }
 
     @database_sync_to_async
     def _reset_stay_time(self, participant_id: str):
@@ -428,110 +964,232 @@ class LocationConsumer(AsyncWebsocketConsumer):
             participant_id = self._validate_participant_id(data.get('participant_id'))
             chat_type = data.get('chat_type', 'group')
             sender_id = data.get('sender_id')  # 個別チャットの送信者
+            last_message_id = data.get('last_message_id')
+            last_message_at = data.get('last_message_at')  # 最後に読んだメッセージのサーバー時刻
+            
+            try:
+                last_message_id = int(last_message_id) if last_message_id is not None else None
+            except (ValueError, TypeError):
+                last_message_id = None
+            
+            try:
+                last_message_at = datetime.fromisoformat(str(last_message_at)) if last_message_at else None
+                if last_message_at is not None and timezone.is_naive(last_message_at):
+                    last_message_at = None
+            except ValueError:
+                last_message_at = None
             
             # デバッグログ
             logger.info(f"Mark as read request: participant={participant_id}, type={chat_type}, sender={sender_id}")
             
-            await self._mark_messages_as_read(participant_id, chat_type, sender_id)
+            await self._mark_messages_as_read(participant_id, chat_type, sender_id, last_message_id, last_message_at)
             
         except Exception as e:
             logger.error(f"Mark as read error: {str(e)}")
 
+    def _incoming_messages(self, session, participant_id: str, conversation: str):
+        """会話内で参加者が受信したメッセージ"""
+        messages = ChatMessage.objects.filter(session=session)
+        if conversation == 'group':
+            return messages.filter(chat_type='group').exclude(sender_id=participant_id)
+        return messages.filter(chat_type='individual', sender_id=conversation, target_id=participant_id)
+
     @database_sync_to_async
-    def _mark_messages_as_read(self, participant_id: str, chat_type: str, sender_id: str = None):
-        """メッセージを既読にマーク（改善版）"""
+    def _mark_messages_as_read(self, participant_id: str, chat_type: str, sender_id: str = None,
+                               last_message_id: Optional[int] = None, last_message_at: Optional[datetime] = None):
+        """既読カーソルを進める（メッセージ行は更新せず、カーソル1行のみ書き込み）
+
+        既読位置は (時刻, ID) の組。クライアントが時刻を送らない場合はDBから求める。
+        """
         try:
+            conversation = 'group' if chat_type == 'group' else sender_id
+            if not conversation:
+                return False
+            
             session = LocationSession.objects.get(session_id=self.session_id)
+            incoming = self._incoming_messages(session, participant_id, conversation)
             
-            if chat_type == 'group':
-                # 自分以外が送信したグループメッセージを既読に
-                updated = ChatMessage.objects.filter(
-                    session=session,
-                    chat_type='group',
-                    is_read=False
-                ).exclude(sender_id=participant_id).update(
-                    is_read=True
-                )
-                
-                logger.info(f"Marked {updated} group messages as read for {participant_id}")
-                
-            elif chat_type == 'individual' and sender_id:
-                # 特定の人からの個別メッセージを既読に
-                updated = ChatMessage.objects.filter(
+            if last_message_at is not None:
+                position = (min(last_message_at, timezone.now()), last_message_id or 0)
+            else:
+                if last_message_id is not None:
+                    incoming = incoming.filter(id=last_message_id)
+                position = incoming.order_by('-timestamp', '-id').values_list('timestamp', 'id').first()
+            
+            with transaction.atomic():
+                cursor, _ = ChatReadCursor.objects.select_for_update().get_or_create(
                     session=session,
-                    chat_type='individual',
-                    sender_id=sender_id,
-                    target_id=participant_id,
-                    is_read=False
-                ).update(
-                    is_read=True
+                    participant_id=participant_id,
+                    conversation=conversation
                 )
-                
-                logger.info(f"Marked {updated} individual messages as read from {sender_id} to {participant_id}")
+                if position and (cursor.last_read_at is None or
+                                 position > (cursor.last_read_at, cursor.last_read_message_id)):
+                    cursor.last_read_at, cursor.last_read_message_id = position
+                cursor.unread_count = 0
+                cursor.save(update_fields=['last_read_at', 'last_read_message_id', 'unread_count', 'updated_at'])
             
+            logger.info(f"Read cursor updated: {participant_id} / {conversation} -> {cursor.last_read_at}|{cursor.last_read_message_id}")
             return True
             
         except Exception as e:
             logger.error(f"Database error in mark_as_read: {str(e)}")
             return False
 
+    def _get_read_cursors(self, session, participant_id: str) -> Dict[str, tuple]:
+        """参加者の会話ごとの既読位置 (時刻, メッセージID)"""
+        return {
+            conversation: (last_read_at, last_read_message_id)
+            for conversation, last_read_at, last_read_message_id in ChatReadCursor.objects.filter(
+                session=session,
+                participant_id=participant_id,
+                last_read_at__isnull=False
+            ).values_list('conversation', 'last_read_at', 'last_read_message_id')
+        }
+
     @database_sync_to_async
-    def _get_chat_history(self, session_id: str, participant_id: str) -> Dict[str, Any]:
-        """チャット履歴を取得（修正版）"""
+    def _get_chat_history(self, participant_id: str, limit: int):
+        """チャット履歴の最新ページを取得（グループ＋会話ごとの個別メッセージ）
+
+        最近のメッセージはプロセス内キャッシュから返し、DBはセッション・参加者ごとの
+        初回読み込みにのみ使う。
+        """
+        result = {'group': [], 'individual': {}}
+        cursors = {'group': None, 'individual': {}}
         try:
-            from datetime import timedelta
-            cutoff_time = timezone.now() - timedelta(hours=24)
+            cutoff_time = timezone.now() - timedelta(hours=Config.CHAT_HISTORY_HOURS)
+            session = LocationSession.objects.get(session_id=self.session_id)
+            read_cursors = self._get_read_cursors(session, participant_id)
+            
+            group = chat_cache.group(self.session_id)
+            if group is None:
+                group = chat_cache.prime_group(self.session_id, *self._load_recent_group(session, cutoff_time))
+            
+            page, cursors['group'] = self._latest_history_page(*group, cutoff_time, limit)
+            result['group'] = [
+                self._serialize_chat_message(msg, participant_id, read_cursors.get('group'))
+                for msg in page
+            ]
+            
+            conversations = chat_cache.conversations(self.session_id, participant_id)
+            if conversations is None:
+                conversations = chat_cache.prime_participant(
+                    self.session_id, participant_id,
+                    self._load_recent_conversations(session, participant_id, cutoff_time)
+                )
             
-            session = LocationSession.objects.get(session_id=session_id)
-            messages = ChatMessage.objects.filter(
+            for conversation, (messages, complete) in conversations.items():
+                page, cursor = self._latest_history_page(messages, complete, cutoff_time, limit)
+                if not page:
+                    continue
+                if cursor:
+                    cursors['individual'][conversation] = cursor
+                result['individual'][conversation] = [
+                    self._serialize_chat_message(msg, participant_id, read_cursors.get(conversation))
+                    for msg in page
+                ]
+            
+            return result, cursors
+            
+        except Exception as e:
+            logger.error(f"Get chat history error: {str(e)}")
+            return result, cursors
+
+    def _latest_history_page(self, messages: List[CachedMessage], complete: bool,
+                             cutoff_time: datetime, limit: int) -> tuple:
+        """キャッシュ済みメッセージ（古い順）から最新ページと次のカーソルを取り出す"""
+        recent = [msg for msg in messages if msg.timestamp >= cutoff_time]
+        page = recent[-limit:]
+        # キャッシュより古いメッセージがある可能性があれば、続きはDBから取得させる
+        has_more = len(recent) > limit or (not complete and len(recent) == len(messages))
+        cursor = self._make_history_cursor(page[0]) if has_more and page else None
+        return page, cursor
+
+    def _load_recent_group(self, session, cutoff_time: datetime) -> tuple:
+        """グループチャットの最近のメッセージをDBから読み込み（古い順, 全件か）"""
+        rows = list(
+            ChatMessage.objects.filter(
                 session=session,
+                chat_type='group',
                 timestamp__gte=cutoff_time
-            ).order_by('timestamp')
+            ).order_by('-timestamp', '-id')[:Config.CHAT_CACHE_MESSAGES]
+        )
+        messages = [CachedMessage.from_model(msg) for msg in reversed(rows)]
+        return messages, len(rows) < Config.CHAT_CACHE_MESSAGES
+
+    def _load_recent_conversations(self, session, participant_id: str, cutoff_time: datetime) -> Dict[str, tuple]:
+        """参加者の個別チャットを会話ごとに最近の分だけDBから読み込み"""
+        # 自分が関係するメッセージのみをSQLで抽出し、会話ごとに最新N件
+        conversation_key = Case(
+            When(sender_id=participant_id, then=F('target_id')),
+            default=F('sender_id'),
+            output_field=CharField()
+        )
+        individual_messages = ChatMessage.objects.filter(
+            Q(sender_id=participant_id) | Q(target_id=participant_id),
+            session=session,
+            timestamp__gte=cutoff_time,
+            chat_type='individual',
+            target_id__isnull=False
+        ).annotate(
+            conversation=conversation_key,
+            row_number=Window(
+                expression=RowNumber(),
+                partition_by=[conversation_key],
+                order_by=[F('timestamp').desc(), F('id').desc()]
+            )
+        ).filter(row_number__lte=Config.CHAT_CACHE_MESSAGES).order_by('conversation', 'timestamp', 'id')
+        
+        conversations: Dict[str, List[CachedMessage]] = {}
+        for msg in individual_messages:
+            if msg.conversation and msg.conversation != participant_id:
+                conversations.setdefault(msg.conversation, []).append(CachedMessage.from_model(msg))
+        
+        return {
+            conversation: (messages, len(messages) < Config.CHAT_CACHE_MESSAGES)
+            for conversation, messages in conversations.items()
+        }
+
+    @database_sync_to_async
+    def _get_chat_history_page(self, participant_id: str, conversation: str,
+                               before: tuple, limit: int) -> Dict[str, Any]:
+        """カーソルより古いチャット履歴を1ページ取得（キーセットページネーション）"""
+        try:
+            cutoff_time = timezone.now() - timedelta(hours=Config.CHAT_HISTORY_HOURS)
+            before_timestamp, before_id = before
+            session = LocationSession.objects.get(session_id=self.session_id)
+            read_position = self._get_read_cursors(session, participant_id).get(conversation)
             
-            result = {
-                'group': [],
-                'individual': {}
-            }
+            messages = ChatMessage.objects.filter(
+                session=session,
+                timestamp__gte=cutoff_time
+            ).filter(
+                Q(timestamp__lt=before_timestamp) | Q(timestamp=before_timestamp, id__lt=before_id)
+            )
             
-            for msg in messages:
-                # 自分が送信したメッセージは常に既読として扱う
-                is_read_for_current_user = (
-                    msg.is_read or 
-                    msg.sender_id == participant_id
+            if conversation == 'group':
+                messages = messages.filter(chat_type='group')
+            else:
+                messages = messages.filter(
+                    Q(sender_id=participant_id, target_id=conversation) |
+                    Q(sender_id=conversation, target_id=participant_id),
+                    chat_type='individual'
                 )
-                
-                message_data = {
-                    'sender_id': msg.sender_id,
-                    'sender_name': msg.sender_name,
-                    'text': msg.text,
-                    'timestamp': msg.timestamp.isoformat(),
-                    'target_id': msg.target_id,
-                    'is_read': is_read_for_current_user  # 修正
-                }
-                
-                if msg.chat_type == 'group':
-                    result['group'].append(message_data)
-                else:
-                    # 個別メッセージの整理
-                    if msg.target_id == participant_id:
-                        # 自分宛のメッセージ
-                        conversation_key = msg.sender_id
-                    elif msg.sender_id == participant_id:
-                        # 自分が送信したメッセージ
-                        conversation_key = msg.target_id
-                    else:
-                        continue  # 関係ないメッセージはスキップ
-                    
-                    if conversation_key and conversation_key != participant_id:
-                        if conversation_key not in result['individual']:
-                            result['individual'][conversation_key] = []
-                        result['individual'][conversation_key].append(message_data)
             
-            return result
+            page = list(messages.order_by('-timestamp', '-id')[:limit + 1])
+            next_cursor = None
+            if len(page) > limit:
+                page = page[:limit]
+                next_cursor = self._make_history_cursor(page[-1])
+            
+            return {
+                'messages': [self._serialize_chat_message(msg, participant_id, read_position) for msg in reversed(page)],
+                'next_cursor': next_cursor,
+                'has_more': next_cursor is not None
+            }
             
         except Exception as e:
-            logger.error(f"Get chat history error: {str(e)}")
-            return {'group': [], 'individual': {}}
+            logger.error(f"Get chat history page error: {str(e)}")
+            return {'messages': [], 'next_cursor': None, 'has_more': False}
     
     def _get_conversation_key(self, current_id: str, sender_id: str, target_id: str) -> str:
         """会話のキーを生成（修正版）"""
@@ -554,65 +1212,86 @@ class LocationConsumer(AsyncWebsocketConsumer):
                 sender_name = f'参加者{sender_id[:4]}'
             
             text = self._sanitize_message(data.get('text', ''))
-            timestamp = data.get('timestamp', timezone.now().isoformat())
+            target_id = self._validate_target_id(chat_type, data.get('target_id'))
+            client_message_id = str(data.get('client_message_id', ''))[:64] or None
             
             if not text:
                 await self._send_error("メッセージが空です")
                 return
             
-            # メッセージを保存（送信者自身のメッセージはis_read=Trueで保存）
-            message_id = await self._save_chat_message_with_read_status({
-                'session_id': self.session_id,
-                'chat_type': chat_type,
-                'sender_id': sender_id,
-                'sender_name': sender_name,
-                'target_id': data.get('target_id'),
-                'text': text,
-                'timestamp': timestamp,
-                'is_read': False  # デフォルトは未読
-            })
+            # 送信したら入力中は終了
+            self.typing_state.update(chat_type, sender_id, target_id, sender_name, False)
+            
+            # IDと時刻はサーバーで付与し、保存を待たずにブロードキャスト
+            message = ChatMessage(
+                session_id=await self._get_session_pk(),
+                chat_type=chat_type,
+                sender_id=sender_id,
+                sender_name=sender_name,
+                target_id=target_id,
+                text=text,
+                timestamp=timezone.now(),
+                is_read=False
+            )
+            if chat_id_allocator.supported:
+                message.id = await chat_id_allocator.allocate()
+            elif not await chat_writer.write_now(message):
+                await self._send_error("メッセージを保存できませんでした")
+                return
+            message_id = message.id
+            timestamp = message.timestamp.isoformat()
+            chat_cache.append(self.session_id, CachedMessage.from_model(message))
             
-            # ブロードキャスト
-            await self.channel_layer.group_send(
-                self.room_group_name,
+            # ブロードキャスト（個別チャットは送信者と宛先のみ）
+            await self._send_to_conversation(
+                chat_type, sender_id, target_id,
                 {
                     'type': 'chat_broadcast',
                     'chat_type': chat_type,
                     'sender_id': sender_id,
                     'sender_name': sender_name,
-                    'target_id': data.get('target_id'),
+                    'target_id': target_id,
                     'text': text,
-                    'timestamp': timestamp
+                    'timestamp': timestamp,
+                    'message_id': message_id
                 }
             )
             
+            # 保存はまとめて行い、完了したら送信者に通知
+            if chat_id_allocator.supported:
+                saved = await chat_writer.submit(message)
+            else:
+                saved = asyncio.get_running_loop().create_future()
+                saved.set_result(True)
+            self._start_background_task(
+                self._acknowledge_chat_message(saved, message_id, timestamp, client_message_id)
+            )
+            
         except ValidationError as e:
             await self._send_error(str(e))
 
-
-    @database_sync_to_async
-    def _save_chat_message_with_read_status(self, data: Dict[str, Any]):
-        """チャットメッセージを保存（既読状態付き）"""
+    async def _acknowledge_chat_message(self, saved: asyncio.Future, message_id: int,
+                                        timestamp: str, client_message_id: Optional[str]):
+        """チャットメッセージの保存結果を送信者に通知"""
         try:
-            session = LocationSession.objects.get(session_id=data['session_id'])
-            
-            message = ChatMessage.objects.create(
-                session=session,
-                chat_type=data['chat_type'],
-                sender_id=data['sender_id'],
-                sender_name=data['sender_name'],
-                target_id=data.get('target_id'),
-                text=data['text'],
-                timestamp=timezone.now(),
-                is_read=data.get('is_read', False)
-            )
-            
-            return message.id
-            
+            persisted = await asyncio.shield(saved)  # 取り消されても保存は続ける
+            await self.send_json({
+                'type': 'chat_message_saved',
+                'id': message_id,
+                'client_message_id': client_message_id,
+                'timestamp': timestamp,
+                'persisted': persisted
+            })
         except Exception as e:
-            logger.error(f"Chat message save error: {str(e)}")
-            return None
-    
+            logger.error(f"Chat acknowledge error: {str(e)}")
+
+    @database_sync_to_async
+    def _get_session_pk(self) -> int:
+        """セッションの主キー（接続ごとに1回だけ取得）"""
+        if self.session_pk is None:
+            self.session_pk = LocationSession.objects.values_list('pk', flat=True).get(session_id=self.session_id)
+        return self.session_pk
+
 
     async def _handle_typing_indicator(self, data: Dict[str, Any]):
         """入力中インジケーター処理"""
@@ -621,23 +1300,69 @@ class LocationConsumer(AsyncWebsocketConsumer):
             sender_id = self._validate_participant_id(data.get('sender_id'))
             sender_name = self._sanitize_participant_name(data.get('sender_name', ''))
             is_typing = bool(data.get('is_typing', False))
+            target_id = self._validate_target_id(chat_type, data.get('target_id'))
             
-            # ブロードキャスト
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'typing_broadcast',
-                    'chat_type': chat_type,
-                    'sender_id': sender_id,
-                    'sender_name': sender_name,
-                    'target_id': data.get('target_id'),
-                    'is_typing': is_typing
-                }
-            )
+            # 状態のみ更新し、ブロードキャストは定期処理で状態変化だけ行う
+            self.typing_state.update(chat_type, sender_id, target_id, sender_name, is_typing)
+            self._ensure_typing_loop()
             
         except ValidationError as e:
             await self._send_error(str(e))
 
+    def _ensure_typing_loop(self):
+        """入力中状態の定期処理を開始"""
+        if self.typing_state and (self.typing_task is None or self.typing_task.done()):
+            self.typing_task = asyncio.create_task(self._typing_loop())
+
+    async def _typing_loop(self):
+        """入力中状態の変化（開始・終了・期限切れ）をまとめてブロードキャスト"""
+        try:
+            while self.typing_state:
+                await asyncio.sleep(Config.TYPING_TICK)
+                for transition in self.typing_state.tick():
+                    await self._broadcast_typing(transition)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Typing loop error: {str(e)}")
+
+    def _start_background_task(self, coro) -> asyncio.Task:
+        """タスクを開始し、完了まで参照を保持（切断時に取り消す）"""
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    def _cancel_background_tasks(self):
+        for task in list(self.background_tasks):
+            task.cancel()
+        self.background_tasks.clear()
+
+    async def _stop_typing_loop(self):
+        """定期処理を停止し、通知済みの入力中状態を終了させる"""
+        if self.typing_task and not self.typing_task.done():
+            self.typing_task.cancel()
+        self.typing_task = None
+        try:
+            for transition in self.typing_state.clear():
+                await self._broadcast_typing(transition)
+        except Exception as e:
+            logger.error(f"Typing stop error: {str(e)}")
+
+    async def _broadcast_typing(self, transition):
+        """入力中状態の変化を配信（個別チャットは送信者と宛先のみ）"""
+        await self._send_to_conversation(
+            transition.chat_type, transition.sender_id, transition.target_id,
+            {
+                'type': 'typing_broadcast',
+                'chat_type': transition.chat_type,
+                'sender_id': transition.sender_id,
+                'sender_name': transition.sender_name,
+                'target_id': transition.target_id,
+                'is_typing': transition.is_typing
+            }
+        )
+
     # グループメッセージハンドラーを追加
     async def chat_broadcast(self, event):
         await self.send_json({
@@ -647,7 +1372,8 @@ class LocationConsumer(AsyncWebsocketConsumer):
             'sender_name': event['sender_name'],
             'target_id': event.get('target_id'),
             'text': event['text'],
-            'timestamp': event['timestamp']
+            'timestamp': event['timestamp'],
+            'id': event.get('message_id')
         })
 
     async def typing_broadcast(self, event):
@@ -660,74 +1386,38 @@ class LocationConsumer(AsyncWebsocketConsumer):
             'is_typing': event['is_typing']
         })
 
-    # データベース操作メソッドを追加
-    @database_sync_to_async
-    def _save_chat_message(self, data: Dict[str, Any]):
-        """チャットメッセージを保存"""
-        try:
-            session = LocationSession.objects.get(session_id=data['session_id'])
-            
-            # メッセージを作成（デフォルトでis_read=False）
-            message = ChatMessage.objects.create(
-                session=session,
-                chat_type=data['chat_type'],
-                sender_id=data['sender_id'],
-                sender_name=data['sender_name'],
-                target_id=data.get('target_id'),
-                text=data['text'],
-                timestamp=timezone.now(),
-                is_read=False  # 新規メッセージは未読
-            )
-            
-            return message.id
-            
-        except Exception as e:
-            logger.error(f"Chat message save error: {str(e)}")
-            return None
-
     @database_sync_to_async
     def _get_unread_counts(self, session_id: str, participant_id: str) -> Dict[str, Any]:
-        """未読カウントを取得（実際の未読メッセージ数をカウント）"""
+        """未読カウントを取得（既読カーソルに保持した差分更新済みの値）"""
         try:
             session = LocationSession.objects.get(session_id=session_id)
             
-            logger.info(f"Getting unread counts for participant: {participant_id}")
-            
-            # グループメッセージの未読数をカウント
-            # 自分が送信したメッセージと既読メッセージを除外
-            group_messages = ChatMessage.objects.filter(
-                session=session,
-                chat_type='group',
-                is_read=False
-            ).exclude(
-                sender_id=participant_id
-            )
-            group_unread = group_messages.count()
-            
-            logger.info(f"Group unread count: {group_unread}")
+            # グループの既読カーソルがなければ初回のみ実数で作成
+            if not ChatReadCursor.objects.filter(
+                session=session, participant_id=participant_id, conversation='group'
+            ).exists():
+                try:
+                    with transaction.atomic():
+                        ChatReadCursor.objects.create(
+                            session=session,
+                            participant_id=participant_id,
+                            conversation='group',
+                            unread_count=self._incoming_messages(session, participant_id, 'group').count()
+                        )
+                except IntegrityError:
+                    pass
             
-            # 個別メッセージの未読数をカウント
+            group_unread = 0
             individual_unread = {}
             
-            # 自分宛の未読個別メッセージを取得
-            individual_messages = ChatMessage.objects.filter(
+            for conversation, unread_count in ChatReadCursor.objects.filter(
                 session=session,
-                chat_type='individual',
-                target_id=participant_id,
-                is_read=False
-            ).exclude(
-                sender_id=participant_id
-            )
-            
-            # 送信者ごとに未読数をカウント
-            
-            sender_counts = individual_messages.values('sender_id').annotate(
-                unread_count=Count('id')
-            )
-            
-            for item in sender_counts:
-                individual_unread[item['sender_id']] = item['unread_count']
-                logger.info(f"Individual unread from {item['sender_id']}: {item['unread_count']}")
+                participant_id=participant_id
+            ).values_list('conversation', 'unread_count'):
+                if conversation == 'group':
+                    group_unread = unread_count
+                elif unread_count > 0:
+                    individual_unread[conversation] = unread_count
             
             return {
                 'group': group_unread,
@@ -738,37 +1428,6 @@ class LocationConsumer(AsyncWebsocketConsumer):
             logger.error(f"Get unread counts error: {str(e)}")
             return {'group': 0, 'individual': {}}
 
-    @database_sync_to_async
-    def _update_unread_count(self, participant_id: str, chat_type: str, 
-                            sender_id: str = None, reset: bool = False):
-        """未読カウントを更新"""
-        try:
-            session = LocationSession.objects.get(session_id=self.session_id)
-            unread, created = ChatUnreadCount.objects.get_or_create(
-                session=session,
-                participant_id=participant_id,
-                defaults={'group_unread': 0, 'individual_unread': {}}
-            )
-            
-            if chat_type == 'group':
-                if reset:
-                    unread.group_unread = 0
-                else:
-                    unread.group_unread += 1
-            elif sender_id:
-                individual = unread.individual_unread or {}
-                if reset:
-                    individual[sender_id] = 0
-                else:
-                    individual[sender_id] = individual.get(sender_id, 0) + 1
-                unread.individual_unread = individual
-            
-            unread.save()
-            
-        except Exception as e:
-            logger.error(f"Update unread count error: {str(e)}")
-
-
     # ：即座フォアグラウンド復帰ハンドラー
     async def _handle_immediate_foreground_return(self, data: Dict[str, Any]):
         """即座フォアグラウンド復帰処理（最優先）"""
@@ -781,6 +1440,7 @@ class LocationConsumer(AsyncWebsocketConsumer):
             priority_update = bool(data.get('priority_update', False))
 
             self.is_mobile = is_mobile
+            self.is_background = False
 
             logger.info(f"=== 即座フォアグラウンド復帰開始: {participant_id} (sharing: {is_sharing}, mobile: {is_mobile}) ===")
 
@@ -834,6 +1494,8 @@ class LocationConsumer(AsyncWebsocketConsumer):
             priority_connection = bool(data.get('priority_connection', False))
             page_returning = bool(data.get('page_returning', False))
             deduplicate = bool(data.get('deduplicate', False))  # ★ 追加
+            # 共有ページの名簿（または前回の接続）から変わっていなければ、自分の分だけ送る
+            roster_current = roster_versions.is_current(self.session_id, data.get('roster_etag'))
 
             self.is_mobile = is_mobile
 
@@ -845,9 +1507,12 @@ class LocationConsumer(AsyncWebsocketConsumer):
                 logger.info(f"即座オンライン要求: {participant_id} (priority: {priority_connection})")
                 is_background = False
 
+            self.is_background = is_background
+
             # ★ 追加：重複防止処理
             if deduplicate:
-                await self._cleanup_duplicate_entries(participant_id, persistent_participant_id)
+                if await self._cleanup_duplicate_entries(participant_id, persistent_participant_id):
+                    roster_current = False
 
             if request_existing_check:
                 # 複数の方法で既存参加者を検索
@@ -858,6 +1523,8 @@ class LocationConsumer(AsyncWebsocketConsumer):
                 if existing_participant:
                     self.participant_id = existing_participant['participant_id']
                     ip_changed = existing_participant.get('ip_changed', False)
+                    if existing_participant.get('deactivated_count'):
+                        roster_current = False
                     
                     # ★ 重要：既存参加者の場合は更新のみ（新規作成しない）
                     await self._update_existing_participant(
@@ -942,14 +1609,19 @@ class LocationConsumer(AsyncWebsocketConsumer):
                         session_fingerprint=session_fingerprint
                     )
 
-            await self._broadcast_locations()
+            await self._join_participant_group()
+            await self._clear_offline_deadline(self.participant_id)
+            if roster_current:
+                await self._broadcast_single_participant(self.participant_id)
+            else:
+                await self._broadcast_locations()
 
         except ValidationError as e:
             await self._send_error(str(e))
 
     @database_sync_to_async
-    def _cleanup_duplicate_entries(self, participant_id: str, persistent_participant_id: str):
-        """重複エントリのクリーンアップ"""
+    def _cleanup_duplicate_entries(self, participant_id: str, persistent_participant_id: str) -> int:
+        """重複エントリのクリーンアップ（非アクティブ化した件数を返す）"""
         try:
             session = LocationSession.objects.get(session_id=self.session_id)
             
@@ -966,9 +1638,12 @@ class LocationConsumer(AsyncWebsocketConsumer):
                     dup.is_active = False
                     dup.save()
                 logger.info(f"重複エントリをクリーンアップ: {len(to_deactivate)}件")
-                
+                return len(to_deactivate)
+            return 0
+
         except Exception as e:
             logger.error(f"Duplicate cleanup error: {str(e)}")
+            return 0
 
     @database_sync_to_async
     def _check_participant_exists(self, participant_id: str) -> bool:
@@ -1090,16 +1765,17 @@ class LocationConsumer(AsyncWebsocketConsumer):
                     is_active=True
                 ).exclude(participant_id=participant.participant_id)
                 
-                if old_offline_participants.exists():
-                    old_count = old_offline_participants.count()
-                    old_offline_participants.update(is_active=False)
-                    logger.info(f"古いオフライン参加者を非アクティブ化: {old_count}件")
+                deactivated_count = old_offline_participants.update(is_active=False)
+                if deactivated_count:
+                    roster_versions.bump(self.session_id)
+                    logger.info(f"古いオフライン参加者を非アクティブ化: {deactivated_count}件")
 
                 return {
                     'participant_id': participant.participant_id,
                     'participant_name': participant.participant_name,
                     'is_existing': True,
-                    'ip_changed': ip_changed
+                    'ip_changed': ip_changed,
+                    'deactivated_count': deactivated_count
                 }
             
             return None
@@ -1116,17 +1792,25 @@ class LocationConsumer(AsyncWebsocketConsumer):
             latitude, longitude = self._validate_coordinates(data.get('latitude'), data.get('longitude'))
             accuracy = self._validate_accuracy(data.get('accuracy'))
 
-            if not await self._check_session_valid():
+            if not self._is_session_active():
                 await self.send_json({'type': 'session_expired', 'message': 'Session has expired'})
                 return
 
+            is_background = bool(data.get('is_background', False))
+            self.is_background = is_background
+
+            # ジッター抑制：有意な変化がなければ保存・ブロードキャストしない
+            decision = await self._filter_location(participant_id, participant_name, latitude, longitude, accuracy, is_background)
+            if not decision.accept:
+                return
+
             await self._save_location_data({
                 'participant_id': participant_id,
                 'participant_name': participant_name,
-                'latitude': latitude,
-                'longitude': longitude,
+                'latitude': decision.latitude,
+                'longitude': decision.longitude,
                 'accuracy': accuracy,
-                'is_background': bool(data.get('is_background', False)),
+                'is_background': is_background,
                 'is_online': True,
                 'status': 'sharing',
                 'has_shared_before': True
@@ -1138,6 +1822,35 @@ class LocationConsumer(AsyncWebsocketConsumer):
         except ValidationError as e:
             await self._send_error(str(e))
 
+    async def _filter_location(self, participant_id: str, participant_name: str,
+                               latitude: float, longitude: float,
+                               accuracy: Optional[float], is_background: bool):
+        """ジッターフィルターを通し、破棄された場合は最終確認時刻のみ更新"""
+        decision = location_filter.process(
+            self.session_id, participant_id, latitude, longitude, accuracy,
+            attrs=(participant_name, is_background, self.is_mobile)
+        )
+        if not decision.accept and decision.touch_presence:
+            await self._touch_participant_presence(participant_id)
+        return decision
+
+    @database_sync_to_async
+    def _touch_participant_presence(self, participant_id: str):
+        """最終確認時刻のみを更新（位置は変更しない）"""
+        try:
+            now = timezone.now()
+            update_participant(
+                LocationData.objects.filter(
+                    session__session_id=self.session_id,
+                    participant_id=participant_id
+                ),
+                last_seen_at=now,
+                last_updated=now,
+                is_online=True
+            )
+        except Exception as e:
+            logger.error(f"Presence touch error: {str(e)}")
+
     async def _handle_background_status_update(self, data: Dict[str, Any]):
         """バックグラウンド状態更新（即座対応版）"""
         try:
@@ -1151,6 +1864,7 @@ class LocationConsumer(AsyncWebsocketConsumer):
             immediate_transition = bool(data.get('immediate_transition', False))
 
             self.is_mobile = is_mobile
+            self.is_background = is_background
 
             # 即座移行の場合は遅延なしで処理
             if immediate_transition:
@@ -1251,6 +1965,9 @@ class LocationConsumer(AsyncWebsocketConsumer):
             is_moving = bool(data.get('is_moving', False))
 
             self.is_mobile = is_mobile
+            self.is_moving = is_moving
+            self.current_speed = current_speed
+            self.is_background = is_background
 
             # ステータス更新（速度情報も含む）
             status = 'sharing' if is_sharing else 'waiting'
@@ -1267,7 +1984,8 @@ class LocationConsumer(AsyncWebsocketConsumer):
                 'server_time': timezone.now().isoformat(),
                 'keep_alive': True,
                 'speed_acknowledged': True,  # ★ 速度情報受信確認
-                'current_speed': current_speed
+                'current_speed': current_speed,
+                **self._recommended_intervals()
             })
             
             # ★ 追加：共有中かつ移動中の場合は速度情報もブロードキャスト
@@ -1350,19 +2068,23 @@ class LocationConsumer(AsyncWebsocketConsumer):
     @database_sync_to_async
     def _completely_remove_participant(self, participant_id: str):
         """参加者を完全に削除（is_activeをFalseにするだけでなく、削除）"""
+        location_filter.reset(self.session_id, participant_id)
         try:
             session = LocationSession.objects.get(session_id=self.session_id)
             
             # 該当参加者のデータを完全削除
-            deleted_count = LocationData.objects.filter(
+            participant = LocationData.objects.filter(
                 session=session,
                 participant_id=participant_id
-            ).delete()[0]
+            )
+            online_count = participant.filter(is_active=True, is_online=True).count()
+            deleted_count = participant.delete()[0]
+            live_stats.add('online_participants_count', -online_count)
             
             logger.info(f"参加者を完全削除: {participant_id} (削除数: {deleted_count})")
             
-            # チャットの未読カウントもクリア（オプション）
-            ChatUnreadCount.objects.filter(
+            # チャットの既読カーソルもクリア
+            ChatReadCursor.objects.filter(
                 session=session,
                 participant_id=participant_id
             ).delete()
@@ -1395,8 +2117,8 @@ class LocationConsumer(AsyncWebsocketConsumer):
 
 
     @database_sync_to_async
-    def _cleanup_old_offline_participants(self, new_name: str):
-        """古いオフライン参加者をクリーンアップ"""
+    def _cleanup_old_offline_participants(self, new_name: str) -> int:
+        """古いオフライン参加者をクリーンアップ（非アクティブ化した件数を返す）"""
         try:
             session = LocationSession.objects.get(session_id=self.session_id)
             
@@ -1408,15 +2130,13 @@ class LocationConsumer(AsyncWebsocketConsumer):
                 is_active=True
             ).exclude(participant_id=self.participant_id)
             
-            if old_participants.exists():
-                count = old_participants.count()
-                # 非アクティブ化
-                old_participants.update(is_active=False)
+            # 非アクティブ化（名簿が変わるのでバージョンを更新）
+            count = old_participants.update(is_active=False)
+            if count:
+                roster_versions.bump(self.session_id)
                 logger.info(f"名前変更により古いオフライン参加者を非アクティブ化: {count}件 (名前: {new_name})")
-                
-                return count
             
-            return 0
+            return count
             
         except Exception as e:
             logger.error(f"Old participant cleanup error: {str(e)}")
@@ -1463,50 +2183,38 @@ class LocationConsumer(AsyncWebsocketConsumer):
         """ページ閉じ時の切断処理（12時間遅延）"""
         if self.participant_id:
             # バックグラウンド状態で維持（12時間遅延）
-            delay = 43200  # 12時間 = 43200秒
-            await self._schedule_delayed_offline(delay, is_page_close=True)
-
-    async def _schedule_delayed_offline(self, delay_seconds: int, is_page_close: bool = False):
-        """遅延オフライン処理（未共有参加者は除外）"""
-        def delayed_task():
-            time.sleep(delay_seconds)
-            try:
-                from django.db import connection
-                connection.close()  # 新しい接続を使用
-                
-                session = LocationSession.objects.get(session_id=self.session_id)
-                participant = LocationData.objects.filter(
-                    session=session, participant_id=self.participant_id
-                ).first()
-
-                if participant and participant.is_online:
-                    # ★ 追加：未共有（waiting）状態の参加者はオフラインにしない
-                    if participant.status == 'waiting':
-                        logger.info(f"未共有参加者のオフライン処理をスキップ: {self.participant_id}")
-                        return
-                    
-                    time_diff = (timezone.now() - participant.last_updated).total_seconds()
-                    margin = 60 if is_page_close else 30  # ページ閉じの場合はより長い余裕
-                    
-                    if time_diff >= delay_seconds - margin:
-                        # 名前を保持してオフライン化
-                        preserved_name = participant.participant_name
-                        LocationData.objects.filter(
-                            session=session, participant_id=self.participant_id
-                        ).update(
-                            participant_name=preserved_name,  # 名前を明示的に保持
-                            is_online=False,
-                            status='stopped',
-                            last_updated=timezone.now(),
-                            last_seen_at=timezone.now()
-                        )
-                        logger.info(f"遅延オフライン実行（名前保持）: {self.participant_id} -> {preserved_name} (page_close: {is_page_close})")
+            await self._schedule_delayed_offline(Config.PAGE_CLOSE_OFFLINE_DELAY, is_page_close=True)
 
-            except Exception as e:
-                logger.error(f"Delayed offline error: {str(e)}")
+    @database_sync_to_async
+    def _schedule_delayed_offline(self, delay_seconds: int, is_page_close: bool = False):
+        """遅延オフラインの期限を記録（切り替えはプレゼンス・スイーパーがまとめて行う）"""
+        try:
+            # 未共有（waiting）状態の参加者はオフラインにしない
+            updated = LocationData.objects.filter(
+                session__session_id=self.session_id,
+                participant_id=self.participant_id,
+                is_online=True
+            ).exclude(
+                status='waiting'
+            ).update(
+                offline_after=timezone.now() + timedelta(seconds=delay_seconds)
+            )
+            if updated:
+                logger.info(f"遅延オフライン予定: {self.participant_id} ({delay_seconds}秒後, page_close: {is_page_close})")
+        except Exception as e:
+            logger.error(f"Delayed offline error: {str(e)}")
 
-        thread = threading.Thread(target=delayed_task, daemon=True)
-        thread.start()
+    @database_sync_to_async
+    def _clear_offline_deadline(self, participant_id: str):
+        """再接続した参加者の遅延オフライン予定を取り消す"""
+        try:
+            LocationData.objects.filter(
+                session__session_id=self.session_id,
+                participant_id=participant_id,
+                offline_after__isnull=False
+            ).update(offline_after=None)
+        except Exception as e:
+            logger.error(f"Clear offline deadline error: {str(e)}")
 
     # === 検証メソッド ===
 
@@ -1530,6 +2238,12 @@ class LocationConsumer(AsyncWebsocketConsumer):
         except ValueError:
             raise ValidationError('無効な参加者IDです')
 
+    def _validate_target_id(self, chat_type: str, target_id: Optional[str]) -> Optional[str]:
+        """個別チャットの宛先ID検証（グループチャットは宛先なし）"""
+        if chat_type != 'individual':
+            return None
+        return self._validate_participant_id(target_id)
+
     def _validate_coordinates(self, latitude, longitude) -> tuple:
         """座標検証"""
         try:
@@ -1591,25 +2305,24 @@ class LocationConsumer(AsyncWebsocketConsumer):
         return self.scope.get('client', ['127.0.0.1', 0])[0]
 
     async def _check_rate_limit(self) -> bool:
-        """レート制限チェック"""
-        now = timezone.now()
-        if (now - self.last_message_time).total_seconds() >= 60:
-            self.message_count = 0
-            self.last_message_time = now
-
-        self.message_count += 1
-        return self.message_count <= Config.MAX_MESSAGES_PER_MINUTE
+        """レート制限チェック（参加者ごと・セッション全体のトークンバケット）"""
+        participant_key = f'{self.session_id}:{self.participant_id or self.channel_name}'
+        if not await rate_limiter.allow('participant', participant_key, PARTICIPANT_MESSAGE_LIMIT):
+            return False
+        return await rate_limiter.allow('session', self.session_id, SESSION_MESSAGE_LIMIT)
 
     async def _check_connection_limit(self) -> bool:
-        """接続数制限チェック"""
-        cache_key = f'ws_connections_{self.session_id}'
-        connection_count = cache.get(cache_key, 0)
-
-        if connection_count >= Config.MAX_CONNECTIONS_PER_SESSION:
-            return False
+        """接続数制限チェック（切断時に枠を返す）"""
+        self.connection_slot = await rate_limiter.acquire(
+            'connections', self.session_id, Config.MAX_CONNECTIONS_PER_SESSION
+        )
+        return self.connection_slot
 
-        cache.set(cache_key, connection_count + 1, 300)
-        return True
+    async def _release_connection_slot(self):
+        """同時接続枠を返す"""
+        if self.connection_slot:
+            self.connection_slot = False
+            await rate_limiter.release('connections', self.session_id)
 
     # === ユーティリティメソッド ===
 
@@ -1628,9 +2341,15 @@ class LocationConsumer(AsyncWebsocketConsumer):
         """位置情報ブロードキャスト（オフライン参加者も含む）"""
         try:
             locations = await self._get_all_locations()
+            etag, _ = roster_versions.bump(self.session_id)
             await self.channel_layer.group_send(
                 self.room_group_name,
-                {'type': 'location_broadcast', 'locations': locations}
+                {
+                    'type': 'location_broadcast',
+                    'locations': locations,
+                    'roster_version': roster_version(locations),
+                    'roster_etag': etag
+                }
             )
         except Exception as e:
             logger.error(f"Broadcast error: {str(e)}")
@@ -1638,7 +2357,38 @@ class LocationConsumer(AsyncWebsocketConsumer):
     # === グループメッセージハンドラー ===
 
     async def location_broadcast(self, event):
-        await self.send_json({'type': 'location_update', 'locations': event['locations']})
+        self._update_roster_counts(event['locations'])
+        # 距離行列は名簿バージョンごとに1回だけ計算され、自分の行のみ送信
+        version = event.get('roster_version') or roster_version(event['locations'])
+        distances = distance_matrix.row(
+            self.session_id, version, event['locations'],
+            self.participant_id, self.current_speed
+        )
+        await self.send_json({
+            'type': 'location_update',
+            'locations': event['locations'],
+            'distances': distances,
+            'roster_etag': event.get('roster_etag'),
+            **self._recommended_intervals()
+        })
+
+    def _update_roster_counts(self, locations: List[Dict[str, Any]]):
+        """名簿から参加者数と閲覧者数（フォアグラウンドの他参加者）を記録"""
+        self.roster_size = len(locations)
+        self.viewer_count = sum(
+            1 for loc in locations
+            if loc.get('participant_id') != self.participant_id
+            and loc.get('is_online') and not loc.get('is_background')
+        )
+
+    def _recommended_intervals(self) -> Dict[str, int]:
+        """この接続の参加者向け推奨送信間隔"""
+        return reporting_rate.recommend(
+            is_moving=self.is_moving,
+            is_background=self.is_background,
+            participant_count=self.roster_size,
+            viewer_count=self.viewer_count,
+        )
 
     async def notification_broadcast(self, event):
         await self.send_json({
@@ -1653,21 +2403,45 @@ class LocationConsumer(AsyncWebsocketConsumer):
     # === データベース操作メソッド ===
 
     @database_sync_to_async
-    def _check_session_exists(self) -> bool:
-        """セッション存在チェック"""
+    def _load_session(self) -> bool:
+        """セッション存在チェック（主キーと期限を接続に保持）"""
         try:
-            return LocationSession.objects.filter(session_id=self.session_id).exists()
+            session = LocationSession.objects.values('pk', 'expires_at').filter(session_id=self.session_id).first()
+            if session is None:
+                discard_session_caches(self.session_id)
+                return False
+            self.session_pk = session['pk']
+            self.session_expires_at = session['expires_at']
+            return True
         except Exception:
             return False
 
-    @database_sync_to_async
-    def _check_session_valid(self) -> bool:
-        """セッション有効性チェック"""
-        try:
-            session = LocationSession.objects.get(session_id=self.session_id)
-            return timezone.now() < session.expires_at
-        except LocationSession.DoesNotExist:
-            return False
+    def _verify_socket_token(self) -> Optional[SocketIdentity]:
+        """接続URLのトークンを検証"""
+        query = parse_qs(self.scope.get('query_string', b'').decode('latin-1'))
+        token = query.get('token', [None])[0]
+        if not token:
+            return None
+        identity = verify_socket_token(token, self.session_id)
+        if identity is None:
+            logger.warning(f"Invalid socket token: {self.session_id} from {self.client_ip}")
+        return identity
+
+    def _is_session_active(self) -> bool:
+        """セッション有効性チェック（接続時に読み込んだ期限と比較、DBは参照しない）"""
+        return (
+            not self.session_expired
+            and self.session_expires_at is not None
+            and timezone.now() < self.session_expires_at
+        )
+
+    async def session_expired_broadcast(self, event):
+        """期限切れ通知を送信して切断"""
+        if self.session_expired:
+            return
+        self.session_expired = True
+        await self.send_json({'type': 'session_expired', 'message': 'Session has expired'})
+        await self.close(code=4410)
 
     @database_sync_to_async
     def _get_participant_by_ip(self) -> Optional[Dict[str, Any]]:
@@ -1706,6 +2480,8 @@ class LocationConsumer(AsyncWebsocketConsumer):
                      session_fingerprint: Optional[str] = None, 
                      preserve_name: bool = False, preserve_has_shared: bool = False):
         """参加者状態更新（名前・共有履歴保持対応版）"""
+        # 状態が変わるため次の位置情報は必ず保存する
+        location_filter.reset(self.session_id, participant_id)
         try:
             session = LocationSession.objects.get(session_id=self.session_id)
 
@@ -1878,6 +2654,7 @@ class LocationConsumer(AsyncWebsocketConsumer):
                 location.is_online = True
                 location.is_background = is_background
                 location.status = status
+                location.offline_after = None  # 接続中なので遅延オフライン予定は不要
                 
                 if has_position:
                     location.last_updated = timezone.now()
@@ -1908,21 +2685,11 @@ class LocationConsumer(AsyncWebsocketConsumer):
                     data.get('latitude') and data.get('longitude')):
                     
                     # 距離を計算
-                    from math import radians, cos, sin, asin, sqrt
-                    def haversine(lon1, lat1, lon2, lat2):
-                        lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
-                        dlon = lon2 - lon1 
-                        dlat = lat2 - lat1 
-                        a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-                        c = 2 * asin(sqrt(a)) 
-                        r = 6371000  # メートル単位
-                        return c * r
-                    
-                    distance = haversine(
-                        float(existing_location.longitude), 
+                    distance = haversine_distance(
                         float(existing_location.latitude),
-                        float(data['longitude']), 
-                        float(data['latitude'])
+                        float(existing_location.longitude),
+                        float(data['latitude']),
+                        float(data['longitude'])
                     )
                     
                     if distance >= 30:  # ★ 30m以上移動（20mから変更）
@@ -1983,62 +2750,7 @@ class LocationConsumer(AsyncWebsocketConsumer):
     @database_sync_to_async
     def _get_all_locations(self) -> List[Dict[str, Any]]:
         """全位置情報取得（速度情報含む）"""
-        try:
-            session = LocationSession.objects.get(session_id=self.session_id)
-            
-            locations = LocationData.objects.filter(
-                session=session,
-                is_active=True
-            ).order_by('-last_updated')
-
-            result = []
-            for loc in locations:
-                has_location = (loc.latitude is not None and 
-                            loc.longitude is not None and 
-                            loc.latitude != 999.0 and 
-                            loc.longitude != 999.0)
-                
-                should_display = (
-                    getattr(loc, 'has_shared_before', False) or
-                    loc.is_online or
-                    loc.status == 'waiting'
-                )
-                
-                if should_display:
-                    # サーバー側で滞在時間を計算
-                    stay_minutes = 0
-                    
-                    if loc.stay_start_time and loc.is_online and loc.status == 'sharing':
-                        elapsed = (timezone.now() - loc.stay_start_time).total_seconds() / 60
-                        stay_minutes = int(elapsed)
-                    elif loc.total_stay_minutes:
-                        stay_minutes = loc.total_stay_minutes
-                    
-                    location_data = {
-                        'participant_id': loc.participant_id,
-                        'participant_name': escape(loc.participant_name or f'参加者{loc.participant_id[:4]}'),
-                        'latitude': float(loc.latitude) if has_location else None,
-                        'longitude': float(loc.longitude) if has_location else None,
-                        'accuracy': float(loc.accuracy) if (has_location and loc.accuracy) else None,
-                        'last_updated': loc.last_updated.isoformat(),
-                        'last_seen_at': loc.last_seen_at.isoformat() if getattr(loc, 'last_seen_at', None) else None,
-                        'is_background': loc.is_background,
-                        'is_online': loc.is_online,
-                        'is_mobile': getattr(loc, 'is_mobile', False),
-                        'status': loc.status,
-                        'has_shared_before': getattr(loc, 'has_shared_before', False),
-                        'stay_minutes': stay_minutes,
-                        # ★ 追加：速度情報
-                        'current_speed': getattr(loc, 'current_speed', 0),
-                        'is_moving': getattr(loc, 'is_moving', False),
-                    }
-                    result.append(location_data)
-
-            return result
-
-        except Exception as e:
-            logger.error(f"Location fetch error: {str(e)}")
-            return []
+        return get_session_locations(self.session_id)
 
 
     def _calculate_current_stay_time(self, location_data) -> int:
@@ -2077,10 +2789,11 @@ class LocationConsumer(AsyncWebsocketConsumer):
         """参加者非アクティブ化"""
         try:
             session = LocationSession.objects.get(session_id=self.session_id)
-            LocationData.objects.filter(
-                session=session,
-                participant_id=participant_id
-            ).update(
+            update_participant(
+                LocationData.objects.filter(
+                    session=session,
+                    participant_id=participant_id
+                ),
                 is_active=False,
                 is_online=False,
                 status='stopped',
@@ -2096,6 +2809,7 @@ class LocationConsumer(AsyncWebsocketConsumer):
 
 # === Celeryタスク（別ファイルまたは同じファイル内） ===
 from celery import shared_task
+from .tasks import deleter, purge_expired_sessions
 
 @shared_task
 def cleanup_offline_participants():
@@ -2112,8 +2826,8 @@ def cleanup_offline_participants():
             status='waiting'  # ★ 追加：未共有参加者は削除しない
         )
         
-        count = expired_participants.count()
-        expired_participants.delete()
+        metrics = deleter.delete(expired_participants, 'オフライン参加者')
+        count = metrics['deleted']
         
         logger.info(f"オフライン参加者クリーンアップ完了: {count}件削除（未共有参加者は除外）")
         return f"削除件数: {count}"
@@ -2126,13 +2840,9 @@ def cleanup_offline_participants():
 def cleanup_expired_sessions():
     """期限切れセッションとその参加者を削除"""
     try:
-        # 期限切れセッションを削除（CASCADE で参加者も自動削除）
-        expired_sessions = LocationSession.objects.filter(
-            expires_at__lt=timezone.now()
-        )
-        
-        count = expired_sessions.count()
-        expired_sessions.delete()
+        # 期限切れセッションを子テーブルから順に分割削除
+        results = purge_expired_sessions()
+        count = results[-1]['deleted']
         
         logger.info(f"期限切れセッション削除完了: {count}件削除")
         return f"削除件数: {count}"
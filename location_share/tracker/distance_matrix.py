@@ -0,0 +1,118 @@
+# tracker/distance_matrix.py - セッション内の参加者間距離行列
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from .location_filter import EARTH_RADIUS_M
+
+
+def roster_version(locations: List[Dict[str, Any]]) -> str:
+    """位置情報を持つ参加者の座標から名簿バージョン（ダイジェスト）を生成"""
+    digest = hashlib.blake2b(digest_size=8)
+    for loc in sorted(locations, key=lambda l: l['participant_id']):
+        if loc.get('latitude') is None or loc.get('longitude') is None:
+            continue
+        digest.update(f"{loc['participant_id']}:{loc['latitude']:.7f}:{loc['longitude']:.7f};".encode())
+    return digest.hexdigest()
+
+
+def pairwise_distance_bearing(lats: np.ndarray, lngs: np.ndarray):
+    """ハバーサイン距離（m）と方位角（度）の行列をベクトル演算で計算"""
+    phi = np.radians(lats)
+    lam = np.radians(lngs)
+    dphi = phi[None, :] - phi[:, None]
+    dlam = lam[None, :] - lam[:, None]
+    cos_phi = np.cos(phi)
+
+    a = np.sin(dphi / 2) ** 2 + cos_phi[:, None] * cos_phi[None, :] * np.sin(dlam / 2) ** 2
+    distances = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+    y = np.sin(dlam) * cos_phi[None, :]
+    x = cos_phi[:, None] * np.sin(phi)[None, :] - np.sin(phi)[:, None] * cos_phi[None, :] * np.cos(dlam)
+    bearings = (np.degrees(np.arctan2(y, x)) + 360.0) % 360.0
+    return distances, bearings
+
+
+class _SessionMatrix:
+    __slots__ = ('ids', 'index', 'distances', 'bearings')
+
+    def __init__(self, ids, distances, bearings):
+        self.ids = ids
+        self.index = {pid: i for i, pid in enumerate(ids)}
+        self.distances = distances
+        self.bearings = bearings
+
+
+class DistanceMatrixCache:
+    """セッションの距離行列を名簿バージョンごとに1回だけ計算してキャッシュ
+
+    ブロードキャストを受け取った各接続は自分の行だけを取り出す。
+    """
+
+    def __init__(self, max_entries: int = 256, walking_speed_kmh: float = 4.8):
+        self.max_entries = max_entries
+        self.walking_speed_kmh = walking_speed_kmh
+        self._cache: 'OrderedDict[tuple, _SessionMatrix]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def row(self, session_id: str, version: str, locations: List[Dict[str, Any]],
+            participant_id: Optional[str], speed_kmh: float = 0) -> Dict[str, Dict[str, Any]]:
+        """参加者から他の全員への距離・方位・到着予想時間"""
+        if not participant_id:
+            return {}
+
+        matrix = self._get_or_compute(str(session_id), version, locations)
+        i = matrix.index.get(participant_id)
+        if i is None:
+            return {}
+
+        # 移動中でなければ徒歩速度で到着予想時間を計算
+        speed_ms = max(speed_kmh or 0, self.walking_speed_kmh) / 3.6
+        result = {}
+        for j, other_id in enumerate(matrix.ids):
+            if j == i:
+                continue
+            distance = float(matrix.distances[i, j])
+            result[other_id] = {
+                'distance': round(distance, 1),
+                'bearing': round(float(matrix.bearings[i, j]), 1),
+                'eta_seconds': int(distance / speed_ms),
+            }
+        return result
+
+    def discard_session(self, session_id: str):
+        """セッションのキャッシュを破棄"""
+        session_id = str(session_id)
+        with self._lock:
+            for key in [k for k in self._cache if k[0] == session_id]:
+                del self._cache[key]
+
+    def _get_or_compute(self, session_id: str, version: str, locations: List[Dict[str, Any]]) -> _SessionMatrix:
+        key = (session_id, version)
+        with self._lock:
+            matrix = self._cache.get(key)
+            if matrix is not None:
+                self._cache.move_to_end(key)
+                return matrix
+
+        positioned = [
+            loc for loc in locations
+            if loc.get('latitude') is not None and loc.get('longitude') is not None
+        ]
+        ids = [loc['participant_id'] for loc in positioned]
+        lats = np.array([loc['latitude'] for loc in positioned], dtype=float)
+        lngs = np.array([loc['longitude'] for loc in positioned], dtype=float)
+        distances, bearings = pairwise_distance_bearing(lats, lngs)
+        matrix = _SessionMatrix(ids, distances, bearings)
+
+        with self._lock:
+            # 同じセッションの古いバージョンは不要
+            for stale in [k for k in self._cache if k[0] == session_id and k != key]:
+                del self._cache[stale]
+            self._cache[key] = matrix
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return matrix
@@ -0,0 +1,164 @@
+# tracker/live_stats.py - トップページ向けの統計
+import json
+import logging
+from typing import Callable, Dict, Optional
+
+from django.core.cache import cache
+from django.db import connections
+from django.db.models.signals import post_init, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import LocationSession, LocationData
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_count(queryset, exact_below: int = 1000) -> int:
+    """件数の概算
+
+    PostgreSQLでは実行計画の推定行数（統計情報）を使い、テーブルを走査しない。
+    推定が exact_below 未満の場合や他のDBでは COUNT で正確に数える。
+    """
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        sql, params = queryset.values('pk').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        estimate = int(plan[0]['Plan']['Plan Rows'])
+        if estimate >= exact_below:
+            return estimate
+    return queryset.count()
+
+
+class LiveStats:
+    """イベントで増減し、定期的にDBの値（概算）で補正する統計
+
+    値は名前ごとにDjangoのキャッシュ（複数プロセス構成では共有キャッシュ）に保存し、
+    セッション作成・期限切れ・オンライン状態の変化のたびに add() で cache.incr する。
+    interval 秒ごとに1プロセスだけが reconcile() でDBの値に合わせ直し、
+    取りこぼした増減（Celeryでの削除、プロセス内キャッシュの構成など）を補正する。
+    """
+
+    def __init__(self, loaders: Dict[str, Callable[[], int]], interval: int = 30,
+                 event_timeout: int = 86400, prefix: str = 'live_stats'):
+        self.loaders = loaders
+        self.interval = interval
+        self.event_timeout = event_timeout
+        self.prefix = prefix
+
+    def add(self, name: str, delta: int = 1):
+        """イベントによる増減を反映"""
+        if not delta:
+            return
+        try:
+            cache.incr(self._key(name), delta)
+        except ValueError:
+            pass  # 未計算（次の合わせ直しで反映される）
+        except Exception as e:
+            logger.error(f"Stats add error ({name}): {str(e)}")
+
+    def claim(self, event: str) -> bool:
+        """同じイベントを複数のプロセスが処理する場合に、最初の1回だけ True を返す"""
+        return cache.add(f'{self.prefix}:event:{event}', 1, self.event_timeout)
+
+    def snapshot(self) -> Dict[str, int]:
+        """現在の値（補正の期限を過ぎていればDBから計算し直す）"""
+        keys = {name: self._key(name) for name in self.loaders}
+        cached = cache.get_many(keys.values())
+        missing = len(cached) < len(keys)
+        if missing or cache.get(f'{self.prefix}:reconciled') is None:
+            locked = cache.add(f'{self.prefix}:lock', 1, self.interval)
+            try:
+                # 他のプロセスが補正中なら現在の値を使う（値がなければこのプロセスでも計算）
+                if locked or missing:
+                    return self.reconcile()
+            finally:
+                if locked:
+                    cache.delete(f'{self.prefix}:lock')
+        return {name: max(0, cached[key]) for name, key in keys.items()}
+
+    def reconcile(self) -> Dict[str, int]:
+        """DBの値で計算し直して共有"""
+        values = {}
+        for name, loader in self.loaders.items():
+            try:
+                values[name] = loader()
+            except Exception as e:
+                logger.error(f"Stats reconcile error ({name}): {str(e)}")
+                values[name] = max(0, cache.get(self._key(name), 0))
+        cache.set_many({self._key(name): value for name, value in values.items()}, None)
+        cache.set(f'{self.prefix}:reconciled', 1, self.interval)
+        return values
+
+    def _key(self, name: str) -> str:
+        return f'{self.prefix}:{name}'
+
+
+def _count_active_sessions() -> int:
+    return estimate_count(LocationSession.objects.filter(expires_at__gt=timezone.now()))
+
+
+def _count_online_participants() -> int:
+    return estimate_count(LocationData.objects.filter(
+        session__expires_at__gt=timezone.now(),
+        is_active=True,
+        is_online=True
+    ))
+
+
+# トップページの統計（/api/stats/）
+live_stats = LiveStats({
+    'active_sessions_count': _count_active_sessions,
+    'online_participants_count': _count_online_participants,
+})
+
+
+def _counts_as_online(location) -> Optional[bool]:
+    """統計のオンライン人数に含まれるか（状態を読み込んでいなければ None）"""
+    fields = location.__dict__
+    if 'is_active' not in fields or 'is_online' not in fields:
+        return None
+    return bool(fields['is_active'] and fields['is_online'])
+
+
+@receiver(post_init, sender=LocationData)
+def _remember_presence(sender, instance, **kwargs):
+    instance._counted_online = _counts_as_online(instance)
+
+
+@receiver(post_save, sender=LocationData)
+def _count_presence_change(sender, instance, created, **kwargs):
+    """save() によるオンライン状態の変化を反映"""
+    before = False if created else instance._counted_online
+    after = _counts_as_online(instance)
+    if before is not None and after is not None and before != after:
+        live_stats.add('online_participants_count', 1 if after else -1)
+    instance._counted_online = after
+
+
+def update_participant(queryset, **fields) -> int:
+    """参加者1人分の一括更新（オンライン人数が変わる場合は統計に反映）
+
+    オンライン化はすでにオンラインの場合が多いため状態が変わらない行を先に、
+    オフライン化・非アクティブ化は状態が変わる行を先に更新し、通常は1回のUPDATEで済ませる。
+    """
+    if fields.get('is_active') is False or fields.get('is_online') is False:
+        changed = queryset.filter(is_active=True, is_online=True).update(**fields)
+        if not changed:
+            return queryset.update(**fields)
+        live_stats.add('online_participants_count', -changed)
+        return changed
+
+    if fields.get('is_online') is True:
+        updated = queryset.exclude(is_active=True, is_online=False).update(**fields)
+        if updated:
+            return updated
+        changed = queryset.filter(is_active=True, is_online=False).update(**fields)
+        live_stats.add('online_participants_count', changed)
+        return changed
+
+    return queryset.update(**fields)
@@ -0,0 +1,138 @@
+# tracker/location_batch.py - バックグラウンドでたまった位置情報の一括反映
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .location_filter import haversine_distance
+from .models import LocationData
+
+logger = logging.getLogger(__name__)
+
+STAY_RADIUS_METERS = 30  # これ以上動いたら滞在地点を変更（通常の位置更新と同じ閾値）
+MAX_FIX_AGE = timedelta(hours=12)  # これより古い測位は破棄
+
+
+class Fix(NamedTuple):
+    """1回分の測位"""
+    latitude: float
+    longitude: float
+    accuracy: Optional[float]
+    recorded_at: datetime
+
+
+def _parse_timestamp(value, now: datetime) -> datetime:
+    """測位時刻（エポックミリ秒またはISO 8601）を解析し、未来の時刻は現在時刻に丸める"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        recorded_at = datetime.fromtimestamp(value / 1000, tz=dt_timezone.utc)
+    elif isinstance(value, str):
+        recorded_at = parse_datetime(value)
+        if recorded_at is None:
+            raise ValidationError('測位時刻の形式が不正です')
+        if timezone.is_naive(recorded_at):
+            recorded_at = timezone.make_aware(recorded_at, dt_timezone.utc)
+    else:
+        raise ValidationError('測位時刻がありません')
+    return min(recorded_at, now)
+
+
+def parse_fixes(raw_fixes: Any, max_fixes: int = 100) -> List[Fix]:
+    """送信された測位の配列を検証し、測位時刻順に並べて返す"""
+    if not isinstance(raw_fixes, list) or not raw_fixes:
+        raise ValidationError('位置情報の配列が空です')
+    if len(raw_fixes) > max_fixes:
+        raise ValidationError(f'一度に送信できる位置情報は{max_fixes}件までです')
+
+    now = timezone.now()
+    fixes = []
+    for raw in raw_fixes:
+        if not isinstance(raw, dict):
+            raise ValidationError('位置情報の形式が不正です')
+        try:
+            lat = float(raw.get('latitude'))
+            lng = float(raw.get('longitude'))
+        except (TypeError, ValueError):
+            raise ValidationError('座標が不正です')
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            raise ValidationError('座標が範囲外です')
+
+        accuracy = raw.get('accuracy')
+        try:
+            accuracy = float(accuracy) if accuracy is not None else None
+            if accuracy is not None and not (0 <= accuracy <= 10000):
+                accuracy = None
+        except (TypeError, ValueError):
+            accuracy = None
+
+        recorded_at = _parse_timestamp(raw.get('timestamp'), now)
+        if now - recorded_at > MAX_FIX_AGE:
+            continue
+        fixes.append(Fix(lat, lng, accuracy, recorded_at))
+
+    if not fixes:
+        raise ValidationError('有効な位置情報がありません')
+    fixes.sort(key=lambda fix: fix.recorded_at)
+    return fixes
+
+
+def apply_location_fixes(session, participant_id: str, fixes: List[Fix], defaults: Dict[str, Any],
+                         stay_radius: float = STAY_RADIUS_METERS) -> Tuple[LocationData, bool]:
+    """測位を時刻順に反映し、最新の位置のみを1トランザクションで保存
+
+    滞在地点の判定は各測位の時刻で行うため、まとめて届いた場合でも
+    実際に移動した時刻から滞在時間が数えられる。
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        location = LocationData.objects.select_for_update().filter(
+            session=session,
+            participant_id=participant_id
+        ).first()
+        created = location is None
+        if created:
+            location = LocationData(session=session, participant_id=participant_id, first_seen=now)
+
+        prev_lat = float(location.latitude) if location.latitude is not None else None
+        prev_lng = float(location.longitude) if location.longitude is not None else None
+        prev_time = None
+        stay_start_time = location.stay_start_time
+        speed_kmh = None
+
+        for fix in fixes:
+            if prev_lat is None or prev_lng is None:
+                stay_start_time = fix.recorded_at
+            else:
+                distance = haversine_distance(prev_lat, prev_lng, fix.latitude, fix.longitude)
+                if distance >= stay_radius:
+                    stay_start_time = fix.recorded_at
+                    location.last_move_time = fix.recorded_at
+                elif stay_start_time is None:
+                    stay_start_time = fix.recorded_at
+                if prev_time is not None and fix.recorded_at > prev_time:
+                    speed_kmh = distance / (fix.recorded_at - prev_time).total_seconds() * 3.6
+            prev_lat, prev_lng, prev_time = fix.latitude, fix.longitude, fix.recorded_at
+
+        latest = fixes[-1]
+        location.latitude = latest.latitude
+        location.longitude = latest.longitude
+        location.accuracy = latest.accuracy
+        location.stay_start_time = stay_start_time
+        location.total_stay_minutes = int((now - stay_start_time).total_seconds() / 60)
+        if speed_kmh is not None:
+            location.movement_speed = round(speed_kmh, 1)
+        location.last_seen_at = now
+        location.offline_after = None
+        location.is_active = True
+        location.is_online = True
+        location.status = 'sharing'
+        location.has_shared_before = True
+        for field, value in defaults.items():
+            setattr(location, field, value)
+        location.save()
+
+    logger.info(f"位置情報一括反映: {participant_id} ({len(fixes)}件)")
+    return location, created
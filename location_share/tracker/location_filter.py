@@ -0,0 +1,192 @@
+# tracker/location_filter.py - GPS ジッター抑制フィルター
+import logging
+import threading
+import time
+from math import radians, cos, sin, asin, sqrt
+from typing import Dict, Any, Optional, Tuple, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def haversine_distance(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """2点間のハバーサイン距離（メートル）
+
+    スカラー計算はすべてこの関数を使う。行列計算は distance_matrix.pairwise_distance_bearing。
+    """
+    lng1, lat1, lng2, lat2 = map(radians, [lng1, lat1, lng2, lat2])
+    dlng = lng2 - lng1
+    dlat = lat2 - lat1
+    a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_M * asin(sqrt(a))
+
+
+class FilterDecision(NamedTuple):
+    """フィルター判定結果"""
+    accept: bool            # True: 保存・ブロードキャストする
+    latitude: float         # 保存に使う（平滑化済み）緯度
+    longitude: float        # 保存に使う（平滑化済み）経度
+    accuracy: Optional[float]
+    touch_presence: bool    # 破棄時に最終確認時刻のみ更新するか
+    reason: str
+
+
+class _ParticipantState:
+    """参加者ごとのフィルター状態"""
+    __slots__ = (
+        'lat', 'lng', 'variance', 'updated_at',
+        'written_lat', 'written_lng', 'written_accuracy', 'written_at',
+        'touched_at', 'attrs',
+    )
+
+    def __init__(self, lat: float, lng: float, accuracy: float, attrs: Tuple, now: float):
+        self.lat = lat
+        self.lng = lng
+        self.variance = accuracy ** 2
+        self.updated_at = now
+        self.written_lat = lat
+        self.written_lng = lng
+        self.written_accuracy = accuracy
+        self.written_at = now
+        self.touched_at = now
+        self.attrs = attrs
+
+
+class LocationJitterFilter:
+    """参加者ごとの位置情報フィルター
+
+    スカラーカルマンフィルターで位置を平滑化し、精度・距離のデッドバンド内に
+    収まる更新（静止中の端末が送る数mの揺れ）を破棄する。
+    破棄された更新は保存・ブロードキャストせず、最終確認時刻のみ更新する。
+    """
+
+    def __init__(self, min_distance: float = 5.0, accuracy_factor: float = 0.5,
+                 max_accuracy: float = 100.0, max_silence: float = 60.0,
+                 snap_distance: float = 100.0, process_noise: float = 10.0,
+                 default_accuracy: float = 30.0, presence_touch_interval: float = 15.0,
+                 state_ttl: float = 3600.0, enabled: bool = True):
+        self.min_distance = min_distance
+        self.accuracy_factor = accuracy_factor
+        self.max_accuracy = max_accuracy
+        self.max_silence = max_silence
+        self.snap_distance = snap_distance
+        self.process_noise = process_noise
+        self.default_accuracy = default_accuracy
+        self.presence_touch_interval = presence_touch_interval
+        self.state_ttl = state_ttl
+        self.enabled = enabled
+
+        self._states: Dict[Tuple[str, str], _ParticipantState] = {}
+        self._lock = threading.Lock()
+        self._last_prune = time.monotonic()
+        self._stats = {
+            'fixes_received': 0,
+            'fixes_accepted': 0,
+            'writes_saved': 0,
+            'broadcasts_saved': 0,
+            'presence_touches': 0,
+        }
+
+    def process(self, session_id: str, participant_id: str, latitude: float, longitude: float,
+                accuracy: Optional[float] = None, attrs: Tuple = ()) -> FilterDecision:
+        """位置情報を評価して保存すべきか判定
+
+        attrs には保存内容に影響する属性（名前・バックグラウンド状態など）を渡す。
+        前回保存時と異なる場合は必ず保存する。
+        """
+        if not self.enabled:
+            return FilterDecision(True, latitude, longitude, accuracy, False, 'disabled')
+
+        now = time.monotonic()
+        key = (str(session_id), str(participant_id))
+        acc = float(accuracy) if accuracy else self.default_accuracy
+
+        with self._lock:
+            self._stats['fixes_received'] += 1
+            self._prune(now)
+
+            state = self._states.get(key)
+            if state is None or state.attrs != attrs:
+                self._states[key] = _ParticipantState(latitude, longitude, acc, attrs, now)
+                return self._accept(latitude, longitude, accuracy, 'initial' if state is None else 'attrs_changed')
+
+            # 大きな移動は平滑化せずにそのまま採用
+            raw_distance = haversine_distance(state.written_lat, state.written_lng, latitude, longitude)
+            if raw_distance >= self.snap_distance:
+                self._states[key] = _ParticipantState(latitude, longitude, acc, attrs, now)
+                return self._accept(latitude, longitude, accuracy, 'snap')
+
+            # カルマンフィルター（経過時間に応じて分散を増やし、精度で重み付け）
+            dt = max(0.0, now - state.updated_at)
+            variance = state.variance + self.process_noise * dt
+            gain = variance / (variance + acc ** 2)
+            state.lat += gain * (latitude - state.lat)
+            state.lng += gain * (longitude - state.lng)
+            state.variance = (1 - gain) * variance
+            state.updated_at = now
+
+            silence = now - state.written_at
+            moved = haversine_distance(state.written_lat, state.written_lng, state.lat, state.lng)
+            deadband = max(self.min_distance, self.accuracy_factor * acc)
+
+            if acc > self.max_accuracy and acc >= state.written_accuracy and silence < self.max_silence:
+                return self._absorb(state, now, accuracy, 'poor_accuracy')
+
+            if moved < deadband and silence < self.max_silence:
+                return self._absorb(state, now, accuracy, 'deadband')
+
+            state.written_lat = state.lat
+            state.written_lng = state.lng
+            state.written_accuracy = acc
+            state.written_at = now
+            state.touched_at = now
+            return self._accept(state.lat, state.lng, accuracy, 'moved' if moved >= deadband else 'max_silence')
+
+    def reset(self, session_id: str, participant_id: str):
+        """参加者のフィルター状態を破棄（状態変更時・退出時）"""
+        with self._lock:
+            self._states.pop((str(session_id), str(participant_id)), None)
+
+    def discard_session(self, session_id: str):
+        """セッション全体のフィルター状態を破棄"""
+        session_id = str(session_id)
+        with self._lock:
+            for key in [k for k in self._states if k[0] == session_id]:
+                del self._states[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """削減できた書き込み・ブロードキャスト数などの統計"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['tracked_participants'] = len(self._states)
+        return stats
+
+    # === 内部処理 ===
+
+    def _accept(self, latitude, longitude, accuracy, reason) -> FilterDecision:
+        self._stats['fixes_accepted'] += 1
+        return FilterDecision(True, latitude, longitude, accuracy, False, reason)
+
+    def _absorb(self, state: _ParticipantState, now: float, accuracy, reason) -> FilterDecision:
+        self._stats['writes_saved'] += 1
+        self._stats['broadcasts_saved'] += 1
+
+        touch = now - state.touched_at >= self.presence_touch_interval
+        if touch:
+            state.touched_at = now
+            self._stats['presence_touches'] += 1
+
+        if self._stats['writes_saved'] % 500 == 0:
+            logger.info(f"ジッターフィルター統計: {self._stats}")
+
+        return FilterDecision(False, state.written_lat, state.written_lng, accuracy, touch, reason)
+
+    def _prune(self, now: float):
+        """長時間更新のない状態を削除"""
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        stale = [k for k, s in self._states.items() if now - s.updated_at > self.state_ttl]
+        for key in stale:
+            del self._states[key]
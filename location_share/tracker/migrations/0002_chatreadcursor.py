@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-19 05:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatReadCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('participant_id', models.CharField(max_length=50)),
+                ('conversation', models.CharField(help_text="'group' または個別チャット相手の参加者ID", max_length=50)),
+                ('last_read_message_id', models.BigIntegerField(default=0)),
+                ('unread_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_read_cursors', to='tracker.locationsession')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['session', 'conversation'], name='tracker_cha_session_344cd6_idx')],
+                'unique_together': {('session', 'participant_id', 'conversation')},
+            },
+        ),
+    ]
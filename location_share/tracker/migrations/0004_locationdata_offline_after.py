@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0003_chatmessage_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='locationdata',
+            name='offline_after',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='この時刻を過ぎたらオフラインにする（切断時に設定）', null=True),
+        ),
+    ]
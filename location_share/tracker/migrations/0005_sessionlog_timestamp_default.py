@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:03
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0004_locationdata_offline_after'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sessionlog',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
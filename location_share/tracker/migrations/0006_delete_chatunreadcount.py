@@ -0,0 +1,16 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:34
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0005_sessionlog_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='ChatUnreadCount',
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:35
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_last_read_at(apps, schema_editor):
+    """既存のカーソルには最終既読メッセージの時刻を設定"""
+    ChatMessage = apps.get_model('tracker', 'ChatMessage')
+    ChatReadCursor = apps.get_model('tracker', 'ChatReadCursor')
+    ChatReadCursor.objects.filter(last_read_message_id__gt=0).update(
+        last_read_at=Subquery(
+            ChatMessage.objects.filter(id=OuterRef('last_read_message_id')).values('timestamp')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0006_delete_chatunreadcount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatreadcursor',
+            name='last_read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_last_read_at, migrations.RunPython.noop),
+    ]
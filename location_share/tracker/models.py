@@ -91,6 +91,7 @@ class LocationData(models.Model):
     # === 新規追加：オフライン参加者対応フィールド ===
     has_shared_before = models.BooleanField(default=False, help_text="一度でも位置情報を共有した履歴")
     last_seen_at = models.DateTimeField(null=True, blank=True, help_text="最後に確認した時刻")
+    offline_after = models.DateTimeField(null=True, blank=True, db_index=True, help_text="この時刻を過ぎたらオフラインにする（切断時に設定）")
     # === 滞在時間関連フィールド（新規追加） ===
     stay_start_time = models.DateTimeField(null=True, blank=True, help_text="現在位置での滞在開始時刻")
     last_move_time = models.DateTimeField(null=True, blank=True, help_text="最後に移動した時刻")
@@ -207,7 +208,7 @@ class SessionLog(models.Model):
     participant_id = models.CharField(max_length=50, blank=True)
     ip_address = models.GenericIPAddressField(blank=True, null=True)
     user_agent = models.TextField(blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)  # キュー投入時刻を保存
     
     # WebSocket関連の追加情報
     connection_id = models.CharField(max_length=100, blank=True)  # WebSocket接続ID
@@ -275,7 +276,7 @@ class ChatMessage(models.Model):
     sender_name = models.CharField(max_length=100)
     target_id = models.CharField(max_length=50, blank=True, null=True)
     text = models.TextField(max_length=200)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)  # ブロードキャスト時刻をそのまま保存
     is_read = models.BooleanField(default=False)  # これが必要
     
     class Meta:
@@ -289,14 +290,25 @@ class ChatMessage(models.Model):
     def __str__(self):
         return f"{self.sender_name}: {self.text[:50]}"
     
-# tracker/models.py に追加
-class ChatUnreadCount(models.Model):
-    """チャット未読カウント"""
-    session = models.ForeignKey(LocationSession, on_delete=models.CASCADE)
-    participant_id = models.CharField(max_length=100)
-    group_unread = models.IntegerField(default=0)
-    individual_unread = models.JSONField(default=dict)  # {participant_id: count}
+class ChatReadCursor(models.Model):
+    """チャット既読カーソル（参加者・会話ごとの最終既読メッセージと未読数）
+
+    メッセージIDは送信順とは限らないため、既読位置は (last_read_at, last_read_message_id)
+    の組で比較する（チャット履歴の並び順と同じ）。
+    """
+    session = models.ForeignKey(LocationSession, on_delete=models.CASCADE, related_name='chat_read_cursors')
+    participant_id = models.CharField(max_length=50)
+    conversation = models.CharField(max_length=50, help_text="'group' または個別チャット相手の参加者ID")
+    last_read_message_id = models.BigIntegerField(default=0)
+    last_read_at = models.DateTimeField(null=True, blank=True)
+    unread_count = models.IntegerField(default=0)
     updated_at = models.DateTimeField(auto_now=True)
-    
+
     class Meta:
-        unique_together = ['session', 'participant_id']
\ No newline at end of file
+        unique_together = ['session', 'participant_id', 'conversation']
+        indexes = [
+            models.Index(fields=['session', 'conversation']),
+        ]
+
+    def __str__(self):
+        return f"{self.participant_id} - {self.conversation}: {self.unread_count}"
@@ -0,0 +1,92 @@
+# tracker/participant_identity.py - 参加者IDの署名付きCookie・WebSocketトークン
+import logging
+import uuid
+from datetime import datetime, timezone as dt_timezone
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.core import signing
+from django.core.signing import BadSignature
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+PARTICIPANT_COOKIE_SALT = 'tracker.participant'
+MIN_COOKIE_AGE = 60  # 期限間近のセッションでもすぐに消えないように
+SOCKET_TOKEN_SALT = 'tracker.socket'
+SOCKET_TOKEN_MAX_AGE = 24 * 60 * 60  # 最長のセッション時間より長く（開いたままのページから再接続できるように）
+
+
+class SocketIdentity(NamedTuple):
+    """WebSocketトークンに含まれる情報"""
+    session_pk: int
+    participant_id: str
+    expires_at: datetime
+
+
+def participant_cookie_name(session_id) -> str:
+    return f'participant_{session_id}'
+
+
+def get_participant_id(request, session_id) -> Optional[str]:
+    """Cookie から参加者IDを取得（改ざん・期限切れの場合は None）
+
+    DBセッションに保存していた旧形式の値も、セッションCookieがある場合に限り読み出す。
+    """
+    name = participant_cookie_name(session_id)
+    try:
+        participant_id = request.get_signed_cookie(name, default=None, salt=PARTICIPANT_COOKIE_SALT)
+    except BadSignature:
+        logger.warning(f"Invalid participant cookie: {session_id}")
+        participant_id = None
+
+    if not participant_id and settings.SESSION_COOKIE_NAME in request.COOKIES:
+        participant_id = request.session.get(name)
+
+    try:
+        return str(uuid.UUID(participant_id)) if participant_id else None
+    except ValueError:
+        return None
+
+
+def remember_participant(response, session, participant_id: str):
+    """参加者IDを署名付きCookieに保存（位置情報セッションの期限まで有効）"""
+    max_age = max(MIN_COOKIE_AGE, int((session.expires_at - timezone.now()).total_seconds()))
+    response.set_signed_cookie(
+        participant_cookie_name(session.session_id),
+        participant_id,
+        salt=PARTICIPANT_COOKIE_SALT,
+        max_age=max_age,
+        secure=settings.SESSION_COOKIE_SECURE,
+        httponly=True,
+        # 共有リンクを他サイトから開いた場合も同じ参加者として扱う
+        samesite='Lax',
+    )
+
+
+def make_socket_token(session, participant_id: str) -> str:
+    """WebSocket接続用の署名付きトークンを発行
+
+    セッションの主キーと期限を含めるため、接続時にDBを参照せずに検証できる。
+    """
+    return signing.dumps({
+        's': str(session.session_id),
+        'k': session.pk,
+        'p': participant_id,
+        'e': int(session.expires_at.timestamp()),
+    }, salt=SOCKET_TOKEN_SALT)
+
+
+def verify_socket_token(token: str, session_id) -> Optional[SocketIdentity]:
+    """トークンを検証（別セッションのもの・改ざん・有効期間切れの場合は None）"""
+    try:
+        payload = signing.loads(token, salt=SOCKET_TOKEN_SALT, max_age=SOCKET_TOKEN_MAX_AGE)
+        if payload['s'] != str(session_id):
+            return None
+        return SocketIdentity(
+            session_pk=int(payload['k']),
+            participant_id=str(uuid.UUID(payload['p'])),
+            expires_at=datetime.fromtimestamp(payload['e'], tz=dt_timezone.utc),
+        )
+    except (BadSignature, KeyError, TypeError, ValueError):
+        return None
@@ -0,0 +1,57 @@
+# tracker/presence.py - オンライン状態の定期スイープ
+import asyncio
+import logging
+from typing import Awaitable, Callable, Iterable, Optional
+
+from channels.db import database_sync_to_async
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceSweeper:
+    """一定間隔で古くなった参加者をまとめてオフラインにする
+
+    sweep は同期関数で、1回のUPDATEで状態を変更し、影響を受けたセッションIDを返す。
+    on_changed はセッションごとに1回だけ呼ばれる（名簿変更のブロードキャスト）。
+    切断ごとのタイマーやスレッドは持たないため、コストはセッション数に比例する。
+    """
+
+    def __init__(self, sweep: Callable[[], Iterable[str]],
+                 on_changed: Callable[[str], Awaitable[None]], interval: float = 15.0):
+        self.sweep = sweep
+        self.on_changed = on_changed
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {'sweeps': 0, 'sessions_changed': 0}
+
+    def ensure_started(self):
+        """実行中のイベントループでスイープを開始（起動済みなら何もしない）"""
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._task.get_loop() is loop:
+            return
+        self._task = loop.create_task(self._run())
+
+    async def sweep_once(self) -> int:
+        """1回分のスイープを実行し、変更のあったセッション数を返す"""
+        session_ids = await database_sync_to_async(self.sweep)()
+        for session_id in session_ids:
+            try:
+                await self.on_changed(session_id)
+            except Exception as e:
+                logger.error(f"Presence broadcast error: {str(e)}")
+        self._stats['sweeps'] += 1
+        self._stats['sessions_changed'] += len(session_ids)
+        return len(session_ids)
+
+    def get_stats(self):
+        return dict(self._stats)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Presence sweep error: {str(e)}")
@@ -0,0 +1,230 @@
+# tracker/rate_limit.py - トークンバケットによるレート制限（ビュー・コンシューマー共通）
+import asyncio
+import logging
+import threading
+import time
+from collections import Counter
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+
+try:
+    import redis
+    import redis.asyncio as redis_asyncio
+except ImportError:  # 共有バックエンドを使わない構成（開発環境など）
+    redis = None
+    redis_asyncio = None
+
+logger = logging.getLogger(__name__)
+
+
+class Limit(NamedTuple):
+    """1分あたりの回数と、連続して許可する最大回数"""
+    per_minute: float
+    burst: int
+
+    @property
+    def rate(self) -> float:
+        return self.per_minute / 60.0
+
+
+# 残りトークンを補充してから消費する（1キーにつき1回のアトミックな実行）
+_TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return allowed
+"""
+
+# 同時接続数（上限を超えたら取り消す）
+_ACQUIRE_SCRIPT = """
+local count = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
+if count > tonumber(ARGV[1]) then
+    redis.call('DECR', KEYS[1])
+    return 0
+end
+return 1
+"""
+
+_RELEASE_SCRIPT = """
+local count = redis.call('DECR', KEYS[1])
+if count <= 0 then
+    redis.call('DEL', KEYS[1])
+end
+return count
+"""
+
+
+class _LocalBackend:
+    """プロセス内のバケット（共有バックエンドがない場合）"""
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._buckets: Dict[str, Tuple[float, float, Limit]] = {}  # キー -> (残りトークン, 更新時刻, 制限)
+        self._slots: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, limit: Limit, cost: int, now: float) -> bool:
+        with self._lock:
+            tokens, ts, _ = self._buckets.get(key, (limit.burst, now, limit))
+            tokens = min(limit.burst, tokens + max(0.0, now - ts) * limit.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now, limit)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+            return allowed
+
+    def acquire(self, key: str, max_count: int, ttl: int) -> bool:
+        with self._lock:
+            if self._slots[key] >= max_count:
+                return False
+            self._slots[key] += 1
+            return True
+
+    def release(self, key: str):
+        with self._lock:
+            self._slots[key] -= 1
+            if self._slots[key] <= 0:
+                del self._slots[key]
+
+    def _prune(self, now: float):
+        # 満タンまで回復したバケットは消しても結果が変わらない（回復時間はバケットごとの制限で判定）
+        for key, (tokens, ts, limit) in list(self._buckets.items()):
+            if tokens + (now - ts) * limit.rate >= limit.burst:
+                del self._buckets[key]
+
+
+class RateLimiter:
+    """トークンバケットによるレート制限
+
+    redis_url を指定すると全プロセスで共有するバケットを Redis 上に持ち、
+    補充と消費を Lua スクリプトでアトミックに行う。非同期版の allow() は
+    redis.asyncio を使うためイベントループを止めない。未指定の場合や
+    redis パッケージがない場合はプロセス内のバケットを使う。
+    Redis に接続できない場合はリクエストを許可し、エラー件数を記録する。
+    """
+
+    def __init__(self, redis_url: Optional[str] = None, prefix: str = 'ratelimit'):
+        self.prefix = prefix
+        self._local = _LocalBackend()
+        self._redis_url = redis_url if redis is not None else None
+        self._sync_client = None
+        self._async_client = None
+        self._async_loop = None
+        self._stats = Counter()
+        self._stats_lock = threading.Lock()
+        if redis_url and redis is None:
+            logger.warning("redis パッケージがないため、レート制限はプロセス内で行います")
+
+    @property
+    def shared(self) -> bool:
+        return self._redis_url is not None
+
+    # === トークンバケット ===
+
+    def allow_sync(self, scope: str, identifier: str, limit: Limit, cost: int = 1) -> bool:
+        """同期版（同期ビュー用）"""
+        key = self._key(scope, identifier)
+        now = time.time()
+        if not self.shared:
+            return self._record(scope, identifier, self._local.take(key, limit, cost, now))
+        try:
+            client = self._get_sync_client()
+            allowed = client.eval(_TOKEN_BUCKET_SCRIPT, 1, key, limit.rate, limit.burst, now, cost)
+            return self._record(scope, identifier, bool(allowed))
+        except Exception as e:
+            return self._backend_error(scope, e)
+
+    async def allow(self, scope: str, identifier: str, limit: Limit, cost: int = 1) -> bool:
+        """非同期版（非同期ビュー・コンシューマー用）"""
+        key = self._key(scope, identifier)
+        now = time.time()
+        if not self.shared:
+            return self._record(scope, identifier, self._local.take(key, limit, cost, now))
+        try:
+            client = self._get_async_client()
+            allowed = await client.eval(_TOKEN_BUCKET_SCRIPT, 1, key, limit.rate, limit.burst, now, cost)
+            return self._record(scope, identifier, bool(allowed))
+        except Exception as e:
+            return self._backend_error(scope, e)
+
+    # === 同時実行数 ===
+
+    async def acquire(self, scope: str, identifier: str, max_count: int, ttl: int = 21600) -> bool:
+        """同時実行数の枠を確保（成功したら必ず release() する）"""
+        key = self._key(scope, identifier)
+        if not self.shared:
+            return self._record(scope, identifier, self._local.acquire(key, max_count, ttl))
+        try:
+            client = self._get_async_client()
+            allowed = await client.eval(_ACQUIRE_SCRIPT, 1, key, max_count, ttl)
+            return self._record(scope, identifier, bool(allowed))
+        except Exception as e:
+            return self._backend_error(scope, e)
+
+    async def release(self, scope: str, identifier: str):
+        """確保した枠を返す"""
+        key = self._key(scope, identifier)
+        if not self.shared:
+            self._local.release(key)
+            return
+        try:
+            client = self._get_async_client()
+            await client.eval(_RELEASE_SCRIPT, 1, key)
+        except Exception as e:
+            logger.error(f"Rate limit release error: {str(e)}")
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['shared'] = self.shared
+        return stats
+
+    # === 内部処理 ===
+
+    def _key(self, scope: str, identifier: str) -> str:
+        return f'{self.prefix}:{scope}:{identifier}'
+
+    def _record(self, scope: str, identifier: str, allowed: bool) -> bool:
+        with self._stats_lock:
+            self._stats[f'{scope}_allowed' if allowed else f'{scope}_rejected'] += 1
+        if not allowed:
+            logger.warning(f"Rate limit exceeded: {scope} {identifier}")
+        return allowed
+
+    def _backend_error(self, scope: str, error: Exception) -> bool:
+        with self._stats_lock:
+            self._stats['backend_errors'] += 1
+        logger.error(f"Rate limit backend error ({scope}): {str(error)}")
+        return True
+
+    def _get_sync_client(self):
+        if self._sync_client is None:
+            self._sync_client = redis.Redis.from_url(self._redis_url, socket_timeout=0.5)
+        return self._sync_client
+
+    def _get_async_client(self):
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            # 接続プールはイベントループごとに作り直す
+            self._async_client = redis_asyncio.Redis.from_url(self._redis_url, socket_timeout=0.5)
+            self._async_loop = loop
+        return self._async_client
+
+
+rate_limiter = RateLimiter(getattr(settings, 'RATE_LIMIT_REDIS_URL', None))
@@ -0,0 +1,103 @@
+# tracker/reporting_rate.py - サーバー主導の送信間隔制御
+import threading
+import time
+from collections import deque
+from typing import Dict
+
+
+class WorkerLoadMonitor:
+    """プロセス内のWebSocket受信レートを計測"""
+
+    def __init__(self, window_seconds: int = 10):
+        self.window_seconds = window_seconds
+        self._buckets = deque()  # [(秒, 件数)]
+        self._lock = threading.Lock()
+
+    def record(self, count: int = 1):
+        """受信メッセージを記録"""
+        now = int(time.monotonic())
+        with self._lock:
+            if self._buckets and self._buckets[-1][0] == now:
+                self._buckets[-1][1] += count
+            else:
+                self._buckets.append([now, count])
+            self._trim(now)
+
+    def messages_per_second(self) -> float:
+        """直近ウィンドウの平均受信レート"""
+        now = int(time.monotonic())
+        with self._lock:
+            self._trim(now)
+            total = sum(count for _, count in self._buckets)
+        return total / self.window_seconds
+
+    def _trim(self, now: int):
+        while self._buckets and self._buckets[0][0] <= now - self.window_seconds:
+            self._buckets.popleft()
+
+
+class ReportingRateController:
+    """参加者ごとの推奨送信間隔を計算
+
+    移動状態・セッション人数・閲覧者数・ワーカー負荷から、位置情報の送信間隔と
+    ping間隔（ミリ秒）を決める。静止中・誰にも見られていない参加者や、
+    負荷の高いワーカーでは間隔を広げる。
+    """
+
+    def __init__(self, moving_interval: float = 1, stationary_interval: float = 15,
+                 background_interval: float = 15, unwatched_interval: float = 60,
+                 min_interval: float = 1, max_interval: float = 120,
+                 ping_interval: float = 60, background_ping_interval: float = 20,
+                 max_ping_interval: float = 90, max_background_ping_interval: float = 30,
+                 size_threshold: int = 5, size_step: float = 0.1,
+                 target_messages_per_second: float = 200, max_load_factor: float = 4,
+                 load_monitor: WorkerLoadMonitor = None):
+        self.moving_interval = moving_interval
+        self.stationary_interval = stationary_interval
+        self.background_interval = background_interval
+        self.unwatched_interval = unwatched_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.ping_interval = ping_interval
+        self.background_ping_interval = background_ping_interval
+        self.max_ping_interval = max_ping_interval
+        self.max_background_ping_interval = max_background_ping_interval
+        self.size_threshold = size_threshold
+        self.size_step = size_step
+        self.target_messages_per_second = target_messages_per_second
+        self.max_load_factor = max_load_factor
+        self.load_monitor = load_monitor or WorkerLoadMonitor()
+
+    def load_factor(self) -> float:
+        """ワーカー負荷に応じた倍率（1.0 = 通常）"""
+        mps = self.load_monitor.messages_per_second()
+        if mps <= self.target_messages_per_second:
+            return 1.0
+        return min(self.max_load_factor, mps / self.target_messages_per_second)
+
+    def recommend(self, is_moving: bool, is_background: bool,
+                  participant_count: int, viewer_count: int) -> Dict[str, int]:
+        """推奨送信間隔を計算（ミリ秒）"""
+        load = self.load_factor()
+
+        interval = self.moving_interval if is_moving else self.stationary_interval
+        if is_background:
+            interval = max(interval, self.background_interval)
+        if viewer_count <= 0:
+            interval = max(interval, self.unwatched_interval)
+
+        # 参加者が多いほどファンアウトが増えるため間隔を広げる
+        size_factor = 1 + max(0, participant_count - self.size_threshold) * self.size_step
+        interval = interval * size_factor * load
+        interval = max(self.min_interval, min(self.max_interval, interval))
+
+        # pingは接続維持が目的のため、バックグラウンドでは上限を低く保つ
+        if is_background:
+            ping = min(self.max_background_ping_interval, self.background_ping_interval * load)
+        else:
+            ping = min(self.max_ping_interval, self.ping_interval * load)
+
+        return {
+            'report_interval': int(interval * 1000),
+            'ping_interval': int(ping * 1000),
+        }
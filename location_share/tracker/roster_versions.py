@@ -0,0 +1,73 @@
+# tracker/roster_versions.py - ポーリング用の名簿バージョン（ETag）
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Tuple
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils import timezone
+
+
+class RosterVersions:
+    """セッションごとの名簿バージョンと更新時刻
+
+    参加者の書き込み（名簿のブロードキャスト）ごとに bump() で新しいバージョンを発行し、
+    ポーリングAPIは get() の値だけで 304 を返せるかを判定する。値はDjangoのキャッシュに
+    保存するため、複数プロセス構成では共有キャッシュ（Redis等）が前提となる。
+    キャッシュから消えた場合は新しいバージョンを発行するので、古いETagとは一致しない。
+    プロセス内キャッシュでは他のプロセスの bump() が見えないため、shared が False になり、
+    304 の判定・名簿の共有・ETagによる差分通知は行わない。
+    """
+
+    def __init__(self, timeout: int = 86400, snapshot_timeout: int = 30, prefix: str = 'roster_version'):
+        self.timeout = timeout
+        self.snapshot_timeout = snapshot_timeout
+        self.prefix = prefix
+
+    @property
+    def shared(self) -> bool:
+        """バージョンが全プロセスで共有されるキャッシュに保存されているか"""
+        return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+    def bump(self, session_id: str) -> Tuple[str, datetime]:
+        """名簿が変わったときに呼ぶ"""
+        entry = self._new_entry()
+        cache.set(self._key(session_id), entry, self.timeout)
+        return entry
+
+    def get(self, session_id: str) -> Tuple[str, datetime]:
+        """現在の (ETag, 更新時刻)"""
+        key = self._key(session_id)
+        entry = cache.get(key)
+        if entry is None:
+            entry = self._new_entry()
+            if not cache.add(key, entry, self.timeout):
+                entry = cache.get(key) or entry
+        return entry
+
+    def snapshot(self, session_id: str, loader: Callable[[], Any]) -> Tuple[str, Any]:
+        """現在のETagと、そのバージョンの名簿（同じバージョンの間は loader を1回だけ呼ぶ）
+
+        ETagを先に読むため、名簿はETagの時点以降の内容になる（古い名簿に新しいETagは付かない）。
+        滞在時間など時刻で変わる値があるため、キャッシュは snapshot_timeout 秒で破棄する。
+        """
+        etag, _ = self.get(session_id)
+        if not self.shared:
+            return etag, loader()
+        data = cache.get_or_set(f'{self._key(session_id)}:snapshot:{etag}', loader, self.snapshot_timeout)
+        return etag, data
+
+    def is_current(self, session_id: str, etag) -> bool:
+        """クライアントが持つETagが最新か"""
+        return self.shared and bool(etag) and etag == self.get(session_id)[0]
+
+    def _key(self, session_id: str) -> str:
+        return f'{self.prefix}:{session_id}'
+
+    @staticmethod
+    def _new_entry() -> Tuple[str, datetime]:
+        return f'"{uuid.uuid4().hex[:16]}"', timezone.now()
+
+
+roster_versions = RosterVersions()
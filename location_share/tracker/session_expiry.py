@@ -0,0 +1,69 @@
+# tracker/session_expiry.py - セッション期限切れのプッシュ通知
+import asyncio
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class _Watch:
+    __slots__ = ('handle', 'refs')
+
+    def __init__(self, handle: asyncio.TimerHandle):
+        self.handle = handle
+        self.refs = 1
+
+
+class SessionExpiryScheduler:
+    """接続中のセッションごとに期限切れ時刻のタイマーを1つだけ持つ
+
+    同じセッションの接続数を参照カウントで管理し、最後の接続が切れたら
+    タイマーを解除する。期限に達したら on_expire(session_id) を呼ぶ。
+    """
+
+    def __init__(self, on_expire: Callable[[str], Awaitable[None]]):
+        self.on_expire = on_expire
+        self._watches: Dict[str, _Watch] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def watch(self, session_id: str, expires_at: datetime):
+        """接続の開始時に呼ぶ（初回のみタイマーを設定）"""
+        session_id = str(session_id)
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # イベントループが変わった場合（テスト・再起動）は作り直す
+            self._loop = loop
+            self._watches = {}
+
+        watch = self._watches.get(session_id)
+        if watch is not None:
+            watch.refs += 1
+            return
+
+        delay = max(0.0, (expires_at - timezone.now()).total_seconds())
+        handle = loop.call_later(delay, lambda: loop.create_task(self._fire(session_id)))
+        self._watches[session_id] = _Watch(handle)
+
+    def unwatch(self, session_id: str):
+        """接続の終了時に呼ぶ（最後の接続ならタイマーを解除）"""
+        session_id = str(session_id)
+        watch = self._watches.get(session_id)
+        if watch is None:
+            return
+        watch.refs -= 1
+        if watch.refs <= 0:
+            watch.handle.cancel()
+            del self._watches[session_id]
+
+    def active_sessions(self) -> int:
+        return len(self._watches)
+
+    async def _fire(self, session_id: str):
+        self._watches.pop(session_id, None)
+        try:
+            await self.on_expire(session_id)
+        except Exception as e:
+            logger.error(f"Session expiry error: {str(e)}")
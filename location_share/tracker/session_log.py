@@ -0,0 +1,128 @@
+# tracker/session_log.py - セッションログの非同期書き込み
+import atexit
+import logging
+import queue
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import SessionLog
+
+logger = logging.getLogger(__name__)
+
+
+class SessionLogSink:
+    """SessionLog をプロセス内のキューに積み、バックグラウンドスレッドでまとめて保存
+
+    リクエスト処理・WebSocket処理から INSERT を切り離す。sample_rates で指定した
+    アクションは一定割合のみ記録し、キューが shed_ratio を超えたら記録を止める。
+    キューが満杯の場合は待たずに破棄して件数を記録する（ログのために応答を遅らせない）。
+    """
+
+    def __init__(self, max_queue: int = 10000, max_batch: int = 500, flush_interval: float = 1.0,
+                 sample_rates: Optional[Dict[str, float]] = None, shed_ratio: float = 0.5):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.sample_rates = sample_rates or {}
+        self.shed_size = int(max_queue * shed_ratio)
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stats = {'queued': 0, 'written': 0, 'failed': 0, 'batches': 0, 'sampled_out': 0, 'dropped': 0}
+
+    def log(self, session, action: str, **fields) -> bool:
+        """ログを記録（session はインスタンスまたは主キー）。キューに積んだら True"""
+        rate = self.sample_rates.get(action)
+        if rate is not None:
+            # 高頻度のアクションは間引き、混雑時は記録しない
+            if random.random() >= rate or self._queue.qsize() >= self.shed_size:
+                self._count('sampled_out')
+                return False
+
+        fields.setdefault('timestamp', timezone.now())
+        entry = SessionLog(session_id=getattr(session, 'pk', session), action=action, **fields)
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            dropped = self._count('dropped')
+            if dropped % 1000 == 1:
+                logger.warning(f"SessionLog queue full: {dropped}件破棄")
+            return False
+
+        self._count('queued')
+        self._ensure_started()
+        return True
+
+    def flush(self):
+        """キューに残っているログをこのスレッドで保存（終了時・テスト用）"""
+        while True:
+            batch = self._drain(self.max_batch)
+            if not batch:
+                return
+            self._write(batch)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.qsize()
+        return stats
+
+    # === 内部処理 ===
+
+    def _count(self, key: str) -> int:
+        with self._lock:
+            self._stats[key] += 1
+            return self._stats[key]
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='session-log-sink', daemon=True)
+                self._thread.start()
+
+    def _drain(self, limit: int) -> List[SessionLog]:
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # 最初の1件から flush_interval 秒、または max_batch 件までまとめる
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch: List[SessionLog]):
+        try:
+            close_old_connections()
+            SessionLog.objects.bulk_create(batch, batch_size=self.max_batch)
+            with self._lock:
+                self._stats['written'] += len(batch)
+                self._stats['batches'] += 1
+        except Exception as e:
+            logger.error(f"SessionLog batch save error: {str(e)}")
+            with self._lock:
+                self._stats['failed'] += len(batch)
+
+
+# 位置更新は件数が多いため1割のみ記録
+session_log = SessionLogSink(sample_rates={'location_updated': 0.1})
+atexit.register(session_log.flush)
@@ -0,0 +1,1543 @@
+// chat.js - チャット機能（location-sharing.js から遅延読み込み）
+
+class ChatManager {
+    constructor() {
+        this.currentChatTarget = null;
+        this.messages = {
+            group: [],
+            individual: {}
+        };
+        this.unreadCounts = {
+            group: 0,
+            individual: {}
+        };
+        this.typingTimers = {};
+        this.isTyping = {};
+        // ★ 過去履歴の読み込み用カーソル（null = これ以上古い履歴なし）
+        this.historyCursors = {
+            group: null,
+            individual: {}
+        };
+        this.loadingOlderHistory = {};
+        this.participantStatusInterval = null;
+        this.rapidStatusInterval = null;
+        this.scrollPosition = 0;
+        
+        this.initElements();
+        this.startStatusUpdateTimer();
+        this.loadMessages();
+        
+        // モーダル外クリックで閉じる
+        this.chatModal?.addEventListener('click', (e) => {
+            if (e.target === this.chatModal) {
+                this.closeChat();
+            }
+        });
+        this.typingStates = {}; // 入力状態を管理
+        this.typingCheckIntervals = {}; // 入力状態チェック用インターバル
+        // 二重タップ防止用のフラグ
+        this.isTransitioning = false;
+        this.lastTapTime = 0;
+    }
+    
+    initElements() {
+    this.chatButton = document.getElementById('chat-button');
+    this.chatBadge = document.getElementById('chat-badge');
+    this.chatModal = document.getElementById('chat-modal');
+    
+    // イベントリスナー
+    this.chatButton?.addEventListener('click', () => this.openChat());
+    
+    // モーダル外クリックで閉じる
+    this.chatModal?.addEventListener('click', (e) => {
+        if (e.target === this.chatModal) {
+            this.closeChat();
+        }
+    });
+    
+    // 入力中表示のイベントリスナーを追加
+        const groupInput = document.getElementById('group-input');
+        const individualInput = document.getElementById('individual-input');
+    
+        if (groupInput) {
+            // 入力開始時
+            groupInput.addEventListener('input', () => {
+                this.handleTypingStart('group', groupInput);
+            });
+            
+            // フォーカス喪失時
+            groupInput.addEventListener('blur', () => {
+                this.handleTypingEnd('group');
+            });
+        }
+        
+        if (individualInput) {
+            individualInput.addEventListener('input', () => {
+                if (this.currentChatTarget) {
+                    this.handleTypingStart(this.currentChatTarget, individualInput);
+                }
+            });
+            
+            individualInput.addEventListener('blur', () => {
+                if (this.currentChatTarget) {
+                    this.handleTypingEnd(this.currentChatTarget);
+                }
+            });
+        }
+
+        
+    
+    // ★ 上端までスクロールしたら過去の履歴を読み込む
+    const groupMessages = document.getElementById('group-messages');
+    const individualMessages = document.getElementById('individual-messages');
+    
+    groupMessages?.addEventListener('scroll', () => {
+        if (groupMessages.scrollTop < 40) {
+            this.requestOlderMessages('group');
+        }
+    }, { passive: true });
+    
+    individualMessages?.addEventListener('scroll', () => {
+        if (individualMessages.scrollTop < 40 && this.currentChatTarget) {
+            this.requestOlderMessages(this.currentChatTarget);
+        }
+    }, { passive: true });
+    
+    // 文字数カウンターを追加
+    ['group-input', 'individual-input'].forEach(id => {
+        const input = document.getElementById(id);
+        if (!input) return;
+        
+        // 既存のカウンターがあれば削除
+        const existingCounter = input.parentElement.querySelector('.char-counter');
+        if (existingCounter) {
+            existingCounter.remove();
+        }
+        
+        // 文字数カウンター要素を作成
+        const counter = document.createElement('div');
+        counter.className = 'char-counter';
+        counter.style.cssText = `
+            position: absolute;
+            right: 50px;
+            bottom: 10px;
+            font-size: 11px;
+            color: #999;
+            pointer-events: none;
+        `;
+        counter.textContent = '0/200';
+        input.parentElement.style.position = 'relative';
+        input.parentElement.appendChild(counter);
+        
+        // 入力時に文字数を更新
+        input.addEventListener('input', () => {
+            const length = input.value.length;
+            counter.textContent = `${length}/200`;
+            
+            if (length > 200) {
+                counter.style.color = '#dc3545';
+                counter.style.fontWeight = 'bold';
+                input.style.borderColor = '#dc3545';
+            } else if (length > 180) {
+                counter.style.color = '#ffc107';
+                counter.style.fontWeight = 'normal';
+                input.style.borderColor = '';
+            } else {
+                counter.style.color = '#999';
+                counter.style.fontWeight = 'normal';
+                input.style.borderColor = '';
+            }
+        });
+        
+        // Enterキーで送信
+        input.addEventListener('keypress', (e) => {
+            if (e.key === 'Enter') {
+                e.preventDefault();
+                const length = input.value.trim().length;
+                if (length > 200) {
+                    this.showMessageLengthError(id === 'group-input' ? 'group' : 'individual');
+                    return;
+                }
+                
+                if (id === 'group-input') {
+                    this.sendGroupMessage();
+                } else {
+                    this.sendIndividualMessage();
+                }
+            }
+        });
+    });
+    
+    // iOS ズーム防止
+    const inputs = document.querySelectorAll('.chat-input, #participant-name');
+    inputs.forEach(input => {
+        input.addEventListener('focus', (e) => {
+            if (/iPhone|iPad|iPod/.test(navigator.userAgent)) {
+                e.preventDefault();
+                e.target.style.fontSize = '16px';
+                setTimeout(() => {
+                    e.target.setSelectionRange(e.target.value.length, e.target.value.length);
+                }, 0);
+            }
+        });
+        
+        let lastTouchEnd = 0;
+        input.addEventListener('touchend', (e) => {
+            const now = Date.now();
+            if (now - lastTouchEnd <= 300) {
+                e.preventDefault();
+            }
+            lastTouchEnd = now;
+        });
+    });
+}
+    
+    // 新規メソッド：入力開始処理
+    handleTypingStart(target, inputElement) {
+        const hasContent = inputElement.value.trim().length > 0;
+        
+        // 初めて文字が入力された場合
+        if (hasContent && !this.typingStates[target]) {
+            this.typingStates[target] = true;
+            
+            // 入力中通知を送信
+            this.sendTypingIndicator(target, true);
+            
+            // 定期的に入力状態をチェック
+            this.startTypingCheck(target, inputElement);
+        }
+        
+        // 文字が全て削除された場合
+        if (!hasContent && this.typingStates[target]) {
+            this.handleTypingEnd(target);
+        }
+    }
+    
+    // 新規メソッド：入力終了処理
+    handleTypingEnd(target) {
+        if (this.typingStates[target]) {
+            this.typingStates[target] = false;
+            
+            // 入力終了通知を送信
+            this.sendTypingIndicator(target, false);
+            
+            // チェックインターバルをクリア
+            this.stopTypingCheck(target);
+        }
+    }
+    
+    // 新規メソッド：定期的な入力状態チェック
+    startTypingCheck(target, inputElement) {
+        // 既存のインターバルをクリア
+        this.stopTypingCheck(target);
+        
+        // 500msごとに入力状態をチェック
+        this.typingCheckIntervals[target] = scheduler.every(`typing-check:${target}`, 500, () => {
+            const hasContent = inputElement.value.trim().length > 0;
+            
+            if (!hasContent && this.typingStates[target]) {
+                // 内容が空になったら入力終了
+                this.handleTypingEnd(target);
+            } else if (hasContent && this.typingStates[target]) {
+                // まだ入力中の場合は継続通知を送信（10秒ごと）
+                const now = Date.now();
+                const lastSent = this.lastTypingSent?.[target] || 0;
+                
+                if (now - lastSent > 10000) { // 10秒経過
+                    this.sendTypingIndicator(target, true);
+                    if (!this.lastTypingSent) this.lastTypingSent = {};
+                    this.lastTypingSent[target] = now;
+                }
+            }
+        });
+    }
+    
+    // 新規メソッド：入力状態チェック停止
+    stopTypingCheck(target) {
+        if (this.typingCheckIntervals[target]) {
+            scheduler.cancel(this.typingCheckIntervals[target]);
+            delete this.typingCheckIntervals[target];
+        }
+    }
+    
+    // 新規メソッド：入力中通知送信
+    sendTypingIndicator(target, isTyping) {
+        wsManager.send({
+            type: 'typing_indicator',
+            chat_type: target === 'group' ? 'group' : 'individual',
+            target_id: target === 'group' ? null : target,
+            sender_id: state.participantId,
+            sender_name: this.getParticipantNameSafe(),
+            is_typing: isTyping
+        });
+    }
+
+    loadMessages() {
+        this.messages = { group: [], individual: {} };
+        this.unreadCounts = { group: 0, individual: {} };
+        
+        // WebSocket接続後にサーバーから履歴と未読カウントを要求
+        const checkAndRequest = () => {
+            if (wsManager && wsManager.websocket && 
+                wsManager.websocket.readyState === WebSocket.OPEN) {
+                const participantId = state.participantId || window.djangoData.participantId;
+                
+                if (participantId) {
+                    wsManager.send({
+                        type: 'request_chat_history',
+                        session_id: state.sessionId,
+                        participant_id: participantId
+                    });
+                } else {
+                    console.error('Participant ID not available');
+                    setTimeout(checkAndRequest, 500);
+                }
+            } else {
+                setTimeout(checkAndRequest, 500);
+            }
+        };
+        
+        setTimeout(checkAndRequest, 1000);
+    }
+    
+    handleChatHistory(data) {
+    if (!data.messages) return;
+    
+    
+    // メッセージを復元
+    this.messages = { group: [], individual: {} };
+    
+    // グループメッセージを復元
+    if (Array.isArray(data.messages.group)) {
+        this.messages.group = data.messages.group;
+    }
+    
+    // 個別メッセージを復元
+    if (data.messages.individual) {
+        Object.keys(data.messages.individual).forEach(conversationPartnerId => {
+            if (!this.messages.individual[conversationPartnerId]) {
+                this.messages.individual[conversationPartnerId] = [];
+            }
+            
+            this.messages.individual[conversationPartnerId] = 
+                data.messages.individual[conversationPartnerId];
+        });
+    }
+    
+    // ★ 過去履歴のカーソルを保存
+    this.historyCursors = {
+        group: data.cursors?.group || null,
+        individual: data.cursors?.individual || {}
+    };
+    this.loadingOlderHistory = {};
+    
+    // 未読カウントを復元（修正版）
+    if (data.unread_counts) {
+        // サーバーから受け取った未読数を使用
+        this.unreadCounts = {
+            group: data.unread_counts.group || 0,
+            individual: data.unread_counts.individual || {}
+        };
+        
+    } else {
+        // サーバーから未読数が提供されない場合のフォールバック
+        this.calculateUnreadCountsWithSessionCheck();
+    }
+    
+    // UIを更新
+    this.updateBadge();
+    this.updateParticipantsList();
+    
+    // 現在開いているチャットを再描画
+    const activeGroupChat = document.getElementById('group-chat-screen')?.classList.contains('active');
+    const activeIndividualChat = document.getElementById('individual-chat-screen')?.classList.contains('active');
+    
+    if (activeGroupChat) {
+        this.renderGroupMessages();
+    } else if (activeIndividualChat && this.currentChatTarget) {
+        this.renderIndividualMessages(this.currentChatTarget);
+    }
+    
+}
+// ★ 過去の履歴を1ページ要求
+requestOlderMessages(conversation) {
+    const cursor = conversation === 'group' ?
+        this.historyCursors.group :
+        this.historyCursors.individual[conversation];
+    
+    if (!cursor || this.loadingOlderHistory[conversation]) return;
+    
+    const sent = wsManager.send({
+        type: 'request_chat_history',
+        participant_id: state.participantId || window.djangoData.participantId,
+        conversation: conversation,
+        before: cursor
+    });
+    
+    if (sent) {
+        this.loadingOlderHistory[conversation] = true;
+    }
+}
+
+// ★ 過去の履歴ページを先頭に追加
+handleChatHistoryPage(data) {
+    const conversation = data.conversation;
+    if (!conversation) return;
+    
+    this.loadingOlderHistory[conversation] = false;
+    
+    if (conversation === 'group') {
+        this.historyCursors.group = data.next_cursor || null;
+    } else {
+        this.historyCursors.individual[conversation] = data.next_cursor || null;
+    }
+    
+    if (!Array.isArray(data.messages) || data.messages.length === 0) return;
+    
+    const isGroup = conversation === 'group';
+    const existing = isGroup ? this.messages.group : (this.messages.individual[conversation] || []);
+    const existingIds = new Set(existing.map(msg => msg.id).filter(id => id !== undefined));
+    const older = data.messages.filter(msg => !existingIds.has(msg.id));
+    const merged = older.concat(existing);
+    
+    if (isGroup) {
+        this.messages.group = merged;
+    } else {
+        this.messages.individual[conversation] = merged;
+    }
+    
+    // 表示中の会話であればスクロール位置を保ったまま再描画
+    const containerId = isGroup ? 'group-messages' : 'individual-messages';
+    const container = document.getElementById(containerId);
+    const isVisible = isGroup ?
+        document.getElementById('group-chat-screen')?.classList.contains('active') :
+        document.getElementById('individual-chat-screen')?.classList.contains('active') && this.currentChatTarget === conversation;
+    
+    if (!container || !isVisible) return;
+    
+    const previousHeight = container.scrollHeight;
+    const previousTop = container.scrollTop;
+    
+    if (isGroup) {
+        this.renderGroupMessages();
+    } else {
+        this.renderIndividualMessages(conversation);
+    }
+    
+    container.scrollTop = container.scrollHeight - previousHeight + previousTop;
+    
+    // 過去履歴の追加では新着表示を出さない
+    const indicatorId = isGroup ? 'group-new-message-indicator' : 'individual-new-message-indicator';
+    document.getElementById(indicatorId)?.remove();
+}
+
+calculateUnreadCountsWithSessionCheck() {
+    const participantId = state.participantId || window.djangoData.participantId;
+    
+    // セッションストレージから最後に読んだメッセージのタイムスタンプを取得
+    const lastReadTimestamps = this.getLastReadTimestamps();
+    
+    // グループメッセージの未読数を計算
+    this.unreadCounts.group = this.messages.group.filter(msg => {
+        // 自分のメッセージは除外
+        if (msg.sender_id === participantId) return false;
+        
+        // 既読フラグが設定されている場合
+        if (msg.is_read) return false;
+        
+        // 最後に読んだ時刻より新しいメッセージのみ未読とする
+        const msgTime = new Date(msg.timestamp).getTime();
+        const lastReadTime = lastReadTimestamps.group || 0;
+        return msgTime > lastReadTime;
+    }).length;
+    
+    // 個別メッセージの未読数を計算
+    this.unreadCounts.individual = {};
+    
+    Object.keys(this.messages.individual).forEach(conversationPartnerId => {
+        const lastReadTime = lastReadTimestamps.individual[conversationPartnerId] || 0;
+        
+        const unreadCount = this.messages.individual[conversationPartnerId].filter(msg => {
+            // 自分が送信したメッセージは除外
+            if (msg.sender_id === participantId) return false;
+            
+            // 自分宛でないメッセージは除外
+            if (msg.target_id !== participantId) return false;
+            
+            // 既読フラグが設定されている場合
+            if (msg.is_read) return false;
+            
+            // 最後に読んだ時刻より新しいメッセージのみ未読とする
+            const msgTime = new Date(msg.timestamp).getTime();
+            return msgTime > lastReadTime;
+        }).length;
+        
+        if (unreadCount > 0) {
+            this.unreadCounts.individual[conversationPartnerId] = unreadCount;
+        }
+    });
+    
+}
+
+// ：最後に読んだメッセージのタイムスタンプを管理
+getLastReadTimestamps() {
+    const key = `lastRead_${state.sessionId}_${state.participantId}`;
+    const stored = sessionStorage.getItem(key);
+    
+    if (stored) {
+        try {
+            return JSON.parse(stored);
+        } catch (e) {
+            console.warn('Failed to parse last read timestamps:', e);
+        }
+    }
+    
+    return {
+        group: 0,
+        individual: {}
+    };
+}
+setLastReadTimestamp(chatType, targetId = null) {
+    const key = `lastRead_${state.sessionId}_${state.participantId}`;
+    const timestamps = this.getLastReadTimestamps();
+    const now = Date.now();
+    
+    if (chatType === 'group') {
+        timestamps.group = now;
+    } else if (targetId) {
+        if (!timestamps.individual) {
+            timestamps.individual = {};
+        }
+        timestamps.individual[targetId] = now;
+    }
+    
+    sessionStorage.setItem(key, JSON.stringify(timestamps));
+}
+calculateUnreadCounts() {
+    const participantId = state.participantId || window.djangoData.participantId;
+    
+    // グループメッセージの未読数を計算
+    this.unreadCounts.group = this.messages.group.filter(msg => 
+        msg.sender_id !== participantId && !msg.is_read
+    ).length;
+    
+    // 個別メッセージの未読数を計算
+    this.unreadCounts.individual = {};
+    
+    Object.keys(this.messages.individual).forEach(conversationPartnerId => {
+        const unreadCount = this.messages.individual[conversationPartnerId].filter(msg => 
+            msg.sender_id !== participantId && 
+            msg.target_id === participantId && 
+            !msg.is_read
+        ).length;
+        
+        if (unreadCount > 0) {
+            this.unreadCounts.individual[conversationPartnerId] = unreadCount;
+        }
+    });
+    
+}
+openChat() {
+    this.chatModal.style.display = 'flex';
+    // 次のフレームでopenクラスを追加（アニメーション発動）
+    requestAnimationFrame(() => {
+        this.chatModal.classList.add('open');
+    });
+    
+    this.showParticipantsList();
+    this.updateParticipantsList();
+    this.startRapidStatusUpdate();
+    
+    if (window.innerWidth <= 768) {
+        document.body.classList.add('chat-modal-open');
+        this.scrollPosition = window.scrollY;
+        document.body.style.top = `-${this.scrollPosition}px`;
+    }
+}
+
+closeChat() {
+    this.chatModal.classList.remove('open');
+    // アニメーション完了後に非表示
+    setTimeout(() => {
+        this.chatModal.style.display = 'none';
+    }, 300);
+    
+    this.stopRapidStatusUpdate();
+    
+    if (window.innerWidth <= 768) {
+        document.body.classList.remove('chat-modal-open');
+        document.body.style.top = '';
+        window.scrollTo(0, this.scrollPosition || 0);
+    }
+}
+    
+    showParticipantsList() {
+        document.querySelectorAll('.chat-screen').forEach(screen => {
+            screen.classList.remove('active');
+        });
+        document.getElementById('participants-screen').classList.add('active');
+        this.updateParticipantsList();
+    }
+    
+updateParticipantsList() {
+    const listEl = document.getElementById('chat-participant-list');
+    if (!listEl) return;
+    
+    // 既存のイベントリスナーをクリア
+    listEl.innerHTML = '';
+    
+    const groupUnread = this.unreadCounts.group || 0;
+    const lastGroupMsg = this.messages.group[this.messages.group.length - 1];
+    
+    // グループセクションラベル
+    const groupSectionLabel = document.createElement('div');
+    groupSectionLabel.className = 'chat-section-label group-section';
+    groupSectionLabel.innerHTML = `
+        <i class="fas fa-users"></i>
+        <span>グループ</span>
+    `;
+    listEl.appendChild(groupSectionLabel);
+    
+    // グループチャット項目
+    const groupItem = document.createElement('div');
+    groupItem.className = 'chat-participant-item group';
+    groupItem.innerHTML = `
+        <div class="participant-avatar">
+            <i class="fas fa-users"></i>
+        </div>
+        <div class="participant-info">
+            <div class="participant-name">
+                <i class="fas fa-globe"></i> 全員
+            </div>
+            <div class="last-message">
+                ${lastGroupMsg ? this.truncateMessage(lastGroupMsg.text) : '全員でチャットしよう！'}
+            </div>
+        </div>
+        ${lastGroupMsg ? `<div class="message-time">${this.formatTime(lastGroupMsg.timestamp)}</div>` : ''}
+        ${groupUnread > 0 ? `<div class="unread-badge">${groupUnread}</div>` : ''}
+    `;
+    
+    // グループチャットのクリックイベントを直接設定
+    groupItem.addEventListener('click', (e) => {
+        e.preventDefault();
+        e.stopPropagation();
+        this.openGroupChat();
+    });
+    
+    // タッチイベントも追加（モバイル対応）
+    groupItem.addEventListener('touchend', (e) => {
+        e.preventDefault();
+        e.stopPropagation();
+        this.openGroupChat();
+    });
+    
+    listEl.appendChild(groupItem);
+    
+    // ★ 修正：参加者リストを名前順でソート（自分以外）
+    const sortedParticipants = [...state.participantsData]
+        .filter(p => p.participant_id !== state.participantId)
+        .sort((a, b) => {
+            // 名前でソート（大文字小文字を無視）
+            const nameA = (a.participant_name || `参加者${a.participant_id.substring(0, 4)}`).toLowerCase();
+            const nameB = (b.participant_name || `参加者${b.participant_id.substring(0, 4)}`).toLowerCase();
+            
+            // 名前が同じ場合はparticipant_idでソート（一貫性のため）
+            if (nameA === nameB) {
+                return a.participant_id.localeCompare(b.participant_id);
+            }
+            
+            return nameA.localeCompare(nameB);
+        });
+    
+    const hasParticipants = sortedParticipants.length > 0;
+    
+    if (hasParticipants) {
+        // 個別セクションラベル
+        const individualSectionLabel = document.createElement('div');
+        individualSectionLabel.className = 'chat-section-label individual-section';
+        individualSectionLabel.innerHTML = `
+            <i class="fas fa-user"></i>
+            <span>個別チャット</span>
+        `;
+        listEl.appendChild(individualSectionLabel);
+        
+        // ★ 修正：ソート済みの参加者を順番に表示
+        sortedParticipants.forEach(participant => {
+            const name = participant.participant_name || `参加者${participant.participant_id.substring(0, 4)}`;
+            const initials = name.substring(0, 2).toUpperCase();
+            const participantId = participant.participant_id;
+            
+            let statusClass = '';
+            let statusText = '';
+            
+            if (!participant.is_online) {
+                statusClass = 'offline';
+                statusText = 'オフライン';
+            } else if (participant.is_background) {
+                statusClass = 'background';
+                statusText = 'バックグラウンド';
+            } else if (participant.status === 'sharing') {
+                statusClass = 'sharing';
+                statusText = '位置共有中';
+            } else {
+                statusClass = 'waiting';
+                statusText = '共有待機中';
+            }
+            
+            const messages = this.messages.individual[participantId] || [];
+            const lastMsg = messages[messages.length - 1];
+            const unread = this.unreadCounts.individual[participantId] || 0;
+            
+            const participantItem = document.createElement('div');
+            participantItem.className = 'chat-participant-item';
+            participantItem.innerHTML = `
+                <div class="participant-avatar" style="background: ${mapManager.getParticipantColor(participantId)};">
+                    ${initials}
+                    <div class="status-indicator ${statusClass}"></div>
+                </div>
+                <div class="participant-info">
+                    <div class="participant-name">${this.escapeHtml(name)}</div>
+                    <div class="last-message">
+                        ${lastMsg ? this.truncateMessage(lastMsg.text) : 'タップしてチャット開始'}
+                    </div>
+                    <div class="participant-status ${statusClass}">${statusText}</div>
+                </div>
+                ${lastMsg ? `<div class="message-time">${this.formatTime(lastMsg.timestamp)}</div>` : ''}
+                ${unread > 0 ? `<div class="unread-badge">${unread}</div>` : ''}
+            `;
+            
+            // 個別チャットのクリックイベントを直接設定
+            participantItem.addEventListener('click', (e) => {
+                e.preventDefault();
+                e.stopPropagation();
+                this.openIndividualChat(participantId, name);
+            });
+            
+            // タッチイベントも追加（モバイル対応）
+            participantItem.addEventListener('touchend', (e) => {
+                e.preventDefault();
+                e.stopPropagation();
+                this.openIndividualChat(participantId, name);
+            });
+            
+            listEl.appendChild(participantItem);
+        });
+    } else {
+        // 参加者がいない場合の表示
+        const emptyDiv = document.createElement('div');
+        emptyDiv.style.cssText = 'text-align: center; padding: 20px; color: #999;';
+        emptyDiv.innerHTML = `
+            <i class="fas fa-user-friends" style="font-size: 48px; opacity: 0.3;"></i>
+            <p style="margin-top: 10px;">他の参加者を待っています...</p>
+        `;
+        listEl.appendChild(emptyDiv);
+    }
+}
+    
+openGroupChat() {
+    // 二重タップ防止
+    if (this.isTransitioning) return;
+    
+    const now = Date.now();
+    if (now - this.lastTapTime < 300) return;
+    this.lastTapTime = now;
+    
+    this.isTransitioning = true;
+    
+    document.querySelectorAll('.chat-screen').forEach(screen => {
+        screen.classList.remove('active');
+    });
+    document.getElementById('group-chat-screen').classList.add('active');
+    
+    // 最後に読んだタイムスタンプを更新
+    this.setLastReadTimestamp('group');
+    
+    // 未読メッセージがある場合は既読にする
+    if (this.unreadCounts.group > 0) {
+        wsManager.send({
+            type: 'mark_as_read',
+            participant_id: state.participantId,
+            chat_type: 'group',
+            ...this.getReadPosition('group')
+        });
+        
+        // ローカルの未読カウントをリセット
+        this.unreadCounts.group = 0;
+        this.updateBadge();
+    }
+    
+    this.renderGroupMessages();
+    this.scrollToBottom('group-messages');
+    
+    // チャット画面を開いた後の新着メッセージ監視を開始
+    this.startAutoReadMonitoring('group');
+    
+    // トランジション完了後にフラグをリセット
+    setTimeout(() => {
+        this.isTransitioning = false;
+    }, 300);
+}
+    
+openIndividualChat(participantId, participantName) {
+    // 二重タップ防止
+    if (this.isTransitioning) return;
+    
+    const now = Date.now();
+    if (now - this.lastTapTime < 300) return;
+    this.lastTapTime = now;
+    
+    this.isTransitioning = true;
+    this.currentChatTarget = participantId;
+    
+    document.querySelectorAll('.chat-screen').forEach(screen => {
+        screen.classList.remove('active');
+    });
+    document.getElementById('individual-chat-screen').classList.add('active');
+    document.getElementById('individual-chat-title').textContent = participantName;
+    
+    // 最後に読んだタイムスタンプを更新
+    this.setLastReadTimestamp('individual', participantId);
+    
+    // 未読メッセージがある場合は既読にする
+    const unreadCount = this.unreadCounts.individual[participantId] || 0;
+    if (unreadCount > 0) {
+        wsManager.send({
+            type: 'mark_as_read',
+            participant_id: state.participantId,
+            chat_type: 'individual',
+            sender_id: participantId,
+            ...this.getReadPosition('individual', participantId)
+        });
+        
+        // ローカルの未読カウントをリセット
+        this.unreadCounts.individual[participantId] = 0;
+        this.updateBadge();
+    }
+    
+    this.renderIndividualMessages(participantId);
+    this.scrollToBottom('individual-messages');
+    
+    // チャット画面を開いた後の新着メッセージ監視を開始
+    this.startAutoReadMonitoring('individual', participantId);
+    
+    // トランジション完了後にフラグをリセット
+    setTimeout(() => {
+        this.isTransitioning = false;
+    }, 300);
+}
+    startAutoReadMonitoring(chatType, targetId = null) {
+    // 既存の監視を停止
+    scheduler.cancel(this.autoReadInterval);
+    
+    // 100msごとに新着メッセージをチェックして自動既読（タブが非表示の間は既読にしない）
+    this.autoReadInterval = scheduler.every('chat-auto-read', 100, () => {
+        const isChatModalOpen = this.chatModal.style.display !== 'none';
+        if (!isChatModalOpen) {
+            scheduler.cancel(this.autoReadInterval);
+            return;
+        }
+        
+        if (chatType === 'group') {
+            const isGroupChatOpen = document.getElementById('group-chat-screen')?.classList.contains('active');
+            if (isGroupChatOpen && this.unreadCounts.group > 0) {
+                this.markAsReadImmediately('group');
+            }
+        } else if (chatType === 'individual' && targetId) {
+            const isIndividualChatOpen = document.getElementById('individual-chat-screen')?.classList.contains('active');
+            const isCurrentChat = this.currentChatTarget === targetId;
+            if (isIndividualChatOpen && isCurrentChat && this.unreadCounts.individual[targetId] > 0) {
+                this.markAsReadImmediately('individual', targetId);
+            }
+        }
+    }, 'render');
+}
+    sendGroupMessage() {
+        const input = document.getElementById('group-input');
+        const text = input.value.trim();
+        
+        if (!text) return;
+        
+        if (text.length > 200) {
+            this.showMessageLengthError('group');
+            return;
+        }
+        
+        // 入力状態をクリア
+        this.handleTypingEnd('group');
+        
+        const message = {
+            type: 'chat_message',
+            chat_type: 'group',
+            sender_id: state.participantId,
+            sender_name: this.getParticipantNameSafe(),
+            text: text,
+            timestamp: new Date().toISOString(),
+            client_message_id: this.createClientMessageId()
+        };
+        
+        wsManager.send(message);
+        this.addMessage('group', null, message);
+        
+        input.value = '';
+        
+        // 文字数カウンターをリセット
+        const counter = input.parentElement.querySelector('.char-counter');
+        if (counter) {
+            counter.textContent = '0/200';
+            counter.style.color = '#999';
+            counter.style.fontWeight = 'normal';
+        }
+        input.style.borderColor = '';
+    }
+    
+    sendIndividualMessage() {
+        const input = document.getElementById('individual-input');
+        const text = input.value.trim();
+        
+        if (!text || !this.currentChatTarget) return;
+        
+        if (text.length > 200) {
+            this.showMessageLengthError('individual');
+            return;
+        }
+        
+        // 入力状態をクリア
+        this.handleTypingEnd(this.currentChatTarget);
+        
+        const message = {
+            type: 'chat_message',
+            chat_type: 'individual',
+            sender_id: state.participantId,
+            sender_name: this.getParticipantNameSafe(),
+            target_id: this.currentChatTarget,
+            text: text,
+            timestamp: new Date().toISOString(),
+            client_message_id: this.createClientMessageId()
+        };
+        
+        wsManager.send(message);
+        this.addMessage('individual', this.currentChatTarget, message);
+        
+        input.value = '';
+        
+        // 文字数カウンターをリセット
+        const counter = input.parentElement.querySelector('.char-counter');
+        if (counter) {
+            counter.textContent = '0/200';
+            counter.style.color = '#999';
+            counter.style.fontWeight = 'normal';
+        }
+        input.style.borderColor = '';
+    }
+
+// ：文字数エラー表示メソッド
+showMessageLengthError(chatType) {
+    const inputId = chatType === 'group' ? 'group-input' : 'individual-input';
+    const input = document.getElementById(inputId);
+    
+    // エラーメッセージを表示
+    const errorDiv = document.createElement('div');
+    errorDiv.className = 'chat-error-message';
+    errorDiv.style.cssText = `
+        position: absolute;
+        bottom: 60px;
+        left: 10px;
+        right: 10px;
+        background: #dc3545;
+        color: white;
+        padding: 8px 12px;
+        border-radius: 8px;
+        font-size: 12px;
+        animation: shake 0.3s;
+        z-index: 1000;
+    `;
+    errorDiv.innerHTML = `
+        <i class="fas fa-exclamation-triangle"></i> 
+        メッセージは200文字以内で入力してください（現在: ${input.value.length}文字）
+    `;
+    
+    // 親要素に追加
+    input.parentElement.style.position = 'relative';
+    input.parentElement.appendChild(errorDiv);
+    
+    // 入力欄を赤くハイライト
+    input.style.borderColor = '#dc3545';
+    input.style.boxShadow = '0 0 0 0.2rem rgba(220, 53, 69, 0.25)';
+    
+    // 3秒後に削除
+    setTimeout(() => {
+        errorDiv.remove();
+        input.style.borderColor = '';
+        input.style.boxShadow = '';
+    }, 3000);
+}
+    handleIncomingMessage(data) {
+    if (data.sender_id === state.participantId) return;
+    
+    if (data.chat_type === 'group') {
+        this.messages.group.push(data);
+        
+        // チャット画面とグループチャットが開いているかチェック
+        const isGroupChatOpen = document.getElementById('group-chat-screen')?.classList.contains('active');
+        const isChatModalOpen = this.chatModal.style.display !== 'none';
+        
+        if (isGroupChatOpen && isChatModalOpen) {
+            // グループチャットを開いている場合は即座に既読にする
+            this.markAsReadImmediately('group');
+        } else {
+            // 開いていない場合のみ未読カウントを増やす
+            this.unreadCounts.group++;
+            this.updateBadge();
+        }
+        
+        // UIを更新
+        if (isGroupChatOpen) {
+            this.renderGroupMessages();
+        }
+        
+        // 参加者リストが開いている場合も即座に更新
+        if (document.getElementById('participants-screen')?.classList.contains('active')) {
+            this.updateParticipantsList();
+        }
+        
+        // 通知（チャットモーダルが閉じている場合のみ）
+        if (!isChatModalOpen) {
+            ui.showNotification(
+                `${data.sender_name}: ${this.truncateMessage(data.text)}`,
+                'info',
+                'fas fa-comment'
+            );
+        }
+    } else if (data.chat_type === 'individual') {
+        // 自分宛てかチェック
+        if (data.target_id === state.participantId) {
+            const senderId = data.sender_id;
+            
+            if (!this.messages.individual[senderId]) {
+                this.messages.individual[senderId] = [];
+            }
+            this.messages.individual[senderId].push(data);
+            
+            // 個別チャットが開いているかチェック
+            const isIndividualChatOpen = document.getElementById('individual-chat-screen')?.classList.contains('active');
+            const isCurrentChat = this.currentChatTarget === senderId;
+            const isChatModalOpen = this.chatModal.style.display !== 'none';
+            
+            if (isIndividualChatOpen && isCurrentChat && isChatModalOpen) {
+                // 該当の個別チャットを開いている場合は即座に既読にする
+                this.markAsReadImmediately('individual', senderId);
+            } else {
+                // 開いていない場合のみ未読カウントを増やす
+                if (!this.unreadCounts.individual[senderId]) {
+                    this.unreadCounts.individual[senderId] = 0;
+                }
+                this.unreadCounts.individual[senderId]++;
+                this.updateBadge();
+            }
+            
+            // UIを更新
+            if (isCurrentChat && isIndividualChatOpen) {
+                this.renderIndividualMessages(senderId);
+            }
+            
+            // 参加者リストが開いている場合も即座に更新
+            if (document.getElementById('participants-screen')?.classList.contains('active')) {
+                this.updateParticipantsList();
+            }
+            
+            // 通知（チャットモーダルが閉じている場合のみ）
+            if (!isChatModalOpen) {
+                ui.showNotification(
+                    `${data.sender_name}: ${this.truncateMessage(data.text)}`,
+                    'info',
+                    'fas fa-comment'
+                );
+            }
+        }
+    }
+}
+    // 送信メッセージの保存確認と対応付けるためのID
+    createClientMessageId() {
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`;
+}
+
+    // 送信メッセージの保存確認：サーバーのIDと時刻を反映
+    handleMessageSaved(data) {
+    if (!data.client_message_id) return;
+    
+    const conversations = [this.messages.group, ...Object.values(this.messages.individual)];
+    for (const messages of conversations) {
+        const message = messages.find(msg => msg.client_message_id === data.client_message_id);
+        if (message) {
+            message.id = data.id;
+            message.timestamp = data.timestamp || message.timestamp;
+            break;
+        }
+    }
+    
+    if (!data.persisted) {
+        ui.showNotification('メッセージを保存できませんでした', 'warning', 'fas fa-exclamation-triangle');
+    }
+}
+
+    // 会話内で受信済みの最新メッセージの位置（既読カーソル用、サーバーの時刻とIDの順）
+    getReadPosition(chatType, partnerId = null) {
+    const messages = chatType === 'group'
+        ? this.messages.group
+        : (this.messages.individual[partnerId] || []);
+    let latest = null;
+    messages.forEach(msg => {
+        if (msg.sender_id === state.participantId || !Number.isInteger(msg.id)) return;
+        const time = Date.parse(msg.timestamp);
+        if (!latest || time > latest.time || (time === latest.time && msg.id > latest.id)) {
+            latest = { time, id: msg.id, timestamp: msg.timestamp };
+        }
+    });
+    return latest ? { last_message_id: latest.id, last_message_at: latest.timestamp } : {};
+}
+
+    markAsReadImmediately(chatType, senderId = null) {
+    // 即座に既読マークを送信
+    const markAsReadData = {
+        type: 'mark_as_read',
+        participant_id: state.participantId,
+        chat_type: chatType
+    };
+    
+    if (chatType === 'individual' && senderId) {
+        markAsReadData.sender_id = senderId;
+    }
+    
+    Object.assign(markAsReadData, this.getReadPosition(chatType, senderId));
+    
+    // WebSocketで既読通知を送信
+    if (wsManager.websocket && wsManager.websocket.readyState === WebSocket.OPEN) {
+        wsManager.send(markAsReadData);
+    }
+    
+    // ローカルの未読カウントも即座にリセット
+    if (chatType === 'group') {
+        this.unreadCounts.group = 0;
+    } else if (senderId) {
+        if (this.unreadCounts.individual[senderId]) {
+            this.unreadCounts.individual[senderId] = 0;
+        }
+    }
+    
+    // バッジを更新
+    this.updateBadge();
+    
+    // タイムスタンプも更新
+    this.setLastReadTimestamp(chatType, senderId);
+}
+    
+    handleTypingIndicator(data) {
+        if (data.sender_id === state.participantId) return;
+        
+        if (data.chat_type === 'group') {
+            const indicator = document.getElementById('group-typing-indicator');
+            if (indicator) {
+                if (data.is_typing) {
+                    indicator.querySelector('span').textContent = data.sender_name;
+                    indicator.style.display = 'block';
+                    
+                    // タイムアウトをセット（15秒後に自動で非表示）
+                    if (this.typingTimeouts?.group) {
+                        clearTimeout(this.typingTimeouts.group);
+                    }
+                    if (!this.typingTimeouts) this.typingTimeouts = {};
+                    this.typingTimeouts.group = setTimeout(() => {
+                        indicator.style.display = 'none';
+                    }, 15000);
+                } else {
+                    // 入力終了通知を受信したら即座に非表示
+                    indicator.style.display = 'none';
+                    if (this.typingTimeouts?.group) {
+                        clearTimeout(this.typingTimeouts.group);
+                        delete this.typingTimeouts.group;
+                    }
+                }
+            }
+        } else if (data.chat_type === 'individual' && data.target_id === state.participantId) {
+            const indicator = document.getElementById('typing-indicator');
+            if (indicator && this.currentChatTarget === data.sender_id) {
+                if (data.is_typing) {
+                    indicator.querySelector('span').textContent = data.sender_name;
+                    indicator.style.display = 'block';
+                    
+                    // タイムアウトをセット（15秒後に自動で非表示）
+                    if (this.typingTimeouts?.[data.sender_id]) {
+                        clearTimeout(this.typingTimeouts[data.sender_id]);
+                    }
+                    if (!this.typingTimeouts) this.typingTimeouts = {};
+                    this.typingTimeouts[data.sender_id] = setTimeout(() => {
+                        indicator.style.display = 'none';
+                    }, 15000);
+                } else {
+                    // 入力終了通知を受信したら即座に非表示
+                    indicator.style.display = 'none';
+                    if (this.typingTimeouts?.[data.sender_id]) {
+                        clearTimeout(this.typingTimeouts[data.sender_id]);
+                        delete this.typingTimeouts[data.sender_id];
+                    }
+                }
+            }
+        }
+    }
+    
+    handleParticipantStatusUpdate(data) {
+        // 参加者リストが表示されている場合は即座に更新
+        if (this.chatModal.style.display !== 'none' && 
+            document.getElementById('participants-screen').classList.contains('active')) {
+            this.updateParticipantsList();
+        }
+    }
+    
+addMessage(type, target, message) {
+    if (type === 'group') {
+        this.messages.group.push(message);
+        
+        // グループチャットが開いている場合のみ再描画
+        const isGroupChatOpen = document.getElementById('group-chat-screen')?.classList.contains('active');
+        if (isGroupChatOpen) {
+            // ★ 修正：自分のメッセージの場合は自動スクロール
+            if (message.sender_id === state.participantId) {
+                this.renderGroupMessages();
+                this.scrollToBottom('group-messages');
+            } else {
+                this.renderGroupMessages();
+            }
+        }
+    } else {
+        const key = target || message.sender_id;
+        if (!this.messages.individual[key]) {
+            this.messages.individual[key] = [];
+        }
+        this.messages.individual[key].push(message);
+        
+        // 該当の個別チャットが開いている場合のみ再描画
+        const isIndividualChatOpen = document.getElementById('individual-chat-screen')?.classList.contains('active');
+        if (this.currentChatTarget === key && isIndividualChatOpen) {
+            // ★ 修正：自分のメッセージの場合は自動スクロール
+            if (message.sender_id === state.participantId) {
+                this.renderIndividualMessages(key);
+                this.scrollToBottom('individual-messages');
+            } else {
+                this.renderIndividualMessages(key);
+            }
+        }
+    }
+    
+    // 参加者リストが開いていれば更新
+    if (document.getElementById('participants-screen').classList.contains('active')) {
+        this.updateParticipantsList();
+    }
+}
+    
+renderGroupMessages() {
+    const container = document.getElementById('group-messages');
+    if (!container) return;
+    
+    // スクロール位置を保存
+    const wasScrolledToBottom = this.isScrolledToBottom(container);
+    const scrollPosition = container.scrollTop;
+    
+    if (this.messages.group.length === 0) {
+        container.innerHTML = `
+            <div class="chat-welcome">
+                <i class="fas fa-comments" style="font-size: 48px; color: #00b300; opacity: 0.3;"></i>
+                <p style="color: #999; margin-top: 10px;">グループチャットへようこそ！</p>
+            </div>
+        `;
+        return;
+    }
+    
+    let html = '';
+    let lastDate = null;
+    
+    this.messages.group.forEach(msg => {
+        const msgDate = new Date(msg.timestamp).toLocaleDateString();
+        if (msgDate !== lastDate) {
+            html += `<div class="system-message">${msgDate}</div>`;
+            lastDate = msgDate;
+        }
+        
+        const isOwn = msg.sender_id === state.participantId;
+        html += `
+            <div class="message ${isOwn ? 'own' : ''}">
+                <div class="message-bubble">
+                    ${!isOwn ? `<div class="message-sender">${msg.sender_name}</div>` : ''}
+                    <div>${this.escapeHtml(msg.text)}</div>
+                    <div class="message-time-label">${this.formatTime(msg.timestamp)}</div>
+                </div>
+            </div>
+        `;
+    });
+    
+    container.innerHTML = html;
+    
+    // スクロール位置を復元または最下部へ
+    if (wasScrolledToBottom) {
+        this.scrollToBottom('group-messages');
+    } else {
+        container.scrollTop = scrollPosition;
+        // ★ 修正：最後のメッセージが自分のものでない場合のみ新着表示
+        const lastMessage = this.messages.group[this.messages.group.length - 1];
+        if (lastMessage && lastMessage.sender_id !== state.participantId) {
+            this.showNewMessageIndicator('group');
+        }
+    }
+}
+    
+renderIndividualMessages(participantId) {
+    const container = document.getElementById('individual-messages');
+    if (!container) return;
+    
+    // スクロール位置を保存
+    const wasScrolledToBottom = this.isScrolledToBottom(container);
+    const scrollPosition = container.scrollTop;
+    
+    const messages = this.messages.individual[participantId] || [];
+    
+    if (messages.length === 0) {
+        container.innerHTML = `
+            <div class="chat-welcome">
+                <i class="fas fa-comment" style="font-size: 48px; color: #00b300; opacity: 0.3;"></i>
+                <p style="color: #999; margin-top: 10px;">チャットを開始しましょう！</p>
+            </div>
+        `;
+        return;
+    }
+    
+    let html = '';
+    let lastDate = null;
+    
+    messages.forEach(msg => {
+        const msgDate = new Date(msg.timestamp).toLocaleDateString();
+        if (msgDate !== lastDate) {
+            html += `<div class="system-message">${msgDate}</div>`;
+            lastDate = msgDate;
+        }
+        
+        const isOwn = msg.sender_id === state.participantId;
+        html += `
+            <div class="message ${isOwn ? 'own' : ''}">
+                <div class="message-bubble">
+                    <div>${this.escapeHtml(msg.text)}</div>
+                    <div class="message-time-label">${this.formatTime(msg.timestamp)}</div>
+                </div>
+            </div>
+        `;
+    });
+    
+    container.innerHTML = html;
+    
+    // スクロール位置を復元または最下部へ
+    if (wasScrolledToBottom) {
+        this.scrollToBottom('individual-messages');
+    } else {
+        container.scrollTop = scrollPosition;
+        // ★ 修正：最後のメッセージが自分のものでない場合のみ新着表示
+        const lastMessage = messages[messages.length - 1];
+        if (lastMessage && lastMessage.sender_id !== state.participantId) {
+            this.showNewMessageIndicator('individual', participantId);
+        }
+    }
+}
+    
+isScrolledToBottom(element) {
+    if (!element) return true;
+    const threshold = 50; // 50px の余裕を持たせる
+    return element.scrollHeight - element.scrollTop - element.clientHeight < threshold;
+}
+
+showNewMessageIndicator(chatType, targetId = null) {
+    const indicatorId = chatType === 'group' ? 'group-new-message-indicator' : 'individual-new-message-indicator';
+    
+    // ★ 修正：既存のインジケーターを削除してから新規作成
+    let existingIndicator = document.getElementById(indicatorId);
+    if (existingIndicator) {
+        existingIndicator.remove();
+    }
+    
+    const indicator = document.createElement('div');
+    indicator.id = indicatorId;
+    indicator.className = 'new-message-indicator';
+    indicator.style.cssText = `
+        position: absolute;
+        bottom: 60px;
+        left: 50%;
+        transform: translateX(-50%);
+        background: #007bff;
+        color: white;
+        padding: 8px 16px;
+        border-radius: 20px;
+        font-size: 12px;
+        cursor: pointer;
+        z-index: 1000;
+        box-shadow: 0 2px 8px rgba(0, 123, 255, 0.3);
+        animation: slideUpCenter 0.3s ease-out;
+        pointer-events: auto;  /* ★ クリック可能を明示 */
+    `;
+    indicator.innerHTML = `
+        <i class="fas fa-chevron-down"></i> 新着メッセージ
+    `;
+    
+    const container = chatType === 'group' ? 
+        document.getElementById('group-chat-screen') : 
+        document.getElementById('individual-chat-screen');
+    
+    if (container) {
+        container.style.position = 'relative';
+        container.appendChild(indicator);
+        
+        // ★ 修正：クリックイベントを確実に設定
+        const scrollHandler = (e) => {
+            e.stopPropagation();  // ★ イベント伝播を停止
+            const messagesContainer = chatType === 'group' ? 
+                document.getElementById('group-messages') : 
+                document.getElementById('individual-messages');
+                
+            this.scrollToBottom(messagesContainer.id);
+            indicator.remove();
+        };
+        
+        // ★ 修正：複数のイベントタイプに対応
+        indicator.addEventListener('click', scrollHandler);
+        indicator.addEventListener('touchstart', scrollHandler, { passive: true });
+        
+        // メッセージコンテナのスクロールイベントを監視
+        const messagesContainer = chatType === 'group' ? 
+            document.getElementById('group-messages') : 
+            document.getElementById('individual-messages');
+            
+        if (messagesContainer) {
+            const scrollMonitor = () => {
+                if (this.isScrolledToBottom(messagesContainer)) {
+                    indicator.remove();
+                    messagesContainer.removeEventListener('scroll', scrollMonitor);
+                }
+            };
+            messagesContainer.addEventListener('scroll', scrollMonitor);
+        }
+    }
+}
+    updateBadge() {
+        let totalUnread = this.unreadCounts.group;
+        Object.values(this.unreadCounts.individual).forEach(count => {
+            totalUnread += count;
+        });
+        
+        if (totalUnread > 0) {
+            this.chatBadge.textContent = totalUnread > 99 ? '99+' : totalUnread;
+            this.chatBadge.style.display = 'block';
+        } else {
+            this.chatBadge.style.display = 'none';
+        }
+    }
+    
+    startStatusUpdateTimer() {
+        // 参加者リストのステータスを定期的に更新
+        this.participantStatusInterval = scheduler.every('chat-participant-status', 2000, () => {
+            if (this.chatModal.style.display !== 'none' && 
+                document.getElementById('participants-screen').classList.contains('active')) {
+                this.updateParticipantsList();
+            }
+        }, 'render'); // 2秒ごとに更新
+    }
+    
+    stopStatusUpdateTimer() {
+        if (this.participantStatusInterval) {
+            scheduler.cancel(this.participantStatusInterval);
+            this.participantStatusInterval = null;
+        }
+    }
+    
+    startRapidStatusUpdate() {
+        // 既存のタイマーをクリア
+        scheduler.cancel(this.rapidStatusInterval);
+        
+        // チャットモーダルが開いている間は1秒ごとに更新
+        this.rapidStatusInterval = scheduler.every('chat-rapid-status', 1000, () => {
+            if (this.chatModal.style.display !== 'none' && 
+                document.getElementById('participants-screen').classList.contains('active')) {
+                this.updateParticipantsList();
+            }
+        }, 'render'); // 1秒ごと
+    }
+    
+    stopRapidStatusUpdate() {
+        if (this.rapidStatusInterval) {
+            scheduler.cancel(this.rapidStatusInterval);
+            this.rapidStatusInterval = null;
+        }
+    }
+    
+    cleanup() {
+        this.stopStatusUpdateTimer();
+        this.stopRapidStatusUpdate();
+        
+        // 全ての入力状態をクリア
+        Object.keys(this.typingStates).forEach(target => {
+            this.handleTypingEnd(target);
+        });
+        
+        // タイムアウトをクリア
+        if (this.typingTimeouts) {
+            Object.values(this.typingTimeouts).forEach(timeout => {
+                clearTimeout(timeout);
+            });
+            this.typingTimeouts = {};
+        }
+        
+        this.clearMessages();
+    }
+
+    
+    clearMessages() {
+        this.messages = { group: [], individual: {} };
+        this.unreadCounts = { group: 0, individual: {} };
+        this.updateBadge();
+    }
+    
+    getParticipantNameSafe() {
+        const name = state.getParticipantName();
+        if (!name || name.trim() === '') {
+            return `参加者${state.participantId.substring(0, 4)}`;
+        }
+        return name;
+    }
+    
+    // ユーティリティ
+    formatTime(timestamp) {
+        const date = new Date(timestamp);
+        const now = new Date();
+        const diff = now - date;
+        
+        if (diff < 60000) return '今';
+        if (diff < 3600000) return `${Math.floor(diff / 60000)}分前`;
+        if (diff < 86400000) return date.toLocaleTimeString('ja-JP', { hour: '2-digit', minute: '2-digit' });
+        
+        return date.toLocaleDateString('ja-JP', { month: 'numeric', day: 'numeric' });
+    }
+    
+    truncateMessage(text, maxLength = 30) {
+        if (!text) return '';
+        return text.length > maxLength ? text.substring(0, maxLength) + '...' : text;
+    }
+    
+    escapeHtml(text) {
+        const div = document.createElement('div');
+        div.textContent = text;
+        return div.innerHTML;
+    }
+    
+    scrollToBottom(elementId) {
+        const element = document.getElementById(elementId);
+        if (element) {
+            setTimeout(() => {
+                element.scrollTop = element.scrollHeight;
+            }, 50);
+        }
+    }
+}
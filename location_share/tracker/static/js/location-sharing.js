@@ -14,6 +14,8 @@ const CONFIG = {
     MIN_TIME_BETWEEN_UPDATES: 1000, 
     CLUSTERING_DISTANCE: 25,
     CLUSTER_OFFSET_RADIUS: 33,
+    SCHEDULER_SLACK: 500,  // この時間内に期限が来る処理は同じ起床で実行
+    NETWORK_ALIGN_WINDOW: 5000,  // 送信処理はこの時間内のものを前倒しして同時に送る
 };
 
 // === ストレージキー ===
@@ -22,6 +24,99 @@ const STORAGE_KEYS = {
     STAY_TIME_TRACKER: 'stay_time_tracker'
 };
 
+// === クライアント側スケジューラ ===
+// 定期処理を1つのタイマーにまとめ、期限の近い処理は同じ起床で実行する。
+// 'render' の処理は requestAnimationFrame 内でまとめて実行し、タブが非表示の間は止める。
+// 'network' の処理は1つが実行されるとき、期限の近い他の送信も前倒しして通信をまとめる。
+class ClientScheduler {
+    constructor() {
+        this.jobs = new Map();
+        this.timer = null;
+        this.wakeAt = null;
+        document.addEventListener('visibilitychange', () => this.reschedule());
+    }
+    
+    every(name, interval, callback, kind = 'task') {
+        this.jobs.set(name, { name, interval, callback, kind, dueAt: Date.now() + interval });
+        this.reschedule();
+        return name;
+    }
+    
+    cancel(name) {
+        if (name && this.jobs.delete(name)) {
+            this.reschedule();
+        }
+    }
+    
+    has(name) {
+        return this.jobs.has(name);
+    }
+    
+    isRunnable(job) {
+        return !(job.kind === 'render' && document.hidden);
+    }
+    
+    reschedule() {
+        let next = Infinity;
+        for (const job of this.jobs.values()) {
+            if (this.isRunnable(job)) {
+                next = Math.min(next, job.dueAt);
+            }
+        }
+        // 既により早い起床が予約されていればそのまま
+        if (this.timer && this.wakeAt <= next) return;
+        
+        clearTimeout(this.timer);
+        this.timer = null;
+        if (next === Infinity) return;
+        
+        this.wakeAt = next;
+        this.timer = setTimeout(() => this.run(), Math.max(0, next - Date.now()));
+    }
+    
+    run() {
+        this.timer = null;
+        this.wakeAt = null;
+        
+        const now = Date.now();
+        const runnable = [...this.jobs.values()].filter(job => this.isRunnable(job));
+        const isDue = job => job.dueAt <= now + Math.min(job.interval * 0.1, CONFIG.SCHEDULER_SLACK);
+        const sendingNow = runnable.some(job => job.kind === 'network' && isDue(job));
+        const due = runnable.filter(job =>
+            isDue(job) ||
+            (sendingNow && job.kind === 'network' &&
+                job.dueAt <= now + Math.min(job.interval * 0.5, CONFIG.NETWORK_ALIGN_WINDOW))
+        );
+        
+        const frameJobs = [];
+        due.forEach(job => {
+            job.dueAt = now + job.interval;
+            if (job.kind === 'render') {
+                frameJobs.push(job);
+            } else {
+                this.execute(job);
+            }
+        });
+        if (frameJobs.length > 0) {
+            requestAnimationFrame(() => frameJobs.forEach(job => this.execute(job)));
+        }
+        
+        this.reschedule();
+    }
+    
+    execute(job) {
+        // 同じ起床で先に実行された処理が停止した場合は実行しない
+        if (this.jobs.get(job.name) !== job) return;
+        try {
+            job.callback();
+        } catch (error) {
+            console.error(`定期処理エラー (${job.name}):`, error);
+        }
+    }
+}
+
+const scheduler = new ClientScheduler();
+
 // === 状態管理クラス ===
 class LocationSharingState {
     constructor() {
@@ -43,6 +138,10 @@ class LocationSharingState {
         this.lastSentPosition = null;
         this.lastSentTime = 0;
         
+        // サーバー推奨の送信間隔（pong・名簿で受信）
+        this.serverIntervals = null;
+        this.lastReportedMoving = false;
+        
         // 接続状態
         this.reconnectAttempts = 0;
         this.backgroundReconnectAttempts = 0;
@@ -54,6 +153,8 @@ class LocationSharingState {
         this.participantOrder = [];
         this.participantColors = {};
         this.previousParticipantsState = new Map();
+        this.distances = {};  // ★ サーバー計算の自分から各参加者への距離
+        this.rosterEtag = null;  // 受信済みの名簿バージョン（join時に送信し、変更がなければ全件送信を省略）
         
         // セッション情報
         this.sessionId = window.djangoData.sessionId;
@@ -388,7 +489,9 @@ init() {
     }
     
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    const wsUrl = `${protocol}//${window.location.host}/ws/location/${state.sessionId}/`;
+    const socketToken = window.djangoData.socketToken;
+    const wsUrl = `${protocol}//${window.location.host}/ws/location/${state.sessionId}/` +
+        (socketToken ? `?token=${encodeURIComponent(socketToken)}` : '');
     
     if (this.websocket) {
         this.websocket.onclose = null;
@@ -437,9 +540,12 @@ handleOpen(event) {
     
     this.sendJoinMessage();
     
-    // チャット履歴を要求
-    if (window.chatManager) {
-        setTimeout(() => {
+    // 未接続中にたまった測位を送信（join処理の後）
+    setTimeout(() => locationManager.flushBufferedFixes(), 500);
+    
+    // チャット機能を読み込んでから履歴を要求
+    setTimeout(() => {
+        chatLoader.load().then(() => {
             const participantId = state.participantId || window.djangoData.participantId;
             
             wsManager.send({
@@ -447,8 +553,8 @@ handleOpen(event) {
                 session_id: state.sessionId,
                 participant_id: participantId
             });
-        }, 500);
-    }
+        }).catch(error => console.error(error.message));
+    }, 500);
     
     if (state.isInBackground) {
         this.startBackgroundKeepAlive();
@@ -545,6 +651,9 @@ handleReconnect() {
         if (this.websocket && this.websocket.readyState === WebSocket.OPEN) {
             try {
                 this.websocket.send(JSON.stringify(data));
+                if (data.type === 'ping' || data.type === 'location_update') {
+                    this.lastPresenceSentAt = Date.now();
+                }
                 return true;
             } catch (error) {
                 console.error('メッセージ送信エラー:', error);
@@ -576,18 +685,22 @@ sendJoinMessage() {
         page_returning: backgroundManager?.isPageUnloading === false,
         immediate_online: !state.isInBackground,
         priority_connection: !state.isInBackground,
-        deduplicate: true  // ★ 重複防止フラグ
+        deduplicate: true,  // ★ 重複防止フラグ
+        roster_etag: state.rosterEtag
     };
     
     this.send(joinMessage);
 }
     
 startConnectionManagement() {
-    if (this.connectionInterval) clearInterval(this.connectionInterval);
+    scheduler.cancel(this.connectionInterval);
     
-    const pingInterval = state.isInBackground ? CONFIG.BACKGROUND_KEEPALIVE_INTERVAL : 60000;
+    // ★ サーバー推奨のping間隔を優先
+    const defaultInterval = state.isInBackground ? CONFIG.BACKGROUND_KEEPALIVE_INTERVAL : 60000;
+    const pingInterval = state.serverIntervals?.ping_interval || defaultInterval;
+    this.currentPingInterval = pingInterval;
     
-    this.connectionInterval = setInterval(() => {
+    this.connectionInterval = scheduler.every('connection-check', pingInterval, () => {
         if (!this.websocket || this.websocket.readyState !== WebSocket.OPEN) {
             if (!state.isReconnecting) {
                 console.warn('WebSocket接続が無効 - 再接続試行');
@@ -596,54 +709,90 @@ startConnectionManagement() {
             return;
         }
 
-        // ★ 修正：現在の移動速度を計算して含める
-        let currentSpeed = 0;
-        let isMoving = false;
-        
-        // MapManagerから現在の速度情報を取得
-        if (state.participantId && mapManager.speedHistory && mapManager.speedHistory[state.participantId]) {
-            const speeds = mapManager.speedHistory[state.participantId];
-            if (speeds.length > 0) {
-                currentSpeed = speeds[speeds.length - 1]; // 最新の速度
-                isMoving = currentSpeed >= 3; // 3km/h以上で移動中と判定
-            }
+        this.sendPing();
+    }, 'network');
+}
+
+// ★ 現在の移動速度を含むpingを送信
+sendPing() {
+    let currentSpeed = 0;
+    let isMoving = false;
+    
+    // MapManagerから現在の速度情報を取得
+    if (state.participantId && mapManager.speedHistory && mapManager.speedHistory[state.participantId]) {
+        const speeds = mapManager.speedHistory[state.participantId];
+        if (speeds.length > 0) {
+            currentSpeed = speeds[speeds.length - 1]; // 最新の速度
+            isMoving = currentSpeed >= 3; // 3km/h以上で移動中と判定
         }
+    }
+    
+    // 位置監視側で移動を検出している場合も移動中として報告
+    isMoving = isMoving || state.lastReportedMoving;
 
-        // Pingデータ送信（速度情報を追加）
-        const pingData = {
-            type: 'ping',
-            participant_id: state.participantId,
-            timestamp: Date.now(),
-            is_sharing: state.isSharing,
-            has_position: !!state.lastKnownPosition,
-            is_background: state.isInBackground,
-            is_mobile: this.isMobileDevice(),
-            keep_connection: true,
-            status: state.isSharing ? 'sharing' : 'waiting',
-            // ★ 追加：速度情報
-            current_speed: currentSpeed,
-            is_moving: isMoving
-        };
-            
-        this.send(pingData);
-    }, pingInterval);
+    // Pingデータ送信（速度情報を追加）
+    const pingData = {
+        type: 'ping',
+        participant_id: state.participantId,
+        timestamp: Date.now(),
+        is_sharing: state.isSharing,
+        has_position: !!state.lastKnownPosition,
+        is_background: state.isInBackground,
+        is_mobile: this.isMobileDevice(),
+        keep_connection: true,
+        status: state.isSharing ? 'sharing' : 'waiting',
+        // ★ 追加：速度情報
+        current_speed: currentSpeed,
+        is_moving: isMoving
+    };
+        
+    return this.send(pingData);
+}
+
+// ★ サーバー推奨の送信間隔を適用
+applyServerIntervals(data) {
+    if (!data || !data.report_interval || !data.ping_interval) return;
+    
+    const previous = state.serverIntervals;
+    state.serverIntervals = {
+        report_interval: data.report_interval,
+        ping_interval: data.ping_interval
+    };
+    
+    // ping間隔が変わった場合のみタイマーを再設定
+    if (!previous || previous.ping_interval !== data.ping_interval) {
+        if (this.connectionInterval && this.currentPingInterval !== data.ping_interval) {
+            this.startConnectionManagement();
+        }
+        if (this.backgroundKeepAliveInterval && state.isInBackground) {
+            this.startBackgroundKeepAlive();
+        }
+    }
+    
+    if (!previous || previous.report_interval !== data.report_interval) {
+        if (locationManager.backgroundLocationUpdate) {
+            locationManager.startBackgroundLocationUpdate();
+        }
+    }
 }
     
     stopConnectionManagement() {
         if (this.connectionInterval) {
-            clearInterval(this.connectionInterval);
+            scheduler.cancel(this.connectionInterval);
             this.connectionInterval = null;
         }
     }
     
     startBackgroundKeepAlive() {
-        if (this.backgroundKeepAliveInterval) {
-            clearInterval(this.backgroundKeepAliveInterval);
-        }
+        scheduler.cancel(this.backgroundKeepAliveInterval);
         
-        const keepAliveInterval = this.isMobileDevice() ? 30000 : 20000;
+        const defaultKeepAlive = this.isMobileDevice() ? 30000 : 20000;
+        const keepAliveInterval = state.serverIntervals?.ping_interval || defaultKeepAlive;
         
-        this.backgroundKeepAliveInterval = setInterval(() => {
+        this.backgroundKeepAliveInterval = scheduler.every('background-keepalive', keepAliveInterval, () => {
+            // 直前にpingか位置情報を送っていれば接続維持のための送信は不要
+            if (Date.now() - (this.lastPresenceSentAt || 0) < keepAliveInterval / 2) return;
+            
             if (state.isInBackground && this.websocket && this.websocket.readyState === WebSocket.OPEN) {
                 const pingData = {
                     type: 'ping',
@@ -659,12 +808,12 @@ startConnectionManagement() {
                 
                 this.send(pingData);
             }
-        }, keepAliveInterval);
+        }, 'network');
     }
     
     stopBackgroundKeepAlive() {
         if (this.backgroundKeepAliveInterval) {
-            clearInterval(this.backgroundKeepAliveInterval);
+            scheduler.cancel(this.backgroundKeepAliveInterval);
             this.backgroundKeepAliveInterval = null;
         }
     }
@@ -709,16 +858,22 @@ handle(data) {
             this.handleDuplicateCleanupResponse(data);
             break;
         case 'chat_message':
-            chatManager.handleIncomingMessage(data);
+            chatLoader.dispatch('handleIncomingMessage', data);
+            break;
+        case 'chat_message_saved':
+            chatLoader.dispatch('handleMessageSaved', data);
             break;
         case 'typing_indicator':
-            chatManager.handleTypingIndicator(data);
+            chatLoader.dispatch('handleTypingIndicator', data);
             break;
         case 'chat_history':
-            chatManager.handleChatHistory(data);
+            chatLoader.dispatch('handleChatHistory', data);
+            break;
+        case 'chat_history_page':
+            chatLoader.dispatch('handleChatHistoryPage', data);
             break;
         case 'participant_status_update':
-            chatManager.handleParticipantStatusUpdate(data);
+            chatLoader.dispatch('handleParticipantStatusUpdate', data);
             break;
         case 'remove_direction_indicator':  // ★ 追加
             this.handleRemoveDirectionIndicator(data);
@@ -757,6 +912,9 @@ handleSingleParticipantUpdate(data) {
     }
     
     const participantData = data.participant_data;
+    if (data.roster_etag) {
+        state.rosterEtag = data.roster_etag;
+    }
     
     // 自分の更新も処理する
     const isOwnUpdate = participantData.participant_id === state.participantId;
@@ -1081,6 +1239,13 @@ requestLatestParticipantsList() {
 
     
     handleLocationUpdate(data) {
+    wsManager.applyServerIntervals(data);
+    if (data.roster_etag) {
+        state.rosterEtag = data.roster_etag;
+    }
+    if (data.distances) {
+        state.distances = data.distances;
+    }
     if (data.locations) {
         
         // ★ 修正：重複処理を先に実行してから状態変化を検出
@@ -1146,6 +1311,7 @@ requestLatestParticipantsList() {
     }
     
     handlePong(data) {
+        wsManager.applyServerIntervals(data);
         if (ui.elements.lastCommunication) {
             ui.elements.lastCommunication.textContent = new Date().toLocaleTimeString() + ' (pong)';
         }
@@ -1411,6 +1577,13 @@ constructor() {
     
     // ★ 追加：最後の有意な移動時刻
     this.lastSignificantMovement = null;
+    
+    // 未接続中の測位（再接続時にまとめて送信）
+    this.bufferedFixes = [];
+    this.BATCH_CONFIG = {
+        MAX_BUFFERED: 300,          // 保持する測位数の上限（古いものから破棄）
+        CHUNK_SIZE: 25,             // 1メッセージあたりの測位数
+    };
 }
     
     
@@ -1581,12 +1754,23 @@ handlePositionUpdate(position) {
         currentTime - this.lastSignificantMovement : 0;
     const isStationary = timeSinceLastMovement > 60000; // 1分以上移動なしで完全静止と判定
     
+    // ★ 移動状態が変わったら即座にpingで報告し、推奨間隔を更新してもらう
+    if (state.lastReportedMoving === isStationary) {
+        state.lastReportedMoving = !isStationary;
+        wsManager.sendPing();
+    }
+    
+    // ★ サーバー推奨の送信間隔（滞在地点が変わるほどの移動は待たずに送信）
+    const reportInterval = state.serverIntervals?.report_interval || this.UPDATE_CONFIG.MIN_INTERVAL;
+    const minInterval = distance >= 30 ? this.UPDATE_CONFIG.MIN_INTERVAL : Math.max(this.UPDATE_CONFIG.MIN_INTERVAL, reportInterval);
+    const maxInterval = Math.max(this.UPDATE_CONFIG.MAX_INTERVAL, reportInterval);
+    
     // 送信判定
     let shouldSend = false;
     let reason = '';
     
     // 最小間隔チェック
-    if (timeSinceLastUpdate < this.UPDATE_CONFIG.MIN_INTERVAL) {
+    if (timeSinceLastUpdate < minInterval) {
         shouldSend = false;
         reason = '最小間隔未満';
     }
@@ -1596,7 +1780,7 @@ handlePositionUpdate(position) {
         reason = `移動検出 (${distance.toFixed(1)}m)`;
     }
     // 通常の最大間隔チェック
-    else if (timeSinceLastUpdate >= this.UPDATE_CONFIG.MAX_INTERVAL) {
+    else if (timeSinceLastUpdate >= maxInterval) {
         shouldSend = true;
         reason = '最大間隔到達';
     }
@@ -1781,7 +1965,43 @@ sendLocationUpdate(position) {
     if (wsManager.websocket && wsManager.websocket.readyState === WebSocket.OPEN) {
         wsManager.send(locationData);
     } else {
-        console.warn('WebSocket未接続のため位置情報送信をスキップ');
+        // 未接続中は測位をためておき、再接続時にまとめて送信
+        this.bufferFix(position);
+    }
+}
+
+bufferFix(position) {
+    this.bufferedFixes.push({
+        latitude: position.coords.latitude,
+        longitude: position.coords.longitude,
+        accuracy: this.validateAccuracy(position.coords.accuracy),
+        timestamp: position.timestamp || Date.now()
+    });
+    if (this.bufferedFixes.length > this.BATCH_CONFIG.MAX_BUFFERED) {
+        this.bufferedFixes.splice(0, this.bufferedFixes.length - this.BATCH_CONFIG.MAX_BUFFERED);
+    }
+}
+
+flushBufferedFixes() {
+    if (!this.bufferedFixes.length || !state.participantId || !state.isSharing) {
+        this.bufferedFixes = [];
+        return;
+    }
+    
+    // 時刻順に分割して送信（サーバーは各バッチの最新位置のみ通知）
+    while (this.bufferedFixes.length) {
+        const fixes = this.bufferedFixes.slice(0, this.BATCH_CONFIG.CHUNK_SIZE);
+        const sent = wsManager.send({
+            type: 'location_batch',
+            participant_id: state.participantId,
+            participant_name: state.getParticipantName(),
+            is_background: state.isInBackground,
+            fixes: fixes
+        });
+        if (!sent) {
+            break;
+        }
+        this.bufferedFixes.splice(0, fixes.length);
     }
 }
 
@@ -2161,22 +2381,21 @@ handleLocationError(error) {
     }
     
     startBackgroundLocationUpdate() {
-        if (this.backgroundLocationUpdate) {
-            clearInterval(this.backgroundLocationUpdate);
-        }
+        scheduler.cancel(this.backgroundLocationUpdate);
         
-        const updateInterval = wsManager.isMobileDevice() ? CONFIG.BACKGROUND_UPDATE_INTERVAL : 10000;
+        const defaultInterval = wsManager.isMobileDevice() ? CONFIG.BACKGROUND_UPDATE_INTERVAL : 10000;
+        const updateInterval = Math.max(defaultInterval, state.serverIntervals?.report_interval || 0);
         
-        this.backgroundLocationUpdate = setInterval(() => {
+        this.backgroundLocationUpdate = scheduler.every('background-location', updateInterval, () => {
             if (state.isInBackground && state.isSharing && state.lastKnownPosition) {
                 this.sendLocationUpdate(state.lastKnownPosition);
             }
-        }, updateInterval);
+        }, 'network');
     }
     
     stopBackgroundLocationUpdate() {
         if (this.backgroundLocationUpdate) {
-            clearInterval(this.backgroundLocationUpdate);
+            scheduler.cancel(this.backgroundLocationUpdate);
             this.backgroundLocationUpdate = null;
         }
     }
@@ -3166,17 +3385,13 @@ createClusterCenterPopup(participants, centerLat, centerLng) {
         navigationButton.style.boxShadow = 'none';
     };
     
-    const buttonUpdateInterval = setInterval(() => {
+    const buttonUpdateJob = scheduler.every(`cluster-popup:${centerLat},${centerLng}`, 1000, () => {
         if (popupDiv.closest('.leaflet-popup-content')) {
-            const previousFollowingState = focusButton.disabled;
             updateButtonStates();
-            
-            if (previousFollowingState !== focusButton.disabled) {
-            }
         } else {
-            clearInterval(buttonUpdateInterval);
+            scheduler.cancel(buttonUpdateJob);
         }
-    }, 1000);
+    }, 'render');
     
     updateButtonStates();
     
@@ -3291,11 +3506,11 @@ startGroupFollowing(participants) {
 startGroupFollowingTimer() {
     // 既存のタイマーをクリア
     if (this.groupFollowingTimer) {
-        clearInterval(this.groupFollowingTimer);
+        scheduler.cancel(this.groupFollowingTimer);
         this.groupFollowingTimer = null;
     }
 
-    this.groupFollowingTimer = setInterval(() => {
+    this.groupFollowingTimer = scheduler.every('group-following', 1000, () => {
         // グループ追従中でない場合は停止
         if (!state.followingGroup || state.followingGroup.length === 0) {
             this.stopGroupFollowingTimer();
@@ -3322,7 +3537,7 @@ startGroupFollowingTimer() {
         
         // 現在の拡大率を維持してグループの中心に移動
         this.followGroupWithCurrentZoom(groupMembers);
-    }, 1000); // 1秒間隔で追従
+    }, 'render'); // 1秒間隔で追従
 }
 // === ：現在の拡大率でグループ追従 ===
 followGroupWithCurrentZoom(participants) {
@@ -3341,7 +3556,7 @@ followGroupWithCurrentZoom(participants) {
 stopGroupFollowingTimer() {
     
     if (this.groupFollowingTimer) {
-        clearInterval(this.groupFollowingTimer);
+        scheduler.cancel(this.groupFollowingTimer);
         this.groupFollowingTimer = null;
     }
     
@@ -3800,7 +4015,7 @@ updateSingleMarker(location) {
 startRegularAnimationForStationary(participantId, latitude, longitude, color, accuracy) {
     // 既存のインターバルがあればクリア
     if (this.regularAnimationIntervals[participantId]) {
-        clearInterval(this.regularAnimationIntervals[participantId]);
+        scheduler.cancel(this.regularAnimationIntervals[participantId]);
         delete this.regularAnimationIntervals[participantId];
     }
     
@@ -3808,17 +4023,17 @@ startRegularAnimationForStationary(participantId, latitude, longitude, color, ac
     this.createRippleAnimation(participantId, latitude, longitude, color, accuracy);
     
     // 3秒ごとの定期更新を設定
-    this.regularAnimationIntervals[participantId] = setInterval(() => {
+    this.regularAnimationIntervals[participantId] = scheduler.every(`ripple:${participantId}`, 3000, () => {
         // オンラインかつ共有中のみアニメーション
         const participant = state.participantsData.find(p => p.participant_id === participantId);
         if (participant && participant.is_online && participant.status === 'sharing') {
             this.createRippleAnimation(participantId, latitude, longitude, color, accuracy);
         } else {
             // オフラインまたは未共有になったらインターバルを停止
-            clearInterval(this.regularAnimationIntervals[participantId]);
+            scheduler.cancel(this.regularAnimationIntervals[participantId]);
             delete this.regularAnimationIntervals[participantId];
         }
-    }, 3000); // 3秒ごと
+    }, 'render'); // 3秒ごと
 }
 
 // 移動停止タイマーを開始
@@ -4732,7 +4947,7 @@ startRegularAnimation(participantId, latitude, longitude, color, accuracy) {
     // ★ 3秒ごとの定期更新を削除
     // 既存のインターバルがあればクリアのみ行う
     if (this.regularAnimationIntervals[participantId]) {
-        clearInterval(this.regularAnimationIntervals[participantId]);
+        scheduler.cancel(this.regularAnimationIntervals[participantId]);
         delete this.regularAnimationIntervals[participantId];
     }
     // インターバルの新規設定は行わない
@@ -4740,7 +4955,7 @@ startRegularAnimation(participantId, latitude, longitude, color, accuracy) {
     
     stopRegularAnimation(participantId) {
         if (this.regularAnimationIntervals[participantId]) {
-            clearInterval(this.regularAnimationIntervals[participantId]);
+            scheduler.cancel(this.regularAnimationIntervals[participantId]);
             delete this.regularAnimationIntervals[participantId];
         }
     }
@@ -5013,7 +5228,7 @@ cleanupRemovedParticipants(removedParticipantIds) {
         
         // 8. ★ アニメーション関連のクリーンアップ
         if (mapManager.regularAnimationIntervals[participantId]) {
-            clearInterval(mapManager.regularAnimationIntervals[participantId]);
+            scheduler.cancel(mapManager.regularAnimationIntervals[participantId]);
             delete mapManager.regularAnimationIntervals[participantId];
         }
         
@@ -5151,6 +5366,21 @@ createParticipantElement(location) {
         if (icon) {
             icon.className = `fas fa-bullseye me-1 ${accuracyClass}`;
         }
+        
+        // ★ 自分からの距離（サーバー側で計算済み）
+        const distanceInfo = !isMe && state.distances ? state.distances[location.participant_id] : null;
+        if (distanceInfo) {
+            contentDiv.appendChild(document.createElement('br'));
+            
+            const distanceSpan = document.createElement('small');
+            distanceSpan.className = 'text-muted';
+            const distanceText = distanceInfo.distance >= 1000 ?
+                `${(distanceInfo.distance / 1000).toFixed(1)}km` :
+                `${Math.round(distanceInfo.distance)}m`;
+            const etaMinutes = Math.max(1, Math.round(distanceInfo.eta_seconds / 60));
+            distanceSpan.innerHTML = `<i class="fas fa-route me-1"></i>距離: ${distanceText} (約${etaMinutes}分)`;
+            contentDiv.appendChild(distanceSpan);
+        }
     }
     
     participantDiv.appendChild(statusDot);
@@ -5458,14 +5688,8 @@ leave() {
         localStorage.setItem(`leaving_timestamp_${state.sessionId}`, Date.now().toString());
         
         // WebSocket の再接続タイマーをすべてクリア
-        if (wsManager.connectionInterval) {
-            clearInterval(wsManager.connectionInterval);
-            wsManager.connectionInterval = null;
-        }
-        if (wsManager.backgroundKeepAliveInterval) {
-            clearInterval(wsManager.backgroundKeepAliveInterval);
-            wsManager.backgroundKeepAliveInterval = null;
-        }
+        wsManager.stopConnectionManagement();
+        wsManager.stopBackgroundKeepAlive();
         
         // 位置情報共有を停止
         if (locationManager.watchId) {
@@ -5549,14 +5773,8 @@ finalizeLeave() {
     }
     
     // タイマーをクリア
-    if (wsManager.connectionInterval) {
-        clearInterval(wsManager.connectionInterval);
-        wsManager.connectionInterval = null;
-    }
-    if (wsManager.backgroundKeepAliveInterval) {
-        clearInterval(wsManager.backgroundKeepAliveInterval);
-        wsManager.backgroundKeepAliveInterval = null;
-    }
+    wsManager.stopConnectionManagement();
+    wsManager.stopBackgroundKeepAlive();
     
     // 状態をクリア（エラーを無視）
     try {
@@ -6114,7 +6332,7 @@ class LocationSharingApp {
         window.sessionManager = new SessionManager();
         window.backgroundManager = new BackgroundManager();
         window.eventHandlerManager = new EventHandlerManager();
-        window.chatManager = new ChatManager();
+        chatLoader.bindButton();
         // 短縮参照を作成
         window.state = state;
         window.ui = ui;
@@ -6164,6 +6382,9 @@ async init() {
         ui.elements.participantsList.innerHTML = '<div class="text-center text-muted">参加者情報を読み込み中...</div>';
     }
     
+    // ページに埋め込まれた名簿を表示（WebSocket接続を待たない）
+    this.applyInitialRoster();
+    
     // WebSocket接続を開始（即座に）
     wsManager.init();
     
@@ -6172,6 +6393,26 @@ async init() {
     ui.updateStatus('visibility', 'active', 'アクティブ');
 }
     
+    applyInitialRoster() {
+        const element = document.getElementById('initial-roster');
+        if (!element) {
+            return;
+        }
+        try {
+            const roster = JSON.parse(element.textContent);
+            if (roster && Array.isArray(roster.locations)) {
+                messageHandler.handleLocationUpdate({
+                    type: 'location_update',
+                    locations: roster.locations,
+                    distances: roster.distances,
+                    roster_etag: roster.etag
+                });
+            }
+        } catch (error) {
+            console.error('初期名簿の読み込みエラー:', error);
+        }
+    }
+    
     restoreSessionState() {
         
         const savedState = state.load();
@@ -6215,17 +6456,17 @@ async init() {
     
     setupPeriodicTasks() {
         // カウントダウン更新
-        setInterval(() => ui.updateCountdown(), 1000);
+        scheduler.every('countdown', 1000, () => ui.updateCountdown(), 'render');
         
         // 参加者表示更新
-        setInterval(() => participantManager.updateDisplay(), CONFIG.PARTICIPANTS_UPDATE);
+        scheduler.every('participants-display', CONFIG.PARTICIPANTS_UPDATE, () => participantManager.updateDisplay(), 'render');
         
         // 定期的な状態保存
-        setInterval(() => {
+        scheduler.every('state-save', 30000, () => {
             if (state.isSharing) {
                 state.save();
             }
-        }, 30000);
+        });
     }
     
     // === アプリケーション初期化と制御 - setupPageUnloadHandler メソッドの修正 ===
@@ -6325,1405 +6566,54 @@ function validateData() {
     
     return true;
 }
-// === チャット管理クラス ===
-class ChatManager {
-    constructor() {
-        this.currentChatTarget = null;
-        this.messages = {
-            group: [],
-            individual: {}
-        };
-        this.unreadCounts = {
-            group: 0,
-            individual: {}
-        };
-        this.typingTimers = {};
-        this.isTyping = {};
-        this.participantStatusInterval = null;
-        this.rapidStatusInterval = null;
-        this.scrollPosition = 0;
-        
-        this.initElements();
-        this.startStatusUpdateTimer();
-        this.loadMessages();
-        
-        // モーダル外クリックで閉じる
-        this.chatModal?.addEventListener('click', (e) => {
-            if (e.target === this.chatModal) {
-                this.closeChat();
-            }
-        });
-        this.typingStates = {}; // 入力状態を管理
-        this.typingCheckIntervals = {}; // 入力状態チェック用インターバル
-        // 二重タップ防止用のフラグ
-        this.isTransitioning = false;
-        this.lastTapTime = 0;
-    }
-    
-    initElements() {
-    this.chatButton = document.getElementById('chat-button');
-    this.chatBadge = document.getElementById('chat-badge');
-    this.chatModal = document.getElementById('chat-modal');
-    
-    // イベントリスナー
-    this.chatButton?.addEventListener('click', () => this.openChat());
-    
-    // モーダル外クリックで閉じる
-    this.chatModal?.addEventListener('click', (e) => {
-        if (e.target === this.chatModal) {
-            this.closeChat();
-        }
-    });
-    
-    // 入力中表示のイベントリスナーを追加
-        const groupInput = document.getElementById('group-input');
-        const individualInput = document.getElementById('individual-input');
+// === チャットの遅延読み込み ===
+// チャット機能（chat.js）は初回表示後に読み込み、低速端末での初期解析時間を減らす
+const chatLoader = {
+    promise: null,
     
-        if (groupInput) {
-            // 入力開始時
-            groupInput.addEventListener('input', () => {
-                this.handleTypingStart('group', groupInput);
-            });
-            
-            // フォーカス喪失時
-            groupInput.addEventListener('blur', () => {
-                this.handleTypingEnd('group');
-            });
-        }
-        
-        if (individualInput) {
-            individualInput.addEventListener('input', () => {
-                if (this.currentChatTarget) {
-                    this.handleTypingStart(this.currentChatTarget, individualInput);
-                }
-            });
-            
-            individualInput.addEventListener('blur', () => {
-                if (this.currentChatTarget) {
-                    this.handleTypingEnd(this.currentChatTarget);
-                }
+    load() {
+        if (!this.promise) {
+            this.promise = new Promise((resolve, reject) => {
+                const script = document.createElement('script');
+                script.src = window.djangoData.chatScriptUrl;
+                script.async = true;
+                script.nonce = document.querySelector('script[nonce]')?.nonce || '';
+                script.onload = () => {
+                    window.chatManager = new ChatManager();
+                    resolve(window.chatManager);
+                };
+                script.onerror = () => {
+                    this.promise = null;
+                    reject(new Error('チャット機能の読み込みに失敗しました'));
+                };
+                document.head.appendChild(script);
             });
         }
-
-        
-    
-    // 文字数カウンターを追加
-    ['group-input', 'individual-input'].forEach(id => {
-        const input = document.getElementById(id);
-        if (!input) return;
-        
-        // 既存のカウンターがあれば削除
-        const existingCounter = input.parentElement.querySelector('.char-counter');
-        if (existingCounter) {
-            existingCounter.remove();
-        }
-        
-        // 文字数カウンター要素を作成
-        const counter = document.createElement('div');
-        counter.className = 'char-counter';
-        counter.style.cssText = `
-            position: absolute;
-            right: 50px;
-            bottom: 10px;
-            font-size: 11px;
-            color: #999;
-            pointer-events: none;
-        `;
-        counter.textContent = '0/200';
-        input.parentElement.style.position = 'relative';
-        input.parentElement.appendChild(counter);
-        
-        // 入力時に文字数を更新
-        input.addEventListener('input', () => {
-            const length = input.value.length;
-            counter.textContent = `${length}/200`;
-            
-            if (length > 200) {
-                counter.style.color = '#dc3545';
-                counter.style.fontWeight = 'bold';
-                input.style.borderColor = '#dc3545';
-            } else if (length > 180) {
-                counter.style.color = '#ffc107';
-                counter.style.fontWeight = 'normal';
-                input.style.borderColor = '';
-            } else {
-                counter.style.color = '#999';
-                counter.style.fontWeight = 'normal';
-                input.style.borderColor = '';
-            }
-        });
-        
-        // Enterキーで送信
-        input.addEventListener('keypress', (e) => {
-            if (e.key === 'Enter') {
-                e.preventDefault();
-                const length = input.value.trim().length;
-                if (length > 200) {
-                    this.showMessageLengthError(id === 'group-input' ? 'group' : 'individual');
-                    return;
-                }
-                
-                if (id === 'group-input') {
-                    this.sendGroupMessage();
-                } else {
-                    this.sendIndividualMessage();
-                }
-            }
-        });
-    });
-    
-    // iOS ズーム防止
-    const inputs = document.querySelectorAll('.chat-input, #participant-name');
-    inputs.forEach(input => {
-        input.addEventListener('focus', (e) => {
-            if (/iPhone|iPad|iPod/.test(navigator.userAgent)) {
-                e.preventDefault();
-                e.target.style.fontSize = '16px';
-                setTimeout(() => {
-                    e.target.setSelectionRange(e.target.value.length, e.target.value.length);
-                }, 0);
-            }
-        });
-        
-        let lastTouchEnd = 0;
-        input.addEventListener('touchend', (e) => {
-            const now = Date.now();
-            if (now - lastTouchEnd <= 300) {
-                e.preventDefault();
-            }
-            lastTouchEnd = now;
-        });
-    });
-}
-    
-    // 新規メソッド：入力開始処理
-    handleTypingStart(target, inputElement) {
-        const hasContent = inputElement.value.trim().length > 0;
-        
-        // 初めて文字が入力された場合
-        if (hasContent && !this.typingStates[target]) {
-            this.typingStates[target] = true;
-            
-            // 入力中通知を送信
-            this.sendTypingIndicator(target, true);
-            
-            // 定期的に入力状態をチェック
-            this.startTypingCheck(target, inputElement);
-        }
-        
-        // 文字が全て削除された場合
-        if (!hasContent && this.typingStates[target]) {
-            this.handleTypingEnd(target);
-        }
-    }
-    
-    // 新規メソッド：入力終了処理
-    handleTypingEnd(target) {
-        if (this.typingStates[target]) {
-            this.typingStates[target] = false;
-            
-            // 入力終了通知を送信
-            this.sendTypingIndicator(target, false);
-            
-            // チェックインターバルをクリア
-            this.stopTypingCheck(target);
-        }
-    }
-    
-    // 新規メソッド：定期的な入力状態チェック
-    startTypingCheck(target, inputElement) {
-        // 既存のインターバルをクリア
-        this.stopTypingCheck(target);
-        
-        // 500msごとに入力状態をチェック
-        this.typingCheckIntervals[target] = setInterval(() => {
-            const hasContent = inputElement.value.trim().length > 0;
-            
-            if (!hasContent && this.typingStates[target]) {
-                // 内容が空になったら入力終了
-                this.handleTypingEnd(target);
-            } else if (hasContent && this.typingStates[target]) {
-                // まだ入力中の場合は継続通知を送信（10秒ごと）
-                const now = Date.now();
-                const lastSent = this.lastTypingSent?.[target] || 0;
-                
-                if (now - lastSent > 10000) { // 10秒経過
-                    this.sendTypingIndicator(target, true);
-                    if (!this.lastTypingSent) this.lastTypingSent = {};
-                    this.lastTypingSent[target] = now;
-                }
-            }
-        }, 500);
-    }
+        return this.promise;
+    },
     
-    // 新規メソッド：入力状態チェック停止
-    stopTypingCheck(target) {
-        if (this.typingCheckIntervals[target]) {
-            clearInterval(this.typingCheckIntervals[target]);
-            delete this.typingCheckIntervals[target];
+    // 読み込み前に届いたメッセージは読み込み後に順番どおり処理
+    dispatch(method, data) {
+        if (window.chatManager) {
+            chatManager[method](data);
+            return;
         }
-    }
-    
-    // 新規メソッド：入力中通知送信
-    sendTypingIndicator(target, isTyping) {
-        wsManager.send({
-            type: 'typing_indicator',
-            chat_type: target === 'group' ? 'group' : 'individual',
-            target_id: target === 'group' ? null : target,
-            sender_id: state.participantId,
-            sender_name: this.getParticipantNameSafe(),
-            is_typing: isTyping
-        });
-    }
-
-    loadMessages() {
-        this.messages = { group: [], individual: {} };
-        this.unreadCounts = { group: 0, individual: {} };
-        
-        // WebSocket接続後にサーバーから履歴と未読カウントを要求
-        const checkAndRequest = () => {
-            if (wsManager && wsManager.websocket && 
-                wsManager.websocket.readyState === WebSocket.OPEN) {
-                const participantId = state.participantId || window.djangoData.participantId;
-                
-                if (participantId) {
-                    wsManager.send({
-                        type: 'request_chat_history',
-                        session_id: state.sessionId,
-                        participant_id: participantId
-                    });
-                } else {
-                    console.error('Participant ID not available');
-                    setTimeout(checkAndRequest, 500);
-                }
-            } else {
-                setTimeout(checkAndRequest, 500);
-            }
-        };
-        
-        setTimeout(checkAndRequest, 1000);
-    }
-    
-    handleChatHistory(data) {
-    if (!data.messages) return;
-    
-    
-    // メッセージを復元
-    this.messages = { group: [], individual: {} };
-    
-    // グループメッセージを復元
-    if (Array.isArray(data.messages.group)) {
-        this.messages.group = data.messages.group;
-    }
-    
-    // 個別メッセージを復元
-    if (data.messages.individual) {
-        Object.keys(data.messages.individual).forEach(conversationPartnerId => {
-            if (!this.messages.individual[conversationPartnerId]) {
-                this.messages.individual[conversationPartnerId] = [];
+        this.load()
+            .then(manager => manager[method](data))
+            .catch(error => console.error(error.message));
+    },
+    
+    // 読み込み前にチャットボタンが押された場合は読み込み後に開く
+    bindButton() {
+        document.getElementById('chat-button')?.addEventListener('click', () => {
+            if (!window.chatManager) {
+                this.load()
+                    .then(manager => manager.openChat())
+                    .catch(error => console.error(error.message));
             }
-            
-            this.messages.individual[conversationPartnerId] = 
-                data.messages.individual[conversationPartnerId];
-        });
-    }
-    
-    // 未読カウントを復元（修正版）
-    if (data.unread_counts) {
-        // サーバーから受け取った未読数を使用
-        this.unreadCounts = {
-            group: data.unread_counts.group || 0,
-            individual: data.unread_counts.individual || {}
-        };
-        
-    } else {
-        // サーバーから未読数が提供されない場合のフォールバック
-        this.calculateUnreadCountsWithSessionCheck();
-    }
-    
-    // UIを更新
-    this.updateBadge();
-    this.updateParticipantsList();
-    
-    // 現在開いているチャットを再描画
-    const activeGroupChat = document.getElementById('group-chat-screen')?.classList.contains('active');
-    const activeIndividualChat = document.getElementById('individual-chat-screen')?.classList.contains('active');
-    
-    if (activeGroupChat) {
-        this.renderGroupMessages();
-    } else if (activeIndividualChat && this.currentChatTarget) {
-        this.renderIndividualMessages(this.currentChatTarget);
+        }, { once: true });
     }
-    
-}
-calculateUnreadCountsWithSessionCheck() {
-    const participantId = state.participantId || window.djangoData.participantId;
-    
-    // セッションストレージから最後に読んだメッセージのタイムスタンプを取得
-    const lastReadTimestamps = this.getLastReadTimestamps();
-    
-    // グループメッセージの未読数を計算
-    this.unreadCounts.group = this.messages.group.filter(msg => {
-        // 自分のメッセージは除外
-        if (msg.sender_id === participantId) return false;
-        
-        // 既読フラグが設定されている場合
-        if (msg.is_read) return false;
-        
-        // 最後に読んだ時刻より新しいメッセージのみ未読とする
-        const msgTime = new Date(msg.timestamp).getTime();
-        const lastReadTime = lastReadTimestamps.group || 0;
-        return msgTime > lastReadTime;
-    }).length;
-    
-    // 個別メッセージの未読数を計算
-    this.unreadCounts.individual = {};
-    
-    Object.keys(this.messages.individual).forEach(conversationPartnerId => {
-        const lastReadTime = lastReadTimestamps.individual[conversationPartnerId] || 0;
-        
-        const unreadCount = this.messages.individual[conversationPartnerId].filter(msg => {
-            // 自分が送信したメッセージは除外
-            if (msg.sender_id === participantId) return false;
-            
-            // 自分宛でないメッセージは除外
-            if (msg.target_id !== participantId) return false;
-            
-            // 既読フラグが設定されている場合
-            if (msg.is_read) return false;
-            
-            // 最後に読んだ時刻より新しいメッセージのみ未読とする
-            const msgTime = new Date(msg.timestamp).getTime();
-            return msgTime > lastReadTime;
-        }).length;
-        
-        if (unreadCount > 0) {
-            this.unreadCounts.individual[conversationPartnerId] = unreadCount;
-        }
-    });
-    
-}
-
-// ：最後に読んだメッセージのタイムスタンプを管理
-getLastReadTimestamps() {
-    const key = `lastRead_${state.sessionId}_${state.participantId}`;
-    const stored = sessionStorage.getItem(key);
-    
-    if (stored) {
-        try {
-            return JSON.parse(stored);
-        } catch (e) {
-            console.warn('Failed to parse last read timestamps:', e);
-        }
-    }
-    
-    return {
-        group: 0,
-        individual: {}
-    };
-}
-setLastReadTimestamp(chatType, targetId = null) {
-    const key = `lastRead_${state.sessionId}_${state.participantId}`;
-    const timestamps = this.getLastReadTimestamps();
-    const now = Date.now();
-    
-    if (chatType === 'group') {
-        timestamps.group = now;
-    } else if (targetId) {
-        if (!timestamps.individual) {
-            timestamps.individual = {};
-        }
-        timestamps.individual[targetId] = now;
-    }
-    
-    sessionStorage.setItem(key, JSON.stringify(timestamps));
-}
-calculateUnreadCounts() {
-    const participantId = state.participantId || window.djangoData.participantId;
-    
-    // グループメッセージの未読数を計算
-    this.unreadCounts.group = this.messages.group.filter(msg => 
-        msg.sender_id !== participantId && !msg.is_read
-    ).length;
-    
-    // 個別メッセージの未読数を計算
-    this.unreadCounts.individual = {};
-    
-    Object.keys(this.messages.individual).forEach(conversationPartnerId => {
-        const unreadCount = this.messages.individual[conversationPartnerId].filter(msg => 
-            msg.sender_id !== participantId && 
-            msg.target_id === participantId && 
-            !msg.is_read
-        ).length;
-        
-        if (unreadCount > 0) {
-            this.unreadCounts.individual[conversationPartnerId] = unreadCount;
-        }
-    });
-    
-}
-openChat() {
-    this.chatModal.style.display = 'flex';
-    // 次のフレームでopenクラスを追加（アニメーション発動）
-    requestAnimationFrame(() => {
-        this.chatModal.classList.add('open');
-    });
-    
-    this.showParticipantsList();
-    this.updateParticipantsList();
-    this.startRapidStatusUpdate();
-    
-    if (window.innerWidth <= 768) {
-        document.body.classList.add('chat-modal-open');
-        this.scrollPosition = window.scrollY;
-        document.body.style.top = `-${this.scrollPosition}px`;
-    }
-}
-
-closeChat() {
-    this.chatModal.classList.remove('open');
-    // アニメーション完了後に非表示
-    setTimeout(() => {
-        this.chatModal.style.display = 'none';
-    }, 300);
-    
-    this.stopRapidStatusUpdate();
-    
-    if (window.innerWidth <= 768) {
-        document.body.classList.remove('chat-modal-open');
-        document.body.style.top = '';
-        window.scrollTo(0, this.scrollPosition || 0);
-    }
-}
-    
-    showParticipantsList() {
-        document.querySelectorAll('.chat-screen').forEach(screen => {
-            screen.classList.remove('active');
-        });
-        document.getElementById('participants-screen').classList.add('active');
-        this.updateParticipantsList();
-    }
-    
-updateParticipantsList() {
-    const listEl = document.getElementById('chat-participant-list');
-    if (!listEl) return;
-    
-    // 既存のイベントリスナーをクリア
-    listEl.innerHTML = '';
-    
-    const groupUnread = this.unreadCounts.group || 0;
-    const lastGroupMsg = this.messages.group[this.messages.group.length - 1];
-    
-    // グループセクションラベル
-    const groupSectionLabel = document.createElement('div');
-    groupSectionLabel.className = 'chat-section-label group-section';
-    groupSectionLabel.innerHTML = `
-        <i class="fas fa-users"></i>
-        <span>グループ</span>
-    `;
-    listEl.appendChild(groupSectionLabel);
-    
-    // グループチャット項目
-    const groupItem = document.createElement('div');
-    groupItem.className = 'chat-participant-item group';
-    groupItem.innerHTML = `
-        <div class="participant-avatar">
-            <i class="fas fa-users"></i>
-        </div>
-        <div class="participant-info">
-            <div class="participant-name">
-                <i class="fas fa-globe"></i> 全員
-            </div>
-            <div class="last-message">
-                ${lastGroupMsg ? this.truncateMessage(lastGroupMsg.text) : '全員でチャットしよう！'}
-            </div>
-        </div>
-        ${lastGroupMsg ? `<div class="message-time">${this.formatTime(lastGroupMsg.timestamp)}</div>` : ''}
-        ${groupUnread > 0 ? `<div class="unread-badge">${groupUnread}</div>` : ''}
-    `;
-    
-    // グループチャットのクリックイベントを直接設定
-    groupItem.addEventListener('click', (e) => {
-        e.preventDefault();
-        e.stopPropagation();
-        this.openGroupChat();
-    });
-    
-    // タッチイベントも追加（モバイル対応）
-    groupItem.addEventListener('touchend', (e) => {
-        e.preventDefault();
-        e.stopPropagation();
-        this.openGroupChat();
-    });
-    
-    listEl.appendChild(groupItem);
-    
-    // ★ 修正：参加者リストを名前順でソート（自分以外）
-    const sortedParticipants = [...state.participantsData]
-        .filter(p => p.participant_id !== state.participantId)
-        .sort((a, b) => {
-            // 名前でソート（大文字小文字を無視）
-            const nameA = (a.participant_name || `参加者${a.participant_id.substring(0, 4)}`).toLowerCase();
-            const nameB = (b.participant_name || `参加者${b.participant_id.substring(0, 4)}`).toLowerCase();
-            
-            // 名前が同じ場合はparticipant_idでソート（一貫性のため）
-            if (nameA === nameB) {
-                return a.participant_id.localeCompare(b.participant_id);
-            }
-            
-            return nameA.localeCompare(nameB);
-        });
-    
-    const hasParticipants = sortedParticipants.length > 0;
-    
-    if (hasParticipants) {
-        // 個別セクションラベル
-        const individualSectionLabel = document.createElement('div');
-        individualSectionLabel.className = 'chat-section-label individual-section';
-        individualSectionLabel.innerHTML = `
-            <i class="fas fa-user"></i>
-            <span>個別チャット</span>
-        `;
-        listEl.appendChild(individualSectionLabel);
-        
-        // ★ 修正：ソート済みの参加者を順番に表示
-        sortedParticipants.forEach(participant => {
-            const name = participant.participant_name || `参加者${participant.participant_id.substring(0, 4)}`;
-            const initials = name.substring(0, 2).toUpperCase();
-            const participantId = participant.participant_id;
-            
-            let statusClass = '';
-            let statusText = '';
-            
-            if (!participant.is_online) {
-                statusClass = 'offline';
-                statusText = 'オフライン';
-            } else if (participant.is_background) {
-                statusClass = 'background';
-                statusText = 'バックグラウンド';
-            } else if (participant.status === 'sharing') {
-                statusClass = 'sharing';
-                statusText = '位置共有中';
-            } else {
-                statusClass = 'waiting';
-                statusText = '共有待機中';
-            }
-            
-            const messages = this.messages.individual[participantId] || [];
-            const lastMsg = messages[messages.length - 1];
-            const unread = this.unreadCounts.individual[participantId] || 0;
-            
-            const participantItem = document.createElement('div');
-            participantItem.className = 'chat-participant-item';
-            participantItem.innerHTML = `
-                <div class="participant-avatar" style="background: ${mapManager.getParticipantColor(participantId)};">
-                    ${initials}
-                    <div class="status-indicator ${statusClass}"></div>
-                </div>
-                <div class="participant-info">
-                    <div class="participant-name">${this.escapeHtml(name)}</div>
-                    <div class="last-message">
-                        ${lastMsg ? this.truncateMessage(lastMsg.text) : 'タップしてチャット開始'}
-                    </div>
-                    <div class="participant-status ${statusClass}">${statusText}</div>
-                </div>
-                ${lastMsg ? `<div class="message-time">${this.formatTime(lastMsg.timestamp)}</div>` : ''}
-                ${unread > 0 ? `<div class="unread-badge">${unread}</div>` : ''}
-            `;
-            
-            // 個別チャットのクリックイベントを直接設定
-            participantItem.addEventListener('click', (e) => {
-                e.preventDefault();
-                e.stopPropagation();
-                this.openIndividualChat(participantId, name);
-            });
-            
-            // タッチイベントも追加（モバイル対応）
-            participantItem.addEventListener('touchend', (e) => {
-                e.preventDefault();
-                e.stopPropagation();
-                this.openIndividualChat(participantId, name);
-            });
-            
-            listEl.appendChild(participantItem);
-        });
-    } else {
-        // 参加者がいない場合の表示
-        const emptyDiv = document.createElement('div');
-        emptyDiv.style.cssText = 'text-align: center; padding: 20px; color: #999;';
-        emptyDiv.innerHTML = `
-            <i class="fas fa-user-friends" style="font-size: 48px; opacity: 0.3;"></i>
-            <p style="margin-top: 10px;">他の参加者を待っています...</p>
-        `;
-        listEl.appendChild(emptyDiv);
-    }
-}
-    
-openGroupChat() {
-    // 二重タップ防止
-    if (this.isTransitioning) return;
-    
-    const now = Date.now();
-    if (now - this.lastTapTime < 300) return;
-    this.lastTapTime = now;
-    
-    this.isTransitioning = true;
-    
-    document.querySelectorAll('.chat-screen').forEach(screen => {
-        screen.classList.remove('active');
-    });
-    document.getElementById('group-chat-screen').classList.add('active');
-    
-    // 最後に読んだタイムスタンプを更新
-    this.setLastReadTimestamp('group');
-    
-    // 未読メッセージがある場合は既読にする
-    if (this.unreadCounts.group > 0) {
-        wsManager.send({
-            type: 'mark_as_read',
-            participant_id: state.participantId,
-            chat_type: 'group'
-        });
-        
-        // ローカルの未読カウントをリセット
-        this.unreadCounts.group = 0;
-        this.updateBadge();
-    }
-    
-    this.renderGroupMessages();
-    this.scrollToBottom('group-messages');
-    
-    // チャット画面を開いた後の新着メッセージ監視を開始
-    this.startAutoReadMonitoring('group');
-    
-    // トランジション完了後にフラグをリセット
-    setTimeout(() => {
-        this.isTransitioning = false;
-    }, 300);
-}
-    
-openIndividualChat(participantId, participantName) {
-    // 二重タップ防止
-    if (this.isTransitioning) return;
-    
-    const now = Date.now();
-    if (now - this.lastTapTime < 300) return;
-    this.lastTapTime = now;
-    
-    this.isTransitioning = true;
-    this.currentChatTarget = participantId;
-    
-    document.querySelectorAll('.chat-screen').forEach(screen => {
-        screen.classList.remove('active');
-    });
-    document.getElementById('individual-chat-screen').classList.add('active');
-    document.getElementById('individual-chat-title').textContent = participantName;
-    
-    // 最後に読んだタイムスタンプを更新
-    this.setLastReadTimestamp('individual', participantId);
-    
-    // 未読メッセージがある場合は既読にする
-    const unreadCount = this.unreadCounts.individual[participantId] || 0;
-    if (unreadCount > 0) {
-        wsManager.send({
-            type: 'mark_as_read',
-            participant_id: state.participantId,
-            chat_type: 'individual',
-            sender_id: participantId
-        });
-        
-        // ローカルの未読カウントをリセット
-        this.unreadCounts.individual[participantId] = 0;
-        this.updateBadge();
-    }
-    
-    this.renderIndividualMessages(participantId);
-    this.scrollToBottom('individual-messages');
-    
-    // チャット画面を開いた後の新着メッセージ監視を開始
-    this.startAutoReadMonitoring('individual', participantId);
-    
-    // トランジション完了後にフラグをリセット
-    setTimeout(() => {
-        this.isTransitioning = false;
-    }, 300);
-}
-    startAutoReadMonitoring(chatType, targetId = null) {
-    // 既存の監視を停止
-    if (this.autoReadInterval) {
-        clearInterval(this.autoReadInterval);
-    }
-    
-    // 100msごとに新着メッセージをチェックして自動既読
-    this.autoReadInterval = setInterval(() => {
-        const isChatModalOpen = this.chatModal.style.display !== 'none';
-        if (!isChatModalOpen) {
-            clearInterval(this.autoReadInterval);
-            return;
-        }
-        
-        if (chatType === 'group') {
-            const isGroupChatOpen = document.getElementById('group-chat-screen')?.classList.contains('active');
-            if (isGroupChatOpen && this.unreadCounts.group > 0) {
-                this.markAsReadImmediately('group');
-            }
-        } else if (chatType === 'individual' && targetId) {
-            const isIndividualChatOpen = document.getElementById('individual-chat-screen')?.classList.contains('active');
-            const isCurrentChat = this.currentChatTarget === targetId;
-            if (isIndividualChatOpen && isCurrentChat && this.unreadCounts.individual[targetId] > 0) {
-                this.markAsReadImmediately('individual', targetId);
-            }
-        }
-    }, 100);
-}
-    sendGroupMessage() {
-        const input = document.getElementById('group-input');
-        const text = input.value.trim();
-        
-        if (!text) return;
-        
-        if (text.length > 200) {
-            this.showMessageLengthError('group');
-            return;
-        }
-        
-        // 入力状態をクリア
-        this.handleTypingEnd('group');
-        
-        const message = {
-            type: 'chat_message',
-            chat_type: 'group',
-            sender_id: state.participantId,
-            sender_name: this.getParticipantNameSafe(),
-            text: text,
-            timestamp: new Date().toISOString()
-        };
-        
-        wsManager.send(message);
-        this.addMessage('group', null, message);
-        
-        input.value = '';
-        
-        // 文字数カウンターをリセット
-        const counter = input.parentElement.querySelector('.char-counter');
-        if (counter) {
-            counter.textContent = '0/200';
-            counter.style.color = '#999';
-            counter.style.fontWeight = 'normal';
-        }
-        input.style.borderColor = '';
-    }
-    
-    sendIndividualMessage() {
-        const input = document.getElementById('individual-input');
-        const text = input.value.trim();
-        
-        if (!text || !this.currentChatTarget) return;
-        
-        if (text.length > 200) {
-            this.showMessageLengthError('individual');
-            return;
-        }
-        
-        // 入力状態をクリア
-        this.handleTypingEnd(this.currentChatTarget);
-        
-        const message = {
-            type: 'chat_message',
-            chat_type: 'individual',
-            sender_id: state.participantId,
-            sender_name: this.getParticipantNameSafe(),
-            target_id: this.currentChatTarget,
-            text: text,
-            timestamp: new Date().toISOString()
-        };
-        
-        wsManager.send(message);
-        this.addMessage('individual', this.currentChatTarget, message);
-        
-        input.value = '';
-        
-        // 文字数カウンターをリセット
-        const counter = input.parentElement.querySelector('.char-counter');
-        if (counter) {
-            counter.textContent = '0/200';
-            counter.style.color = '#999';
-            counter.style.fontWeight = 'normal';
-        }
-        input.style.borderColor = '';
-    }
-
-// ：文字数エラー表示メソッド
-showMessageLengthError(chatType) {
-    const inputId = chatType === 'group' ? 'group-input' : 'individual-input';
-    const input = document.getElementById(inputId);
-    
-    // エラーメッセージを表示
-    const errorDiv = document.createElement('div');
-    errorDiv.className = 'chat-error-message';
-    errorDiv.style.cssText = `
-        position: absolute;
-        bottom: 60px;
-        left: 10px;
-        right: 10px;
-        background: #dc3545;
-        color: white;
-        padding: 8px 12px;
-        border-radius: 8px;
-        font-size: 12px;
-        animation: shake 0.3s;
-        z-index: 1000;
-    `;
-    errorDiv.innerHTML = `
-        <i class="fas fa-exclamation-triangle"></i> 
-        メッセージは200文字以内で入力してください（現在: ${input.value.length}文字）
-    `;
-    
-    // 親要素に追加
-    input.parentElement.style.position = 'relative';
-    input.parentElement.appendChild(errorDiv);
-    
-    // 入力欄を赤くハイライト
-    input.style.borderColor = '#dc3545';
-    input.style.boxShadow = '0 0 0 0.2rem rgba(220, 53, 69, 0.25)';
-    
-    // 3秒後に削除
-    setTimeout(() => {
-        errorDiv.remove();
-        input.style.borderColor = '';
-        input.style.boxShadow = '';
-    }, 3000);
-}
-    handleIncomingMessage(data) {
-    if (data.sender_id === state.participantId) return;
-    
-    if (data.chat_type === 'group') {
-        this.messages.group.push(data);
-        
-        // チャット画面とグループチャットが開いているかチェック
-        const isGroupChatOpen = document.getElementById('group-chat-screen')?.classList.contains('active');
-        const isChatModalOpen = this.chatModal.style.display !== 'none';
-        
-        if (isGroupChatOpen && isChatModalOpen) {
-            // グループチャットを開いている場合は即座に既読にする
-            this.markAsReadImmediately('group');
-        } else {
-            // 開いていない場合のみ未読カウントを増やす
-            this.unreadCounts.group++;
-            this.updateBadge();
-        }
-        
-        // UIを更新
-        if (isGroupChatOpen) {
-            this.renderGroupMessages();
-        }
-        
-        // 参加者リストが開いている場合も即座に更新
-        if (document.getElementById('participants-screen')?.classList.contains('active')) {
-            this.updateParticipantsList();
-        }
-        
-        // 通知（チャットモーダルが閉じている場合のみ）
-        if (!isChatModalOpen) {
-            ui.showNotification(
-                `${data.sender_name}: ${this.truncateMessage(data.text)}`,
-                'info',
-                'fas fa-comment'
-            );
-        }
-    } else if (data.chat_type === 'individual') {
-        // 自分宛てかチェック
-        if (data.target_id === state.participantId) {
-            const senderId = data.sender_id;
-            
-            if (!this.messages.individual[senderId]) {
-                this.messages.individual[senderId] = [];
-            }
-            this.messages.individual[senderId].push(data);
-            
-            // 個別チャットが開いているかチェック
-            const isIndividualChatOpen = document.getElementById('individual-chat-screen')?.classList.contains('active');
-            const isCurrentChat = this.currentChatTarget === senderId;
-            const isChatModalOpen = this.chatModal.style.display !== 'none';
-            
-            if (isIndividualChatOpen && isCurrentChat && isChatModalOpen) {
-                // 該当の個別チャットを開いている場合は即座に既読にする
-                this.markAsReadImmediately('individual', senderId);
-            } else {
-                // 開いていない場合のみ未読カウントを増やす
-                if (!this.unreadCounts.individual[senderId]) {
-                    this.unreadCounts.individual[senderId] = 0;
-                }
-                this.unreadCounts.individual[senderId]++;
-                this.updateBadge();
-            }
-            
-            // UIを更新
-            if (isCurrentChat && isIndividualChatOpen) {
-                this.renderIndividualMessages(senderId);
-            }
-            
-            // 参加者リストが開いている場合も即座に更新
-            if (document.getElementById('participants-screen')?.classList.contains('active')) {
-                this.updateParticipantsList();
-            }
-            
-            // 通知（チャットモーダルが閉じている場合のみ）
-            if (!isChatModalOpen) {
-                ui.showNotification(
-                    `${data.sender_name}: ${this.truncateMessage(data.text)}`,
-                    'info',
-                    'fas fa-comment'
-                );
-            }
-        }
-    }
-}
-    markAsReadImmediately(chatType, senderId = null) {
-    // 即座に既読マークを送信
-    const markAsReadData = {
-        type: 'mark_as_read',
-        participant_id: state.participantId,
-        chat_type: chatType
-    };
-    
-    if (chatType === 'individual' && senderId) {
-        markAsReadData.sender_id = senderId;
-    }
-    
-    // WebSocketで既読通知を送信
-    if (wsManager.websocket && wsManager.websocket.readyState === WebSocket.OPEN) {
-        wsManager.send(markAsReadData);
-    }
-    
-    // ローカルの未読カウントも即座にリセット
-    if (chatType === 'group') {
-        this.unreadCounts.group = 0;
-    } else if (senderId) {
-        if (this.unreadCounts.individual[senderId]) {
-            this.unreadCounts.individual[senderId] = 0;
-        }
-    }
-    
-    // バッジを更新
-    this.updateBadge();
-    
-    // タイムスタンプも更新
-    this.setLastReadTimestamp(chatType, senderId);
-}
-    
-    handleTypingIndicator(data) {
-        if (data.sender_id === state.participantId) return;
-        
-        if (data.chat_type === 'group') {
-            const indicator = document.getElementById('group-typing-indicator');
-            if (indicator) {
-                if (data.is_typing) {
-                    indicator.querySelector('span').textContent = data.sender_name;
-                    indicator.style.display = 'block';
-                    
-                    // タイムアウトをセット（15秒後に自動で非表示）
-                    if (this.typingTimeouts?.group) {
-                        clearTimeout(this.typingTimeouts.group);
-                    }
-                    if (!this.typingTimeouts) this.typingTimeouts = {};
-                    this.typingTimeouts.group = setTimeout(() => {
-                        indicator.style.display = 'none';
-                    }, 15000);
-                } else {
-                    // 入力終了通知を受信したら即座に非表示
-                    indicator.style.display = 'none';
-                    if (this.typingTimeouts?.group) {
-                        clearTimeout(this.typingTimeouts.group);
-                        delete this.typingTimeouts.group;
-                    }
-                }
-            }
-        } else if (data.chat_type === 'individual' && data.target_id === state.participantId) {
-            const indicator = document.getElementById('typing-indicator');
-            if (indicator && this.currentChatTarget === data.sender_id) {
-                if (data.is_typing) {
-                    indicator.querySelector('span').textContent = data.sender_name;
-                    indicator.style.display = 'block';
-                    
-                    // タイムアウトをセット（15秒後に自動で非表示）
-                    if (this.typingTimeouts?.[data.sender_id]) {
-                        clearTimeout(this.typingTimeouts[data.sender_id]);
-                    }
-                    if (!this.typingTimeouts) this.typingTimeouts = {};
-                    this.typingTimeouts[data.sender_id] = setTimeout(() => {
-                        indicator.style.display = 'none';
-                    }, 15000);
-                } else {
-                    // 入力終了通知を受信したら即座に非表示
-                    indicator.style.display = 'none';
-                    if (this.typingTimeouts?.[data.sender_id]) {
-                        clearTimeout(this.typingTimeouts[data.sender_id]);
-                        delete this.typingTimeouts[data.sender_id];
-                    }
-                }
-            }
-        }
-    }
-    
-    handleParticipantStatusUpdate(data) {
-        // 参加者リストが表示されている場合は即座に更新
-        if (this.chatModal.style.display !== 'none' && 
-            document.getElementById('participants-screen').classList.contains('active')) {
-            this.updateParticipantsList();
-        }
-    }
-    
-addMessage(type, target, message) {
-    if (type === 'group') {
-        this.messages.group.push(message);
-        
-        // グループチャットが開いている場合のみ再描画
-        const isGroupChatOpen = document.getElementById('group-chat-screen')?.classList.contains('active');
-        if (isGroupChatOpen) {
-            // ★ 修正：自分のメッセージの場合は自動スクロール
-            if (message.sender_id === state.participantId) {
-                this.renderGroupMessages();
-                this.scrollToBottom('group-messages');
-            } else {
-                this.renderGroupMessages();
-            }
-        }
-    } else {
-        const key = target || message.sender_id;
-        if (!this.messages.individual[key]) {
-            this.messages.individual[key] = [];
-        }
-        this.messages.individual[key].push(message);
-        
-        // 該当の個別チャットが開いている場合のみ再描画
-        const isIndividualChatOpen = document.getElementById('individual-chat-screen')?.classList.contains('active');
-        if (this.currentChatTarget === key && isIndividualChatOpen) {
-            // ★ 修正：自分のメッセージの場合は自動スクロール
-            if (message.sender_id === state.participantId) {
-                this.renderIndividualMessages(key);
-                this.scrollToBottom('individual-messages');
-            } else {
-                this.renderIndividualMessages(key);
-            }
-        }
-    }
-    
-    // 参加者リストが開いていれば更新
-    if (document.getElementById('participants-screen').classList.contains('active')) {
-        this.updateParticipantsList();
-    }
-}
-    
-renderGroupMessages() {
-    const container = document.getElementById('group-messages');
-    if (!container) return;
-    
-    // スクロール位置を保存
-    const wasScrolledToBottom = this.isScrolledToBottom(container);
-    const scrollPosition = container.scrollTop;
-    
-    if (this.messages.group.length === 0) {
-        container.innerHTML = `
-            <div class="chat-welcome">
-                <i class="fas fa-comments" style="font-size: 48px; color: #00b300; opacity: 0.3;"></i>
-                <p style="color: #999; margin-top: 10px;">グループチャットへようこそ！</p>
-            </div>
-        `;
-        return;
-    }
-    
-    let html = '';
-    let lastDate = null;
-    
-    this.messages.group.forEach(msg => {
-        const msgDate = new Date(msg.timestamp).toLocaleDateString();
-        if (msgDate !== lastDate) {
-            html += `<div class="system-message">${msgDate}</div>`;
-            lastDate = msgDate;
-        }
-        
-        const isOwn = msg.sender_id === state.participantId;
-        html += `
-            <div class="message ${isOwn ? 'own' : ''}">
-                <div class="message-bubble">
-                    ${!isOwn ? `<div class="message-sender">${msg.sender_name}</div>` : ''}
-                    <div>${this.escapeHtml(msg.text)}</div>
-                    <div class="message-time-label">${this.formatTime(msg.timestamp)}</div>
-                </div>
-            </div>
-        `;
-    });
-    
-    container.innerHTML = html;
-    
-    // スクロール位置を復元または最下部へ
-    if (wasScrolledToBottom) {
-        this.scrollToBottom('group-messages');
-    } else {
-        container.scrollTop = scrollPosition;
-        // ★ 修正：最後のメッセージが自分のものでない場合のみ新着表示
-        const lastMessage = this.messages.group[this.messages.group.length - 1];
-        if (lastMessage && lastMessage.sender_id !== state.participantId) {
-            this.showNewMessageIndicator('group');
-        }
-    }
-}
-    
-renderIndividualMessages(participantId) {
-    const container = document.getElementById('individual-messages');
-    if (!container) return;
-    
-    // スクロール位置を保存
-    const wasScrolledToBottom = this.isScrolledToBottom(container);
-    const scrollPosition = container.scrollTop;
-    
-    const messages = this.messages.individual[participantId] || [];
-    
-    if (messages.length === 0) {
-        container.innerHTML = `
-            <div class="chat-welcome">
-                <i class="fas fa-comment" style="font-size: 48px; color: #00b300; opacity: 0.3;"></i>
-                <p style="color: #999; margin-top: 10px;">チャットを開始しましょう！</p>
-            </div>
-        `;
-        return;
-    }
-    
-    let html = '';
-    let lastDate = null;
-    
-    messages.forEach(msg => {
-        const msgDate = new Date(msg.timestamp).toLocaleDateString();
-        if (msgDate !== lastDate) {
-            html += `<div class="system-message">${msgDate}</div>`;
-            lastDate = msgDate;
-        }
-        
-        const isOwn = msg.sender_id === state.participantId;
-        html += `
-            <div class="message ${isOwn ? 'own' : ''}">
-                <div class="message-bubble">
-                    <div>${this.escapeHtml(msg.text)}</div>
-                    <div class="message-time-label">${this.formatTime(msg.timestamp)}</div>
-                </div>
-            </div>
-        `;
-    });
-    
-    container.innerHTML = html;
-    
-    // スクロール位置を復元または最下部へ
-    if (wasScrolledToBottom) {
-        this.scrollToBottom('individual-messages');
-    } else {
-        container.scrollTop = scrollPosition;
-        // ★ 修正：最後のメッセージが自分のものでない場合のみ新着表示
-        const lastMessage = messages[messages.length - 1];
-        if (lastMessage && lastMessage.sender_id !== state.participantId) {
-            this.showNewMessageIndicator('individual', participantId);
-        }
-    }
-}
-    
-isScrolledToBottom(element) {
-    if (!element) return true;
-    const threshold = 50; // 50px の余裕を持たせる
-    return element.scrollHeight - element.scrollTop - element.clientHeight < threshold;
-}
-
-showNewMessageIndicator(chatType, targetId = null) {
-    const indicatorId = chatType === 'group' ? 'group-new-message-indicator' : 'individual-new-message-indicator';
-    
-    // ★ 修正：既存のインジケーターを削除してから新規作成
-    let existingIndicator = document.getElementById(indicatorId);
-    if (existingIndicator) {
-        existingIndicator.remove();
-    }
-    
-    const indicator = document.createElement('div');
-    indicator.id = indicatorId;
-    indicator.className = 'new-message-indicator';
-    indicator.style.cssText = `
-        position: absolute;
-        bottom: 60px;
-        left: 50%;
-        transform: translateX(-50%);
-        background: #007bff;
-        color: white;
-        padding: 8px 16px;
-        border-radius: 20px;
-        font-size: 12px;
-        cursor: pointer;
-        z-index: 1000;
-        box-shadow: 0 2px 8px rgba(0, 123, 255, 0.3);
-        animation: slideUpCenter 0.3s ease-out;
-        pointer-events: auto;  /* ★ クリック可能を明示 */
-    `;
-    indicator.innerHTML = `
-        <i class="fas fa-chevron-down"></i> 新着メッセージ
-    `;
-    
-    const container = chatType === 'group' ? 
-        document.getElementById('group-chat-screen') : 
-        document.getElementById('individual-chat-screen');
-    
-    if (container) {
-        container.style.position = 'relative';
-        container.appendChild(indicator);
-        
-        // ★ 修正：クリックイベントを確実に設定
-        const scrollHandler = (e) => {
-            e.stopPropagation();  // ★ イベント伝播を停止
-            const messagesContainer = chatType === 'group' ? 
-                document.getElementById('group-messages') : 
-                document.getElementById('individual-messages');
-                
-            this.scrollToBottom(messagesContainer.id);
-            indicator.remove();
-        };
-        
-        // ★ 修正：複数のイベントタイプに対応
-        indicator.addEventListener('click', scrollHandler);
-        indicator.addEventListener('touchstart', scrollHandler, { passive: true });
-        
-        // メッセージコンテナのスクロールイベントを監視
-        const messagesContainer = chatType === 'group' ? 
-            document.getElementById('group-messages') : 
-            document.getElementById('individual-messages');
-            
-        if (messagesContainer) {
-            const scrollMonitor = () => {
-                if (this.isScrolledToBottom(messagesContainer)) {
-                    indicator.remove();
-                    messagesContainer.removeEventListener('scroll', scrollMonitor);
-                }
-            };
-            messagesContainer.addEventListener('scroll', scrollMonitor);
-        }
-    }
-}
-    updateBadge() {
-        let totalUnread = this.unreadCounts.group;
-        Object.values(this.unreadCounts.individual).forEach(count => {
-            totalUnread += count;
-        });
-        
-        if (totalUnread > 0) {
-            this.chatBadge.textContent = totalUnread > 99 ? '99+' : totalUnread;
-            this.chatBadge.style.display = 'block';
-        } else {
-            this.chatBadge.style.display = 'none';
-        }
-    }
-    
-    startStatusUpdateTimer() {
-        // 参加者リストのステータスを定期的に更新
-        this.participantStatusInterval = setInterval(() => {
-            if (this.chatModal.style.display !== 'none' && 
-                document.getElementById('participants-screen').classList.contains('active')) {
-                this.updateParticipantsList();
-            }
-        }, 2000); // 2秒ごとに更新
-    }
-    
-    stopStatusUpdateTimer() {
-        if (this.participantStatusInterval) {
-            clearInterval(this.participantStatusInterval);
-            this.participantStatusInterval = null;
-        }
-    }
-    
-    startRapidStatusUpdate() {
-        // 既存のタイマーをクリア
-        if (this.rapidStatusInterval) {
-            clearInterval(this.rapidStatusInterval);
-        }
-        
-        // チャットモーダルが開いている間は1秒ごとに更新
-        this.rapidStatusInterval = setInterval(() => {
-            if (this.chatModal.style.display !== 'none' && 
-                document.getElementById('participants-screen').classList.contains('active')) {
-                this.updateParticipantsList();
-            }
-        }, 1000); // 1秒ごと
-    }
-    
-    stopRapidStatusUpdate() {
-        if (this.rapidStatusInterval) {
-            clearInterval(this.rapidStatusInterval);
-            this.rapidStatusInterval = null;
-        }
-    }
-    
-    cleanup() {
-        this.stopStatusUpdateTimer();
-        this.stopRapidStatusUpdate();
-        
-        // 全ての入力状態をクリア
-        Object.keys(this.typingStates).forEach(target => {
-            this.handleTypingEnd(target);
-        });
-        
-        // タイムアウトをクリア
-        if (this.typingTimeouts) {
-            Object.values(this.typingTimeouts).forEach(timeout => {
-                clearTimeout(timeout);
-            });
-            this.typingTimeouts = {};
-        }
-        
-        this.clearMessages();
-    }
-
-    
-    clearMessages() {
-        this.messages = { group: [], individual: {} };
-        this.unreadCounts = { group: 0, individual: {} };
-        this.updateBadge();
-    }
-    
-    getParticipantNameSafe() {
-        const name = state.getParticipantName();
-        if (!name || name.trim() === '') {
-            return `参加者${state.participantId.substring(0, 4)}`;
-        }
-        return name;
-    }
-    
-    // ユーティリティ
-    formatTime(timestamp) {
-        const date = new Date(timestamp);
-        const now = new Date();
-        const diff = now - date;
-        
-        if (diff < 60000) return '今';
-        if (diff < 3600000) return `${Math.floor(diff / 60000)}分前`;
-        if (diff < 86400000) return date.toLocaleTimeString('ja-JP', { hour: '2-digit', minute: '2-digit' });
-        
-        return date.toLocaleDateString('ja-JP', { month: 'numeric', day: 'numeric' });
-    }
-    
-    truncateMessage(text, maxLength = 30) {
-        if (!text) return '';
-        return text.length > maxLength ? text.substring(0, maxLength) + '...' : text;
-    }
-    
-    escapeHtml(text) {
-        const div = document.createElement('div');
-        div.textContent = text;
-        return div.innerHTML;
-    }
-    
-    scrollToBottom(elementId) {
-        const element = document.getElementById(elementId);
-        if (element) {
-            setTimeout(() => {
-                element.scrollTop = element.scrollHeight;
-            }, 50);
-        }
-    }
-}
+};
 // === アプリケーション開始 ===
 document.addEventListener('DOMContentLoaded', function() {
     // データ整合性チェック
@@ -0,0 +1,102 @@
+# tracker/storage.py - 静的ファイルのビルド（縮小・ハッシュ付きファイル名・事前圧縮）
+import gzip
+import logging
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import rjsmin
+except ImportError:  # 縮小せずにハッシュ付与・圧縮のみ行う
+    rjsmin = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import brotli
+except ImportError:  # gzip版のみ出力
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """collectstatic で JS/CSS を縮小し、ハッシュ付きファイル名と gzip/brotli 版を書き出す
+
+    ハッシュは縮小後の内容から計算するため、内容が変わらない限りURLも変わらず、
+    長期間のキャッシュ（nginx の expires max 等）を設定できる。圧縮版は nginx の
+    gzip_static / brotli_static でそのまま配信する想定。縮小は rjsmin / rcssmin、
+    brotli版は brotli パッケージがある場合のみ行う。
+    """
+
+    minifiers = {
+        '.js': rjsmin.jsmin if rjsmin else None,
+        '.css': rcssmin.cssmin if rcssmin else None,
+    }
+    compress_extensions = ('.js', '.css', '.json', '.svg', '.txt', '.ico')
+    min_compress_size = 1024
+
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            # ハッシュは元の場所のファイルから計算されるため、縮小したコピーを読ませる
+            paths = {
+                name: (self, name) if self._minify(name) else source
+                for name, source in paths.items()
+            }
+
+        hashed_names = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if hashed_name and processed and not isinstance(processed, Exception):
+                hashed_names.add(hashed_name)
+            yield name, hashed_name, processed
+
+        if not dry_run:
+            for hashed_name in sorted(hashed_names):
+                self._compress(hashed_name)
+
+    def _minify(self, name: str) -> bool:
+        """STATIC_ROOT にコピーされたファイルを縮小（縮小したら True）"""
+        minify = self._minifier_for(name)
+        if minify is None:
+            return False
+        try:
+            with self.open(name) as source:
+                original = source.read().decode('utf-8')
+            minified = minify(original)
+            self.delete(name)
+            self._save(name, ContentFile(minified.encode('utf-8')))
+            logger.info(f"Minified {name}: {len(original)} -> {len(minified)}")
+            return True
+        except Exception as e:
+            logger.error(f"Minify error ({name}): {str(e)}")
+            return False
+
+    def _minifier_for(self, name: str):
+        if '.min.' in name:
+            return None
+        for extension, minify in self.minifiers.items():
+            if name.endswith(extension):
+                return minify
+        return None
+
+    def _compress(self, name: str):
+        if not name.endswith(self.compress_extensions):
+            return
+        with self.open(name) as source:
+            data = source.read()
+        if len(data) < self.min_compress_size:
+            return
+
+        variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(data, quality=11)))
+        for suffix, compressed in variants:
+            # 圧縮しても小さくならない場合は元のファイルを配信させる
+            if len(compressed) >= len(data):
+                continue
+            if self.exists(name + suffix):
+                self.delete(name + suffix)
+            self._save(name + suffix, ContentFile(compressed))
@@ -1,12 +1,44 @@
 # tracker/tasks.py
 import logging
 from celery import shared_task
+from django.conf import settings
+from django.db.models import Count
 from django.utils import timezone
 from datetime import timedelta
-from .models import LocationSession, LocationData, SessionLog
+from .models import (
+    LocationSession, LocationData, SessionLog, WebSocketConnection,
+    ChatMessage, ChatReadCursor,
+)
+from .chunked_delete import ChunkedDeleter, DatabaseLoadProbe
+from .live_stats import estimate_count
 
 logger = logging.getLogger(__name__)
 
+# 削除は主キー範囲ごとの短いトランザクションで行い、稼働中のセッションへの影響を抑える
+# （DBの負荷が高い間は待機を延ばす）
+deleter = ChunkedDeleter(load_check=DatabaseLoadProbe(
+    max_active_queries=getattr(settings, 'CLEANUP_MAX_ACTIVE_QUERIES', 20),
+    max_replication_lag=getattr(settings, 'CLEANUP_MAX_REPLICATION_LAG', 10.0),
+))
+
+# セッション削除時にCASCADEされるテーブル（先に分割削除しておく）
+SESSION_CHILD_MODELS = [ChatMessage, ChatReadCursor, LocationData, SessionLog, WebSocketConnection]
+
+
+def purge_expired_sessions(current_time=None):
+    """期限切れセッションを子テーブルから順に分割削除"""
+    current_time = current_time or timezone.now()
+    expired_sessions = LocationSession.objects.filter(expires_at__lt=current_time)
+
+    results = [
+        deleter.delete(model.objects.filter(session__in=expired_sessions.values('pk')))
+        for model in SESSION_CHILD_MODELS
+    ]
+    # 子テーブルは空なので、セッション自体は小さいチャンクで削除
+    results.append(deleter.delete(expired_sessions, chunk_size=50))
+    return results
+
+
 @shared_task(bind=True)
 def cleanup_expired_locations(self):
     """期限切れセッションの位置情報のみを削除"""
@@ -14,33 +46,18 @@ def cleanup_expired_locations(self):
         current_time = timezone.now()
         logger.info(f"クリーンアップ開始時刻: {current_time}")
         
-        # 削除対象の位置情報を確認
-        expired_locations_query = LocationData.objects.filter(
-            session__expires_at__lt=current_time
+        # 期限切れセッションの位置情報を分割削除
+        metrics = deleter.delete(
+            LocationData.objects.filter(session__expires_at__lt=current_time),
+            '期限切れ位置情報'
         )
-        expired_locations_count = expired_locations_query.count()
-        logger.info(f"削除対象の位置情報数: {expired_locations_count}")
-        
-        if expired_locations_count == 0:
-            logger.info("削除対象の期限切れ位置情報はありません")
-            return {
-                'success': True,
-                'deleted_locations': 0
-            }
-        
-        # デバッグ: 削除対象の詳細をログ出力
-        sample_locations = expired_locations_query[:5]
-        for loc in sample_locations:
-            logger.info(f"削除対象位置情報 ID: {loc.id}, 緯度: {loc.latitude}, 経度: {loc.longitude}, セッション期限: {loc.session.expires_at}")
         
-        # 期限切れセッションの位置情報を直接削除
-        deleted_locations = expired_locations_query.delete()[0]
-        
-        logger.info(f"期限切れ位置情報削除完了: {deleted_locations}件")
+        logger.info(f"期限切れ位置情報削除完了: {metrics['deleted']}件 ({metrics['chunks']}チャンク, {metrics['elapsed']}秒)")
         
         return {
             'success': True,
-            'deleted_locations': deleted_locations
+            'deleted_locations': metrics['deleted'],
+            'metrics': metrics
         }
         
     except Exception as e:
@@ -54,16 +71,19 @@ def cleanup_old_logs():
     try:
         cutoff_date = timezone.now() - timedelta(days=30)
         
-        deleted_count = SessionLog.objects.filter(
-            timestamp__lt=cutoff_date
-        ).delete()[0]
+        metrics = deleter.delete(
+            SessionLog.objects.filter(timestamp__lt=cutoff_date),
+            '古いログ'
+        )
+        deleted_count = metrics['deleted']
         
         if deleted_count > 0:
             logger.info(f"古いログエントリを削除: {deleted_count}件")
         
         return {
             'success': True,
-            'deleted_logs': deleted_count
+            'deleted_logs': deleted_count,
+            'metrics': metrics
         }
         
     except Exception as e:
@@ -79,11 +99,11 @@ def debug_location_data():
     try:
         current_time = timezone.now()
         
-        # 全体の統計
-        total_sessions = LocationSession.objects.count()
-        total_locations = LocationData.objects.count()
-        expired_sessions = LocationSession.objects.filter(expires_at__lt=current_time).count()
-        expired_locations = LocationData.objects.filter(session__expires_at__lt=current_time).count()
+        # 全体の統計（大きなテーブルは統計情報からの概算）
+        total_sessions = estimate_count(LocationSession.objects.all())
+        total_locations = estimate_count(LocationData.objects.all())
+        expired_sessions = estimate_count(LocationSession.objects.filter(expires_at__lt=current_time))
+        expired_locations = estimate_count(LocationData.objects.filter(session__expires_at__lt=current_time))
         
         logger.info(f"=== 位置情報データ状況 ===")
         logger.info(f"現在時刻: {current_time}")
@@ -94,15 +114,18 @@ def debug_location_data():
         
         # サンプルデータの確認
         if expired_locations > 0:
-            sample_expired = LocationData.objects.filter(session__expires_at__lt=current_time)[:5]
+            sample_expired = LocationData.objects.filter(
+                session__expires_at__lt=current_time
+            ).select_related('session')[:5]
             for loc in sample_expired:
                 logger.info(f"期限切れ位置情報 - ID: {loc.id}, 緯度: {loc.latitude}, 経度: {loc.longitude}, セッション期限: {loc.session.expires_at}")
         
         # 最新のセッション情報も確認
-        recent_sessions = LocationSession.objects.order_by('-expires_at')[:3]
+        recent_sessions = LocationSession.objects.annotate(
+            location_count=Count('locations')
+        ).order_by('-expires_at')[:3]
         for session in recent_sessions:
-            location_count = session.locationdata_set.count()
-            logger.info(f"最新セッション - ID: {session.id}, 期限: {session.expires_at}, 位置情報数: {location_count}")
+            logger.info(f"最新セッション - ID: {session.id}, 期限: {session.expires_at}, 位置情報数: {session.location_count}")
         
         return {
             'current_time': current_time.isoformat(),
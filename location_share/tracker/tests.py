@@ -1,3 +1,1092 @@
-from django.test import TestCase
-
-# Create your tests here.
+import asyncio
+import json
+import re
+import tempfile
+import uuid
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.http import HttpResponse
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .chat_cache import CachedMessage, RecentChatCache
+from .chat_writer import ChatWriteBuffer
+from .chunked_delete import ChunkedDeleter, DatabaseLoadProbe
+from .consumers import LocationConsumer, count_session_expired, persist_chat_messages, sweep_stale_participants
+from .distance_matrix import DistanceMatrixCache, roster_version
+from .live_stats import LiveStats, estimate_count, live_stats, update_participant
+from .location_batch import apply_location_fixes, parse_fixes
+from .location_filter import LocationJitterFilter, haversine_distance
+from .models import LocationSession, LocationData, ChatMessage, ChatReadCursor, SessionLog
+from .participant_identity import (
+    get_participant_id, make_socket_token, participant_cookie_name, remember_participant, verify_socket_token
+)
+from .presence import PresenceSweeper
+from .rate_limit import Limit, RateLimiter, _LocalBackend
+from .reporting_rate import ReportingRateController, WorkerLoadMonitor
+from .roster_versions import roster_versions
+from .session_expiry import SessionExpiryScheduler
+from .session_log import SessionLogSink
+from .storage import CompressedManifestStaticFilesStorage
+from .tasks import debug_location_data
+from .typing_state import TypingStateMachine, TypingTransition
+from .views import _location_stream
+
+# ページの描画にはマニフェスト（collectstatic の出力）を使わない
+PLAIN_STATIC_STORAGES = dict(
+    settings.STORAGES, staticfiles={'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}
+)
+
+
+def use_shared_cache(test):
+    """プロセス間で共有されるキャッシュに切り替える（名簿バージョンはプロセス内キャッシュでは使わない）"""
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    override = override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory.name}
+    })
+    override.enable()
+    test.addCleanup(override.disable)
+
+
+def make_consumer(session) -> LocationConsumer:
+    """DBアクセスのみを行うテスト用のコンシューマー"""
+    consumer = LocationConsumer()
+    consumer.session_id = str(session.session_id)
+    return consumer
+
+
+def call_sync(consumer, name: str, *args):
+    """database_sync_to_async で包まれたメソッドを同期的に呼ぶ"""
+    return LocationConsumer.__dict__[name].func(consumer, *args)
+
+
+class LocationJitterFilterTests(TestCase):
+    """GPSジッター抑制フィルター"""
+
+    def setUp(self):
+        self.filter = LocationJitterFilter(min_distance=5, accuracy_factor=0.5, snap_distance=100)
+
+    def test_first_fix_is_accepted(self):
+        decision = self.filter.process('s', 'p', 35.0, 139.0, 10)
+        self.assertTrue(decision.accept)
+        self.assertEqual(decision.reason, 'initial')
+
+    def test_small_jitter_is_absorbed(self):
+        self.filter.process('s', 'p', 35.0, 139.0, 10)
+        decision = self.filter.process('s', 'p', 35.00001, 139.0, 10)  # 約1m
+        self.assertFalse(decision.accept)
+        self.assertEqual(decision.reason, 'deadband')
+        self.assertEqual((decision.latitude, decision.longitude), (35.0, 139.0))
+
+    def test_moderate_move_is_smoothed(self):
+        self.filter.process('s', 'p', 35.0, 139.0, 10)
+        decision = self.filter.process('s', 'p', 35.0004, 139.0, 10)  # 約44m
+        self.assertTrue(decision.accept)
+        self.assertEqual(decision.reason, 'moved')
+        # カルマンフィルターで前回位置と今回の測位の間に寄せる
+        self.assertGreater(decision.latitude, 35.0)
+        self.assertLess(decision.latitude, 35.0004)
+
+    def test_large_move_snaps_to_raw_fix(self):
+        self.filter.process('s', 'p', 35.0, 139.0, 10)
+        decision = self.filter.process('s', 'p', 35.01, 139.0, 10)
+        self.assertTrue(decision.accept)
+        self.assertEqual(decision.reason, 'snap')
+        self.assertEqual(decision.latitude, 35.01)
+
+    def test_changed_attributes_are_always_saved(self):
+        self.filter.process('s', 'p', 35.0, 139.0, 10, attrs=('名前',))
+        decision = self.filter.process('s', 'p', 35.0, 139.0, 10, attrs=('新しい名前',))
+        self.assertTrue(decision.accept)
+        self.assertEqual(decision.reason, 'attrs_changed')
+
+    def test_haversine_distance(self):
+        self.assertAlmostEqual(haversine_distance(35.0, 139.0, 35.001, 139.0), 111.2, delta=0.5)
+
+
+class DistanceMatrixCacheTests(TestCase):
+    """参加者間の距離行列"""
+
+    def setUp(self):
+        self.cache = DistanceMatrixCache()
+        self.locations = [
+            {'participant_id': 'a', 'latitude': 35.0, 'longitude': 139.0},
+            {'participant_id': 'b', 'latitude': 35.001, 'longitude': 139.0},
+            {'participant_id': 'c', 'latitude': None, 'longitude': None},
+        ]
+
+    def test_row_matches_haversine(self):
+        row = self.cache.row('s', roster_version(self.locations), self.locations, 'a')
+        self.assertEqual(set(row), {'b'})
+        self.assertAlmostEqual(row['b']['distance'], haversine_distance(35.0, 139.0, 35.001, 139.0), delta=0.1)
+        self.assertAlmostEqual(row['b']['bearing'], 0.0, delta=0.1)  # 真北
+
+    def test_matrix_is_reused_for_the_same_version(self):
+        version = roster_version(self.locations)
+        self.cache.row('s', version, self.locations, 'a')
+        moved = [dict(loc, latitude=36.0) if loc['participant_id'] == 'b' else loc for loc in self.locations]
+        # 同じバージョンなら再計算しない
+        self.assertEqual(self.cache.row('s', version, moved, 'a')['b']['distance'], 111.2)
+        self.assertNotEqual(roster_version(moved), version)
+        self.assertGreater(self.cache.row('s', roster_version(moved), moved, 'a')['b']['distance'], 100000)
+
+
+class ChatHistoryPaginationTests(TestCase):
+    """チャット履歴のキーセットページネーション"""
+
+    def setUp(self):
+        self.session = LocationSession.objects.create(duration_minutes=60)
+        self.consumer = make_consumer(self.session)
+        self.a, self.b, self.c = (str(uuid.uuid4()) for _ in range(3))
+        base = timezone.now() - timedelta(minutes=30)
+        # 同じ時刻のメッセージを含めて作成（IDで順序が決まる）
+        for i in range(25):
+            ChatMessage.objects.create(
+                session=self.session, chat_type='group', sender_id=self.a, sender_name='A',
+                text=f'g{i}', timestamp=base + timedelta(seconds=i // 2)
+            )
+        ChatMessage.objects.create(
+            session=self.session, chat_type='individual', sender_id=self.a, target_id=self.b,
+            sender_name='A', text='to b', timestamp=base
+        )
+        ChatMessage.objects.create(
+            session=self.session, chat_type='individual', sender_id=self.a, target_id=self.c,
+            sender_name='A', text='to c', timestamp=base
+        )
+
+    def _page(self, participant_id, conversation, before, limit=10):
+        return call_sync(self.consumer, '_get_chat_history_page', participant_id, conversation, before, limit)
+
+    def test_pages_walk_back_without_gaps_or_duplicates(self):
+        before = (timezone.now(), 0)
+        texts = []
+        while True:
+            page = self._page(self.b, 'group', before)
+            texts = [m['text'] for m in page['messages']] + texts
+            if not page['has_more']:
+                break
+            before = self.consumer._parse_history_cursor(page['next_cursor'])
+        self.assertEqual(texts, [f'g{i}' for i in range(25)])
+
+    def test_direct_messages_only_include_the_pair(self):
+        page = self._page(self.b, self.a, (timezone.now(), 0))
+        self.assertEqual([m['text'] for m in page['messages']], ['to b'])
+        page = self._page(self.c, self.b, (timezone.now(), 0))
+        self.assertEqual(page['messages'], [])
+
+
+class ChatReadCursorTests(TestCase):
+    """既読カーソルと未読数"""
+
+    def setUp(self):
+        self.session = LocationSession.objects.create(duration_minutes=60)
+        self.consumer = make_consumer(self.session)
+        self.sender, self.reader = str(uuid.uuid4()), str(uuid.uuid4())
+        ChatReadCursor.objects.create(session=self.session, participant_id=self.reader, conversation='group')
+
+    def _message(self, text, chat_type='group', **kwargs):
+        return ChatMessage(
+            session=self.session, chat_type=chat_type, sender_id=self.sender, sender_name='S',
+            target_id=self.reader if chat_type == 'individual' else None, text=text, **kwargs
+        )
+
+    def _unread(self, conversation='group'):
+        return ChatReadCursor.objects.get(
+            session=self.session, participant_id=self.reader, conversation=conversation
+        ).unread_count
+
+    def test_persisted_batches_add_to_unread_counts(self):
+        persist_chat_messages([self._message('1'), self._message('2'), self._message('dm', 'individual')])
+        self.assertEqual(self._unread(), 2)
+        self.assertEqual(self._unread(self.sender), 1)
+
+        persist_chat_messages([self._message('3')])
+        self.assertEqual(self._unread(), 3)
+
+    def test_own_messages_are_not_unread(self):
+        ChatReadCursor.objects.create(session=self.session, participant_id=self.sender, conversation='group')
+        persist_chat_messages([self._message('1')])
+        self.assertEqual(
+            ChatReadCursor.objects.get(session=self.session, participant_id=self.sender, conversation='group').unread_count,
+            0
+        )
+
+    def test_mark_as_read_resets_unread_count(self):
+        persist_chat_messages([self._message('1'), self._message('2')])
+        call_sync(self.consumer, '_mark_messages_as_read', self.reader, 'group', None, None, None)
+        cursor = ChatReadCursor.objects.get(session=self.session, participant_id=self.reader, conversation='group')
+        self.assertEqual(cursor.unread_count, 0)
+        self.assertEqual(cursor.last_read_message_id, ChatMessage.objects.latest('timestamp', 'id').id)
+
+    def test_read_position_follows_timestamps_not_ids(self):
+        # 別のプロセスが確保したIDは送信順にならない
+        earlier = timezone.now() - timedelta(seconds=5)
+        persist_chat_messages([self._message('first', id=1000, timestamp=earlier)])
+        call_sync(self.consumer, '_mark_messages_as_read', self.reader, 'group', None, 1000, earlier)
+
+        later = self._message('second', id=10, timestamp=timezone.now())
+        persist_chat_messages([later])
+        self.assertEqual(self._unread(), 1)
+
+        position = self.consumer._get_read_cursors(self.session, self.reader)['group']
+        self.assertFalse(self.consumer._serialize_chat_message(later, self.reader, position)['is_read'])
+        first = ChatMessage.objects.get(id=1000)
+        self.assertTrue(self.consumer._serialize_chat_message(first, self.reader, position)['is_read'])
+
+
+class RecentChatCacheTests(TestCase):
+    """最近のチャットのキャッシュ"""
+
+    def setUp(self):
+        cache.clear()
+        # 同じ共有キャッシュを使う2つのプロセスを想定
+        self.worker = RecentChatCache(settle=60)
+        self.other_worker = RecentChatCache(settle=60)
+
+    def _message(self, message_id):
+        return CachedMessage(message_id, 'group', 'a', 'A', None, str(message_id), timezone.now())
+
+    def test_own_writes_are_served_from_memory(self):
+        self.assertIsNone(self.worker.group('s'))
+        self.worker.prime_group('s', [self._message(1)], True)
+        self.worker.append('s', self._message(2))
+        messages, complete = self.worker.group('s')
+        self.assertEqual([m.id for m in messages], [1, 2])
+        self.assertTrue(complete)
+
+    def test_write_from_another_worker_forces_a_reload(self):
+        self.worker.prime_group('s', [], True)
+        self.worker.append('s', self._message(1))
+        self.other_worker.append('s', self._message(2))
+
+        self.assertIsNone(self.worker.group('s'))
+        # 再読み込みでは未保存の自分のメッセージを残したままDBの内容と統合
+        messages, _ = self.worker.prime_group('s', [self._message(2)], True)
+        self.assertEqual([m.id for m in messages], [1, 2])
+
+    def test_entries_expire_even_when_read(self):
+        short_lived = RecentChatCache(ttl=0)
+        short_lived.prime_group('s', [], True)
+        self.assertIsNone(short_lived.group('s'))
+
+
+class ChunkedDeleterTests(TestCase):
+    """負荷を抑えた分割削除"""
+
+    def setUp(self):
+        self.session = LocationSession.objects.create(duration_minutes=60)
+        SessionLog.objects.bulk_create(
+            SessionLog(session=self.session, action='joined', participant_id=str(i)) for i in range(23)
+        )
+        SessionLog.objects.create(session=self.session, action='left')
+
+    def test_deletes_matching_rows_in_chunks(self):
+        deleter = ChunkedDeleter(chunk_size=5, pause=0)
+        metrics = deleter.delete(SessionLog.objects.filter(action='joined'))
+        self.assertEqual(metrics['deleted'], 23)
+        self.assertEqual(metrics['chunks'], 5)
+        self.assertTrue(metrics['completed'])
+        self.assertEqual(metrics['deleted_by_model'], {'tracker.SessionLog': 23})
+        self.assertEqual(list(SessionLog.objects.values_list('action', flat=True)), ['left'])
+
+    def test_load_check_throttles(self):
+        deleter = ChunkedDeleter(chunk_size=10, pause=0, max_pause=0.001, load_check=lambda: True)
+        metrics = deleter.delete(SessionLog.objects.filter(action='joined'))
+        self.assertEqual(metrics['deleted'], 23)
+        self.assertEqual(metrics['throttled'], 2)
+
+    def test_stops_when_time_budget_is_exceeded(self):
+        deleter = ChunkedDeleter(chunk_size=5, pause=0.01, time_budget=0.005)
+        metrics = deleter.delete(SessionLog.objects.filter(action='joined'))
+        self.assertFalse(metrics['completed'])
+        self.assertEqual(metrics['deleted'], 5)
+
+    def test_load_probe_is_idle_on_other_databases(self):
+        self.assertFalse(DatabaseLoadProbe()())
+
+    def test_debug_report_queries_do_not_grow_with_rows(self):
+        def add_expired(count):
+            session = LocationSession.objects.create(duration_minutes=60)
+            LocationSession.objects.filter(pk=session.pk).update(expires_at=timezone.now() - timedelta(minutes=1))
+            LocationData.objects.bulk_create(
+                LocationData(session=session, participant_id=str(uuid.uuid4()), latitude=35.0, longitude=139.0)
+                for _ in range(count)
+            )
+
+        add_expired(1)
+        with CaptureQueriesContext(connection) as baseline:
+            self.assertEqual(debug_location_data()['expired_locations'], 1)
+        add_expired(5)
+        add_expired(5)
+        with self.assertNumQueries(len(baseline.captured_queries)):
+            self.assertEqual(debug_location_data()['expired_locations'], 11)
+
+
+class LiveStatsTests(TestCase):
+    """トップページ向けの統計"""
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def _count(self):
+        self.calls += 1
+        return LocationSession.objects.count()
+
+    def test_events_update_the_shared_values_between_reconciles(self):
+        LocationSession.objects.create(duration_minutes=60)
+        stats = LiveStats({'sessions': self._count}, prefix='test_stats')
+        other = LiveStats({'sessions': self._count}, prefix='test_stats')
+        self.assertEqual(stats.snapshot(), {'sessions': 1})
+
+        # 他のプロセスでのイベントも、DBを読まずにすぐ反映される
+        other.add('sessions', 2)
+        self.assertEqual(stats.snapshot(), {'sessions': 3})
+        self.assertEqual(self.calls, 1)
+
+        # 補正の期限を過ぎたらDBの値に合わせ直す
+        cache.delete('test_stats:reconciled')
+        self.assertEqual(other.snapshot(), {'sessions': 1})
+        self.assertEqual(self.calls, 2)
+
+    def test_snapshot_does_not_release_another_workers_lock(self):
+        stats = LiveStats({'sessions': self._count}, prefix='test_stats')
+        cache.add('test_stats:lock', 'other', 30)
+        # 値がないため計算はするが、他のプロセスのロックは残す
+        self.assertEqual(stats.snapshot(), {'sessions': 0})
+        self.assertEqual(cache.get('test_stats:lock'), 'other')
+
+        cache.delete('test_stats:reconciled')
+        stats.add('sessions', 5)
+        self.assertEqual(stats.snapshot(), {'sessions': 5})
+        self.assertEqual(self.calls, 1)
+
+    def test_failed_loader_keeps_previous_value(self):
+        stats = LiveStats({'sessions': self._count, 'broken': lambda: 1 / 0}, prefix='test_stats')
+        self.assertEqual(stats.snapshot(), {'sessions': 0, 'broken': 0})
+
+    def test_event_is_claimed_once(self):
+        stats = LiveStats({}, prefix='test_stats')
+        self.assertTrue(stats.claim('expired:s'))
+        self.assertFalse(stats.claim('expired:s'))
+
+    def test_presence_transitions_are_counted(self):
+        live_stats.reconcile()
+        session = LocationSession.objects.create(duration_minutes=60)
+        location = LocationData.objects.create(session=session, participant_id='a')
+        online = lambda: live_stats.snapshot()['online_participants_count']
+        self.assertEqual(online(), 1)
+
+        location.is_online = False
+        location.save()
+        self.assertEqual(online(), 0)
+
+        participant = LocationData.objects.filter(session=session, participant_id='a')
+        update_participant(participant, is_online=True)
+        update_participant(participant, is_online=True)  # 変化がなければ数えない
+        self.assertEqual(online(), 1)
+        update_participant(participant, is_active=False)
+        self.assertEqual(online(), 0)
+        self.assertEqual(live_stats.reconcile()['online_participants_count'], 0)
+
+    def test_session_expiry_is_counted_once(self):
+        session = LocationSession.objects.create(duration_minutes=60)
+        LocationData.objects.create(session=session, participant_id='a')
+        live_stats.reconcile()
+        # 接続のある全プロセスで期限切れのタイマーが動く
+        count_session_expired(str(session.session_id))
+        count_session_expired(str(session.session_id))
+        self.assertEqual(live_stats.snapshot(), {'active_sessions_count': 0, 'online_participants_count': 0})
+
+    def test_estimate_count_is_exact_on_other_databases(self):
+        LocationSession.objects.create(duration_minutes=60)
+        self.assertEqual(estimate_count(LocationSession.objects.all()), 1)
+
+
+class LocationBatchTests(TestCase):
+    """バックグラウンドでたまった位置情報の一括反映"""
+
+    def setUp(self):
+        self.session = LocationSession.objects.create(duration_minutes=60)
+        self.participant_id = str(uuid.uuid4())
+        self.now = timezone.now()
+
+    def _raw(self, minutes_ago, latitude=35.0, longitude=139.0):
+        return {
+            'latitude': latitude,
+            'longitude': longitude,
+            'accuracy': 10,
+            'timestamp': int((self.now - timedelta(minutes=minutes_ago)).timestamp() * 1000),
+        }
+
+    def test_fixes_are_sorted_and_stale_ones_dropped(self):
+        fixes = parse_fixes([self._raw(1), self._raw(5), self._raw(60 * 13), self._raw(-10)])
+        self.assertEqual(len(fixes), 3)
+        self.assertEqual([fix.recorded_at for fix in fixes], sorted(fix.recorded_at for fix in fixes))
+        # 未来の時刻は現在時刻に丸める
+        self.assertLessEqual(fixes[-1].recorded_at, timezone.now())
+
+    def test_invalid_fixes_are_rejected(self):
+        for raw_fixes in ([], [self._raw(1, latitude=91)], [{'latitude': 'x', 'longitude': 0}],
+                          [self._raw(1)] * 101, [self._raw(60 * 13)]):
+            with self.assertRaises(ValidationError):
+                parse_fixes(raw_fixes)
+
+    def test_stay_starts_when_the_participant_moved(self):
+        fixes = parse_fixes([
+            self._raw(30),
+            self._raw(20, latitude=35.01),  # 約1.1km移動
+            self._raw(5, latitude=35.0101),  # 滞在中
+        ])
+        location, created = apply_location_fixes(self.session, self.participant_id, fixes, {'participant_name': 'A'})
+        self.assertTrue(created)
+        self.assertEqual(location.stay_start_time, fixes[1].recorded_at)
+        self.assertEqual(location.total_stay_minutes, 20)
+        self.assertAlmostEqual(float(location.latitude), 35.0101, places=4)
+
+        saved = LocationData.objects.get(session=self.session, participant_id=self.participant_id)
+        self.assertEqual(saved.participant_name, 'A')
+        self.assertTrue(saved.is_online)
+
+
+class RosterConditionalGetTests(TestCase):
+    """名簿バージョンによる条件付きGET"""
+
+    def setUp(self):
+        use_shared_cache(self)
+        self.session = LocationSession.objects.create(duration_minutes=60)
+        self.url = reverse('tracker:api_get_locations', args=[self.session.session_id])
+
+    def test_unchanged_roster_returns_304(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+
+    def test_roster_change_invalidates_etag(self):
+        etag = self.client.get(self.url).headers['ETag']
+        roster_versions.bump(str(self.session.session_id))
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertTrue(roster_versions.is_current(str(self.session.session_id), response.headers['ETag']))
+
+    def test_expired_session_is_not_cached(self):
+        etag = self.client.get(self.url).headers['ETag']
+        # 期限はキャッシュ済みでも、期限を過ぎたらビューに渡す
+        later = self.session.expires_at + timedelta(minutes=1)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn('ETag', response.headers)
+
+    def test_unchanged_roster_costs_no_queries(self):
+        etag = self.client.get(self.url).headers['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_changed_roster_loads_the_session_once(self):
+        cache.delete(f'session_expires_at:{self.session.session_id}')
+        # セッション1回と名簿の読み込みのみ（デコレーターとビューで重複しない）
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_process_local_cache_never_answers_304(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertFalse(roster_versions.shared)
+            etag = roster_versions.get(str(self.session.session_id))[0]
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('ETag', response.headers)
+
+    def test_snapshot_is_reused_for_the_same_version(self):
+        session_id = str(self.session.session_id)
+        etag, data = roster_versions.snapshot(session_id, lambda: ['a'])
+        self.assertEqual(roster_versions.snapshot(session_id, lambda: ['b']), (etag, ['a']))
+        roster_versions.bump(session_id)
+        self.assertEqual(roster_versions.snapshot(session_id, lambda: ['b'])[1], ['b'])
+
+
+class RateLimiterTests(TestCase):
+    """トークンバケットによるレート制限"""
+
+    def test_burst_is_allowed_then_rejected(self):
+        limiter = RateLimiter()
+        limit = Limit(per_minute=60, burst=3)
+        self.assertEqual([limiter.allow_sync('ip', 'x', limit) for _ in range(4)], [True, True, True, False])
+        # 別のキーには影響しない
+        self.assertTrue(limiter.allow_sync('ip', 'y', limit))
+        self.assertEqual(limiter.get_stats()['ip_rejected'], 1)
+
+    def test_tokens_refill_over_time(self):
+        backend = _LocalBackend()
+        limit = Limit(per_minute=60, burst=2)
+        self.assertTrue(backend.take('k', limit, 2, now=0.0))
+        self.assertFalse(backend.take('k', limit, 1, now=0.5))
+        self.assertTrue(backend.take('k', limit, 1, now=1.5))
+
+    def test_prune_keeps_buckets_that_are_still_refilling(self):
+        backend = _LocalBackend(max_keys=1)
+        slow = Limit(per_minute=1, burst=5)
+        fast = Limit(per_minute=600, burst=5)
+        backend.take('slow', slow, 5, now=0.0)
+        backend.take('fast', fast, 5, now=0.0)
+        backend._prune(now=10.0)
+        # 速いバケットは満タンに戻っているが、遅いバケットは空のまま残す
+        self.assertEqual(set(backend._buckets), {'slow'})
+        self.assertFalse(backend.take('slow', slow, 1, now=10.0))
+
+    def test_concurrency_slots(self):
+        limiter = RateLimiter()
+        self.assertTrue(async_to_sync(limiter.acquire)('conn', 's', 1))
+        self.assertFalse(async_to_sync(limiter.acquire)('conn', 's', 1))
+        async_to_sync(limiter.release)('conn', 's')
+        self.assertTrue(async_to_sync(limiter.acquire)('conn', 's', 1))
+
+
+class ParticipantCookieTests(TestCase):
+    """参加者IDの署名付きCookie"""
+
+    def setUp(self):
+        self.session = LocationSession.objects.create(duration_minutes=60)
+        self.participant_id = str(uuid.uuid4())
+        self.factory = RequestFactory()
+
+    def _request_with(self, value):
+        request = self.factory.get('/')
+        request.COOKIES[participant_cookie_name(self.session.session_id)] = value
+        return request
+
+    def test_cookie_round_trip(self):
+        response = HttpResponse()
+        remember_participant(response, self.session, self.participant_id)
+        cookie = response.cookies[participant_cookie_name(self.session.session_id)]
+        self.assertTrue(cookie['httponly'])
+        self.assertGreater(cookie['max-age'], 3500)
+
+        request = self._request_with(cookie.value)
+        self.assertEqual(get_participant_id(request, self.session.session_id), self.participant_id)
+
+    def test_tampered_or_missing_cookie_is_ignored(self):
+        self.assertIsNone(get_participant_id(self.factory.get('/'), self.session.session_id))
+        request = self._request_with(f'{uuid.uuid4()}:forged')
+        self.assertIsNone(get_participant_id(request, self.session.session_id))
+
+
+class SocketTokenTests(TestCase):
+    """WebSocket接続用の署名付きトークン"""
+
+    def setUp(self):
+        self.session = LocationSession.objects.create(duration_minutes=60)
+        self.participant_id = str(uuid.uuid4())
+        self.token = make_socket_token(self.session, self.participant_id)
+
+    def test_token_round_trip(self):
+        identity = verify_socket_token(self.token, self.session.session_id)
+        self.assertEqual(identity.session_pk, self.session.pk)
+        self.assertEqual(identity.participant_id, self.participant_id)
+        self.assertEqual(int(identity.expires_at.timestamp()), int(self.session.expires_at.timestamp()))
+
+    def test_token_for_another_session_is_rejected(self):
+        other = LocationSession.objects.create(duration_minutes=60)
+        self.assertIsNone(verify_socket_token(self.token, other.session_id))
+
+    def test_tampered_token_is_rejected(self):
+        self.assertIsNone(verify_socket_token(self.token[:-2] + 'xx', self.session.session_id))
+        self.assertIsNone(verify_socket_token('', self.session.session_id))
+
+
+class ReportingRateTests(TestCase):
+    """サーバー主導の送信間隔制御"""
+
+    def setUp(self):
+        self.monitor = WorkerLoadMonitor()
+        self.controller = ReportingRateController(load_monitor=self.monitor)
+
+    def test_moving_and_watched_reports_fastest(self):
+        self.assertEqual(
+            self.controller.recommend(is_moving=True, is_background=False, participant_count=2, viewer_count=1),
+            {'report_interval': 1000, 'ping_interval': 60000}
+        )
+
+    def test_idle_participants_slow_down(self):
+        stationary = self.controller.recommend(False, False, 2, 1)
+        unwatched = self.controller.recommend(True, False, 2, 0)
+        background = self.controller.recommend(True, True, 2, 1)
+        self.assertEqual(stationary['report_interval'], 15000)
+        self.assertEqual(unwatched['report_interval'], 60000)
+        self.assertEqual(background['report_interval'], 15000)
+        self.assertEqual(background['ping_interval'], 20000)
+
+    def test_large_sessions_and_worker_load_widen_intervals(self):
+        self.assertEqual(self.controller.recommend(False, False, 15, 1)['report_interval'], 30000)
+
+        self.monitor.record(self.controller.target_messages_per_second * self.monitor.window_seconds * 2)
+        self.assertEqual(self.controller.load_factor(), 2.0)
+        recommended = self.controller.recommend(False, False, 15, 1)
+        self.assertEqual(recommended['report_interval'], 60000)
+        self.assertEqual(recommended['ping_interval'], 90000)  # 上限
+
+
+class PresenceSweepTests(TestCase):
+    """オンライン状態の定期スイープ"""
+
+    def setUp(self):
+        self.session = LocationSession.objects.create(duration_minutes=60)
+        self.now = timezone.now()
+
+    def _participant(self, name, **fields):
+        fields.setdefault('last_seen_at', self.now)
+        return LocationData.objects.create(
+            session=self.session, participant_id=str(uuid.uuid4()), participant_name=name, status='sharing', **fields
+        )
+
+    def test_only_stale_participants_go_offline(self):
+        fresh = self._participant('fresh')
+        due = self._participant('due', offline_after=self.now - timedelta(seconds=1))
+        silent_desktop = self._participant('desktop', last_seen_at=self.now - timedelta(minutes=3))
+        silent_mobile = self._participant('mobile', is_mobile=True, last_seen_at=self.now - timedelta(minutes=3))
+        waiting = self._participant('waiting', offline_after=self.now - timedelta(seconds=1))
+        LocationData.objects.filter(pk=waiting.pk).update(status='waiting')
+
+        self.assertEqual(sweep_stale_participants(), [str(self.session.session_id)])
+        state = {
+            location.pk: (location.is_online, location.status)
+            for location in LocationData.objects.filter(session=self.session)
+        }
+        self.assertEqual(state[fresh.pk], (True, 'sharing'))
+        self.assertEqual(state[due.pk], (False, 'stopped'))  # 切断時の期限を過ぎた
+        self.assertEqual(state[silent_desktop.pk], (False, 'stopped'))  # デスクトップの猶予（2分）を過ぎた
+        self.assertEqual(state[silent_mobile.pk], (True, 'sharing'))  # モバイルの猶予（5分）内
+        self.assertEqual(state[waiting.pk], (True, 'waiting'))  # 未共有の参加者は対象外
+        self.assertEqual(sweep_stale_participants(), [])
+
+    def test_sweeper_broadcasts_once_per_changed_session(self):
+        changed = []
+
+        async def on_changed(session_id):
+            changed.append(session_id)
+            if session_id == 'broken':
+                raise RuntimeError('broadcast failed')
+
+        sweeper = PresenceSweeper(lambda: ['a', 'broken', 'b'], on_changed)
+        self.assertEqual(async_to_sync(sweeper.sweep_once)(), 3)
+        self.assertEqual(changed, ['a', 'broken', 'b'])
+        self.assertEqual(sweeper.get_stats(), {'sweeps': 1, 'sessions_changed': 3})
+
+
+class SessionLogSinkTests(TestCase):
+    """セッションログの非同期書き込み"""
+
+    def setUp(self):
+        self.session = LocationSession.objects.create(duration_minutes=60)
+        self.sink = SessionLogSink(max_queue=3, max_batch=2, sample_rates={'location_updated': 0})
+        # バックグラウンドスレッドは起動せず、flush() で保存する
+        patcher = mock.patch.object(self.sink, '_ensure_started')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_queued_entries_are_written_in_batches(self):
+        self.assertTrue(self.sink.log(self.session, 'joined', participant_id='a'))
+        self.assertTrue(self.sink.log(self.session.pk, 'left', participant_id='a'))
+        self.assertTrue(self.sink.log(self.session, 'error', error_message='x'))
+        self.assertEqual(SessionLog.objects.count(), 0)
+
+        self.sink.flush()
+        self.assertEqual(
+            sorted(SessionLog.objects.values_list('action', flat=True)), ['error', 'joined', 'left']
+        )
+        stats = self.sink.get_stats()
+        self.assertEqual((stats['written'], stats['batches'], stats['pending']), (3, 2, 0))
+
+    def test_sampled_and_overflowing_entries_are_dropped(self):
+        self.assertFalse(self.sink.log(self.session, 'location_updated'))
+        for _ in range(4):
+            self.sink.log(self.session, 'joined')
+        stats = self.sink.get_stats()
+        self.assertEqual((stats['sampled_out'], stats['dropped'], stats['queued']), (1, 1, 3))
+
+
+class TypingStateMachineTests(TestCase):
+    """入力中インジケーターの状態管理"""
+
+    def setUp(self):
+        self.typing = TypingStateMachine(timeout=15, refresh_interval=10)
+
+    def test_only_transitions_are_broadcast(self):
+        self.typing.update('group', 'a', None, 'A', True, now=0)
+        self.assertEqual(self.typing.tick(now=0), [TypingTransition('group', 'a', None, 'A', True)])
+        # 通知が続いても再通知の間隔までは何も送らない
+        self.typing.update('group', 'a', None, 'A', True, now=1)
+        self.assertEqual(self.typing.tick(now=1), [])
+        self.assertEqual(len(self.typing.tick(now=10)), 1)
+
+        self.typing.update('group', 'a', None, 'A', False, now=11)
+        self.assertEqual(self.typing.tick(now=11), [TypingTransition('group', 'a', None, 'A', False)])
+
+    def test_silent_typist_times_out(self):
+        self.typing.update('individual', 'a', 'b', 'A', True, now=0)
+        self.typing.tick(now=0)
+        self.assertEqual(self.typing.tick(now=15), [TypingTransition('individual', 'a', 'b', 'A', False)])
+
+    def test_start_and_stop_within_one_tick_sends_nothing(self):
+        self.typing.update('group', 'a', None, 'A', True, now=0)
+        self.typing.update('group', 'a', None, 'A', False, now=0.1)
+        self.assertEqual(self.typing.tick(now=0.2), [])
+
+
+class SessionExpirySchedulerTests(TestCase):
+    """セッション期限切れのプッシュ通知"""
+
+    def setUp(self):
+        self.expired = []
+
+        async def on_expire(session_id):
+            self.expired.append(session_id)
+
+        self.scheduler = SessionExpiryScheduler(on_expire)
+
+    def test_one_timer_per_session_fires_at_expiry(self):
+        async def scenario():
+            expires_at = timezone.now() + timedelta(milliseconds=20)
+            self.scheduler.watch('s', expires_at)
+            self.scheduler.watch('s', expires_at)
+            self.assertEqual(self.scheduler.active_sessions(), 1)
+            await asyncio.sleep(0.1)
+
+        async_to_sync(scenario)()
+        self.assertEqual(self.expired, ['s'])
+        self.assertEqual(self.scheduler.active_sessions(), 0)
+
+    def test_timer_is_cancelled_after_the_last_connection_leaves(self):
+        async def scenario():
+            expires_at = timezone.now() + timedelta(milliseconds=20)
+            self.scheduler.watch('s', expires_at)
+            self.scheduler.watch('s', expires_at)
+            self.scheduler.unwatch('s')
+            self.assertEqual(self.scheduler.active_sessions(), 1)
+            self.scheduler.unwatch('s')
+            await asyncio.sleep(0.1)
+
+        async_to_sync(scenario)()
+        self.assertEqual(self.expired, [])
+        self.assertEqual(self.scheduler.active_sessions(), 0)
+
+
+class ChatWriteBufferTests(TestCase):
+    """チャットメッセージのバッチ保存"""
+
+    def setUp(self):
+        self.batches = []
+        self.buffer = ChatWriteBuffer(self._persist, max_batch=3, max_latency=0.01)
+
+    def _persist(self, objs):
+        if 'bad' in objs:
+            raise ValueError('save failed')
+        self.batches.append(list(objs))
+
+    def test_messages_are_saved_together(self):
+        async def scenario():
+            futures = [await self.buffer.submit(i) for i in range(4)]
+            return await asyncio.gather(*futures)
+
+        self.assertEqual(async_to_sync(scenario)(), [True] * 4)
+        # max_batch 件で即時保存し、残りは max_latency 後に保存
+        self.assertEqual(self.batches, [[0, 1, 2], [3]])
+        self.assertEqual(self.buffer.get_stats()['persisted'], 4)
+
+    def test_failed_batch_resolves_false(self):
+        async def scenario():
+            future = await self.buffer.submit('bad')
+            return await future, await self.buffer.write_now('ok')
+
+        self.assertEqual(async_to_sync(scenario)(), (False, True))
+        self.assertEqual(self.batches, [['ok']])
+        self.assertEqual(self.buffer.get_stats()['failed'], 1)
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+class HomePageCacheTests(TestCase):
+    """ホームページの共有キャッシュ"""
+
+    def test_home_page_is_publicly_cacheable(self):
+        response = self.client.get(reverse('tracker:home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('public', response.headers['Cache-Control'])
+        # トークンは送信時に取得するため、ページには埋め込まない
+        self.assertContains(response, 'name="csrfmiddlewaretoken" value=""', count=2)
+        self.assertFalse(response.cookies)
+
+    def test_forms_fetch_a_csrf_token(self):
+        response = self.client.get(reverse('tracker:api_csrf_token'))
+        self.assertTrue(response.json()['csrf_token'])
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+class InitialRosterTests(TestCase):
+    """共有ページに埋め込む名簿"""
+
+    def setUp(self):
+        use_shared_cache(self)
+        self.session = LocationSession.objects.create(duration_minutes=60)
+        self.session_id = str(self.session.session_id)
+        self.walker = LocationData.objects.create(
+            session=self.session, participant_id=str(uuid.uuid4()), participant_name='歩く人',
+            latitude=35.0, longitude=139.0, status='sharing', last_seen_at=timezone.now()
+        )
+
+    def _embedded_roster(self):
+        response = self.client.get(reverse('tracker:share_location', args=[self.session.session_id]))
+        self.assertEqual(response.status_code, 200)
+        match = re.search(r'<script id="initial-roster" type="application/json">(.*?)</script>',
+                          response.content.decode(), re.S)
+        return json.loads(match.group(1))
+
+    def test_share_page_embeds_roster_and_etag(self):
+        other = LocationData.objects.create(
+            session=self.session, participant_id=str(uuid.uuid4()), participant_name='待つ人',
+            latitude=35.001, longitude=139.0, status='sharing', last_seen_at=timezone.now()
+        )
+        # 参加済みの参加者として開く（距離は自分から見た値）
+        response = HttpResponse()
+        remember_participant(response, self.session, self.walker.participant_id)
+        self.client.cookies.update(response.cookies)
+
+        roster = self._embedded_roster()
+        self.assertEqual(
+            {loc['participant_id'] for loc in roster['locations']}, {self.walker.participant_id, other.participant_id}
+        )
+        self.assertEqual(set(roster['distances']), {other.participant_id})
+        self.assertTrue(roster_versions.is_current(self.session_id, roster['etag']))
+
+    def test_process_local_cache_does_not_share_snapshots(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            etag = roster_versions.get(self.session_id)[0]
+            # 他のプロセスの bump() が見えないため、ETagによる差分通知は行わない
+            self.assertFalse(roster_versions.is_current(self.session_id, etag))
+            self.assertEqual(roster_versions.snapshot(self.session_id, lambda: ['a'])[1], ['a'])
+            self.assertEqual(roster_versions.snapshot(self.session_id, lambda: ['b'])[1], ['b'])
+
+    def test_deactivated_ghost_is_not_served_from_the_old_snapshot(self):
+        etag = self._embedded_roster()['etag']
+        ghost = LocationData.objects.create(
+            session=self.session, participant_id=str(uuid.uuid4()), participant_name='歩く人',
+            latitude=35.0, longitude=139.0, status='stopped', is_online=False
+        )
+        consumer = make_consumer(self.session)
+        consumer.participant_id = self.walker.participant_id
+        self.assertEqual(call_sync(consumer, '_cleanup_old_offline_participants', '歩く人'), 1)
+
+        self.assertFalse(LocationData.objects.get(pk=ghost.pk).is_active)
+        self.assertFalse(roster_versions.is_current(self.session_id, etag))
+        self.assertNotEqual(self._embedded_roster()['etag'], etag)
+
+
+@mock.patch('tracker.views.session_log')
+class AsyncFallbackViewTests(TestCase):
+    """WebSocketを使えない場合のHTTPフォールバック（非同期ビュー）"""
+
+    def setUp(self):
+        self.session = LocationSession.objects.create(duration_minutes=60)
+        self.participant_id = str(uuid.uuid4())
+
+    def _post(self, name, data):
+        return self.client.post(
+            reverse(f'tracker:{name}', args=[self.session.session_id]), json.dumps(data),
+            content_type='application/json'
+        )
+
+    def test_location_update_creates_participant(self, session_log):
+        response = self._post('api_update_location', {
+            'participant_id': self.participant_id, 'participant_name': 'A', 'latitude': 35.0, 'longitude': 139.0,
+        })
+        self.assertEqual(response.status_code, 200)
+        location = LocationData.objects.get(session=self.session, participant_id=self.participant_id)
+        self.assertEqual(float(location.latitude), 35.0)
+        self.assertEqual(session_log.log.call_args.args[1], 'joined')
+
+    def test_ping_cancels_pending_offline(self, session_log):
+        LocationData.objects.create(
+            session=self.session, participant_id=self.participant_id, is_online=False,
+            offline_after=timezone.now() + timedelta(minutes=1)
+        )
+        response = self._post('api_ping', {'participant_id': self.participant_id})
+        self.assertTrue(response.json()['pong'])
+        location = LocationData.objects.get(session=self.session, participant_id=self.participant_id)
+        self.assertTrue(location.is_online)
+        self.assertIsNone(location.offline_after)
+
+    def test_invalid_requests_are_rejected(self, session_log):
+        self.assertEqual(self._post('api_update_location', {'participant_id': 'x'}).status_code, 400)
+        response = self.client.get(reverse('tracker:api_ping', args=[self.session.session_id]))
+        self.assertEqual(response.status_code, 405)
+
+
+class LocationStreamTests(TestCase):
+    """位置情報のSSEストリーム"""
+
+    def setUp(self):
+        use_shared_cache(self)
+        self.session = LocationSession.objects.create(duration_minutes=60)
+        self.session_id = str(self.session.session_id)
+
+    def _frames(self, last_event_id=None, events=()):
+        """ストリームを開き、events をグループに送ってから終了までのフレームを返す"""
+        async def scenario():
+            stream = _location_stream(self.session_id, None, last_event_id, self.session.expires_at)
+            frames = [await stream.__anext__()]
+            for event in list(events) + [{'type': 'session_expired_broadcast'}]:
+                await get_channel_layer().group_send(f'location_{self.session_id}', event)
+            frames += [frame async for frame in stream]
+            return frames
+
+        return async_to_sync(scenario)()
+
+    def test_stream_sends_roster_then_updates(self):
+        frames = self._frames(events=[{
+            'type': 'single_participant_broadcast', 'participant_id': 'a', 'participant_data': {}, 'roster_etag': '"v2"',
+        }])
+        etag = roster_versions.get(self.session_id)[0].strip('"')
+        self.assertTrue(frames[0].startswith('retry:'))
+        self.assertTrue(frames[1].startswith(f'id: {etag}\nevent: location_update\n'))
+        self.assertTrue(frames[2].startswith('id: v2\nevent: single_participant_update\n'))
+        self.assertTrue(frames[3].startswith('event: session_expired\n'))
+        self.assertEqual(len(frames), 4)
+
+    def test_reconnect_with_current_event_id_skips_roster(self):
+        etag = roster_versions.get(self.session_id)[0].strip('"')
+        frames = self._frames(last_event_id=etag)
+        self.assertEqual(len(frames), 2)
+        self.assertTrue(frames[1].startswith('event: session_expired\n'))
+
+    def test_stream_response_headers(self):
+        response = self.client.get(reverse('tracker:api_location_stream', args=[self.session.session_id]))
+        self.assertEqual(response['Content-Type'], 'text/event-stream; charset=utf-8')
+        self.assertEqual(response['X-Accel-Buffering'], 'no')
+
+
+class ParticipantGroupTests(TestCase):
+    """個別チャットの参加者グループ配信"""
+
+    def test_direct_messages_reach_only_the_pair(self):
+        session = LocationSession.objects.create(duration_minutes=60)
+
+        async def scenario():
+            layer = get_channel_layer()
+            consumers = {}
+            for name in ('a', 'b', 'c'):
+                consumer = make_consumer(session)
+                consumer.channel_layer = layer
+                consumer.channel_name = await layer.new_channel()
+                consumer.room_group_name = f'location_{consumer.session_id}'
+                consumer.participant_id = name
+                await layer.group_add(consumer.room_group_name, consumer.channel_name)
+                await consumer._join_participant_group()
+                consumers[name] = consumer
+
+            await consumers['a']._send_to_conversation('individual', 'a', 'b', {'type': 'chat_message', 'text': 'dm'})
+            await consumers['a']._send_to_conversation('group', 'a', None, {'type': 'chat_message', 'text': 'all'})
+
+            received = {}
+            for name, consumer in consumers.items():
+                received[name] = []
+                while True:
+                    try:
+                        event = await asyncio.wait_for(layer.receive(consumer.channel_name), timeout=0.05)
+                    except asyncio.TimeoutError:
+                        break
+                    received[name].append(event['text'])
+            return received
+
+        self.assertEqual(async_to_sync(scenario)(), {'a': ['dm', 'all'], 'b': ['dm', 'all'], 'c': ['all']})
+
+
+class _StripCommentsStorage(CompressedManifestStaticFilesStorage):
+    # 縮小ライブラリの有無によらず、縮小したファイルがハッシュ・圧縮されることを確認する
+    minifiers = {'.js': lambda source: re.sub(r'/\*.*?\*/', '', source, flags=re.S)}
+
+
+class CompressedManifestStorageTests(TestCase):
+    """静的ファイルのビルド（縮小・ハッシュ付きファイル名・事前圧縮）"""
+
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.storage = _StripCommentsStorage(location=self.root.name, base_url='/static/')
+
+    def _collect(self, files):
+        for name, content in files.items():
+            self.storage.delete(name)
+            self.storage._save(name, ContentFile(content.encode('utf-8')))
+        list(self.storage.post_process({name: (self.storage, name) for name in files}))
+        self.storage.load_manifest()
+
+    def test_minified_file_is_hashed_and_precompressed(self):
+        body = 'var a = 1;\n' * 200
+        self._collect({'js/app.js': '/* comment */\n' + body, 'js/tiny.js': 'var b;'})
+
+        hashed = self.storage.stored_name('js/app.js')
+        self.assertNotEqual(hashed, 'js/app.js')
+        with self.storage.open(hashed) as f:
+            self.assertNotIn(b'comment', f.read())
+        self.assertTrue(self.storage.exists(hashed + '.gz'))
+        # 小さいファイルは圧縮しない
+        self.assertFalse(self.storage.exists(self.storage.stored_name('js/tiny.js') + '.gz'))
+
+    def test_hash_follows_minified_content(self):
+        self._collect({'js/app.js': '/* v1 */\nvar a = 1;'})
+        first = self.storage.stored_name('js/app.js')
+        # コメントだけの変更では縮小後の内容が同じなのでURLも変わらない
+        self._collect({'js/app.js': '/* v2 */\nvar a = 1;'})
+        self.assertEqual(self.storage.stored_name('js/app.js'), first)
+
+
+class ChatAcknowledgementTests(TestCase):
+    """チャットメッセージの送信確認"""
+
+    def test_acknowledgement_is_kept_until_sent_and_cancelled_on_disconnect(self):
+        consumer = LocationConsumer()
+        sent = []
+
+        async def send_json(content):
+            sent.append(content)
+
+        consumer.send_json = send_json
+
+        async def scenario():
+            loop = asyncio.get_running_loop()
+            saved, pending = loop.create_future(), loop.create_future()
+            done = consumer._start_background_task(consumer._acknowledge_chat_message(saved, 1, 't', 'c1'))
+            consumer._start_background_task(consumer._acknowledge_chat_message(pending, 2, 't', 'c2'))
+            self.assertEqual(len(consumer.background_tasks), 2)
+
+            saved.set_result(True)
+            await done
+            self.assertEqual(len(consumer.background_tasks), 1)
+
+            # 切断時は未送信の確認を取り消す（保存自体は取り消さない）
+            consumer._cancel_background_tasks()
+            await asyncio.sleep(0)
+            return pending
+
+        pending = async_to_sync(scenario)()
+        self.assertEqual([(m['id'], m['persisted']) for m in sent], [(1, True)])
+        self.assertEqual(consumer.background_tasks, set())
+        self.assertFalse(pending.cancelled())
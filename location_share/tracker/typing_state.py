@@ -0,0 +1,88 @@
+# tracker/typing_state.py - 入力中インジケーターの状態管理
+import time
+from typing import Dict, List, Optional, Tuple, NamedTuple
+
+# (chat_type, sender_id, target_id)
+TypingKey = Tuple[str, str, Optional[str]]
+
+
+class TypingTransition(NamedTuple):
+    """ブロードキャストすべき状態変化"""
+    chat_type: str
+    sender_id: str
+    target_id: Optional[str]
+    sender_name: str
+    is_typing: bool
+
+
+class _TypingEntry:
+    __slots__ = ('sender_name', 'expires_at', 'announced', 'announced_at')
+
+    def __init__(self, sender_name: str, expires_at: float):
+        self.sender_name = sender_name
+        self.expires_at = expires_at
+        self.announced = False
+        self.announced_at = 0.0
+
+
+class TypingStateMachine:
+    """接続ごとの入力中状態（送信者・宛先単位）
+
+    クライアントからの通知は状態を更新するだけで、ブロードキャストは tick() が
+    返す状態変化（開始・終了）のみ行う。一定時間通知がなければサーバー側で終了とし、
+    入力中が続く場合は refresh_interval ごとに再通知する。
+    同じ tick 内で開始・終了した場合は何も送らない。
+    """
+
+    def __init__(self, timeout: float = 15.0, refresh_interval: float = 10.0):
+        self.timeout = timeout
+        self.refresh_interval = refresh_interval
+        self._entries: Dict[TypingKey, _TypingEntry] = {}
+
+    def update(self, chat_type: str, sender_id: str, target_id: Optional[str],
+               sender_name: str, is_typing: bool, now: Optional[float] = None):
+        """クライアントからの入力中通知を反映"""
+        now = time.monotonic() if now is None else now
+        key = (chat_type, sender_id, target_id)
+        entry = self._entries.get(key)
+
+        if is_typing:
+            if entry is None:
+                self._entries[key] = _TypingEntry(sender_name, now + self.timeout)
+            else:
+                entry.sender_name = sender_name
+                entry.expires_at = now + self.timeout
+        elif entry is not None:
+            # 次の tick で終了を通知（未通知なら破棄のみ）
+            entry.expires_at = now
+
+    def tick(self, now: Optional[float] = None) -> List[TypingTransition]:
+        """期限切れ・未通知・再通知が必要な状態変化をまとめて取り出す"""
+        now = time.monotonic() if now is None else now
+        transitions = []
+
+        for key, entry in list(self._entries.items()):
+            chat_type, sender_id, target_id = key
+            if entry.expires_at <= now:
+                del self._entries[key]
+                if entry.announced:
+                    transitions.append(TypingTransition(chat_type, sender_id, target_id, entry.sender_name, False))
+            elif not entry.announced or now - entry.announced_at >= self.refresh_interval:
+                entry.announced = True
+                entry.announced_at = now
+                transitions.append(TypingTransition(chat_type, sender_id, target_id, entry.sender_name, True))
+
+        return transitions
+
+    def clear(self) -> List[TypingTransition]:
+        """全状態を破棄し、通知済みのものの終了を返す（切断時）"""
+        transitions = [
+            TypingTransition(chat_type, sender_id, target_id, entry.sender_name, False)
+            for (chat_type, sender_id, target_id), entry in self._entries.items()
+            if entry.announced
+        ]
+        self._entries.clear()
+        return transitions
+
+    def __bool__(self) -> bool:
+        return bool(self._entries)
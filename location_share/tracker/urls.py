@@ -17,8 +17,11 @@ urlpatterns = [
     
     # API エンドポイント
     path('api/stats/', views.api_get_stats, name='api_get_stats'),
+    path('api/csrf-token/', views.api_csrf_token, name='api_csrf_token'),
     path('api/session/<uuid:session_id>/update/', views.api_update_location, name='api_update_location'),
+    path('api/session/<uuid:session_id>/update-batch/', views.api_update_locations_batch, name='api_update_locations_batch'),
     path('api/session/<uuid:session_id>/locations/', views.api_get_locations, name='api_get_locations'),
+    path('api/session/<uuid:session_id>/stream/', views.api_location_stream, name='api_location_stream'),
     path('api/session/<uuid:session_id>/leave/', views.api_leave_session, name='api_leave_session'),
     path('api/session/<uuid:session_id>/offline/', views.api_offline_status, name='api_offline_status'),
     path('api/session/<uuid:session_id>/update-name/', views.api_update_name, name='api_update_name'),
@@ -1,32 +1,45 @@
 # tracker/views.py - セキュリティ強化版
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse, Http404
+from django.http import JsonResponse, Http404, HttpResponseNotAllowed, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django.views.decorators.http import require_http_methods
 from django.utils import timezone
 from django.contrib import messages
 from django.core.mail import send_mail
 from django.conf import settings
+from django.core.cache import cache
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags, escape
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
-from django.views.decorators.cache import never_cache
+from django.views.decorators.cache import never_cache, cache_control
 from django.views.decorators.vary import vary_on_headers
+from django.utils.cache import get_conditional_response, add_never_cache_headers, patch_cache_control
+from django.utils.http import http_date
 from django.middleware.csrf import get_token
 from django.utils.decorators import method_decorator
 from django.views.decorators.gzip import gzip_page
 from django.core.signing import Signer, BadSignature
 from django.utils.crypto import get_random_string
 from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from asgiref.sync import async_to_sync, sync_to_async
+import asyncio
 import json
 import uuid
+from functools import wraps
 import logging
 import re
 import bleach
-from datetime import timedelta
-from .models import LocationSession, LocationData, SessionLog
+from .models import LocationSession, LocationData
+from .session_log import session_log
+from .live_stats import live_stats, update_participant
+from .location_batch import parse_fixes, apply_location_fixes
+from .consumers import broadcast_participant, get_session_locations, distance_matrix
+from .distance_matrix import roster_version
+from .roster_versions import roster_versions
+from .rate_limit import Limit, rate_limiter
+from .participant_identity import get_participant_id, remember_participant, make_socket_token
 
 # ログ設定
 logger = logging.getLogger(__name__)
@@ -35,6 +48,14 @@ logger = logging.getLogger(__name__)
 MAX_PARTICIPANT_NAME_LENGTH = 30
 MAX_MESSAGE_LENGTH = 2000
 MAX_REQUESTS_PER_MINUTE = 60
+VIEW_RATE_LIMITS = {
+    'default': Limit(MAX_REQUESTS_PER_MINUTE, MAX_REQUESTS_PER_MINUTE),
+    'ping': Limit(MAX_REQUESTS_PER_MINUTE * 3, MAX_REQUESTS_PER_MINUTE * 3),  # pingは頻繁に呼ばれるため3倍まで許可
+}
+MAX_FIXES_PER_BATCH = 100  # 一括送信1回あたりの測位数
+SSE_KEEPALIVE_SECONDS = 15  # SSEのコメント送信間隔（プロキシによる切断防止）
+SSE_MAX_DURATION_SECONDS = 1800  # 1接続の最長時間（以降はブラウザの自動再接続に任せる）
+SSE_RETRY_MILLISECONDS = 3000  # 切断時の再接続待ち
 ALLOWED_DURATION_CHOICES = [15, 30, 60, 120, 240, 480, 720]  # 許可された時間設定
 
 def validate_participant_name(name):
@@ -108,24 +129,21 @@ def validate_participant_id(participant_id):
     
     return True
 
-def rate_limit_check(request, key_suffix=''):
-    """レート制限チェック（簡易版）"""
-    from django.core.cache import cache
-    
-    client_ip = get_client_ip(request)
-    cache_key = f'rate_limit_{client_ip}_{key_suffix}'
-    
-    requests = cache.get(cache_key, 0)
-    if requests >= MAX_REQUESTS_PER_MINUTE:
-        return False
-    
-    cache.set(cache_key, requests + 1, 60)  # 1分間
-    return True
+def home(request):
+    """ホームページ（CDN等でキャッシュ可能、フォームのCSRFトークンは送信時に取得）"""
+    response = render(request, 'tracker/home.html')
+    if messages.get_messages(request).used:
+        # エラーメッセージを表示した応答は共有キャッシュに載せない
+        add_never_cache_headers(response)
+    else:
+        patch_cache_control(response, public=True, max_age=settings.HOME_PAGE_CACHE_SECONDS)
+    return response
 
 @never_cache
-def home(request):
-    """ホームページ"""
-    return render(request, 'tracker/home.html')
+@require_http_methods(["GET"])
+def api_csrf_token(request):
+    """キャッシュされたページのフォーム用にCSRFトークンを返す"""
+    return JsonResponse({'csrf_token': get_token(request)})
 
 @csrf_protect
 @never_cache
@@ -348,11 +366,12 @@ def create_session(request):
     
     try:
         session = LocationSession.objects.create(duration_minutes=duration)
+        live_stats.add('active_sessions_count')
         
         # ログ記録
-        SessionLog.objects.create(
-            session=session,
-            action='created',
+        session_log.log(
+            session,
+            'created',
             ip_address=get_client_ip(request),
             user_agent=request.META.get('HTTP_USER_AGENT', '')[:500]  # 長さ制限
         )
@@ -405,15 +424,8 @@ def share_location(request, session_id):
     if session.is_expired():
         return render(request, 'tracker/expired.html', {'session': session})
     
-    # 参加者IDをセッションで管理（セキュア）
-    participant_key = f'participant_{session_id}'
-    participant_id = request.session.get(participant_key)
-    
-    if not participant_id:
-        participant_id = str(uuid.uuid4())
-        request.session[participant_key] = participant_id
-        # セッションを保存
-        request.session.save()
+    # 参加者IDは署名付きCookieで管理（DBセッションへの書き込みなし）
+    participant_id = get_participant_id(request, session_id) or str(uuid.uuid4())
     
     # WebSocket用の設定
     is_secure = request.is_secure()
@@ -425,50 +437,148 @@ def share_location(request, session_id):
         'participant_id': participant_id,
         'expires_at': session.expires_at,
         'websocket_url': f'{ws_scheme}://{host}/ws/location/{session_id}/',
+        'socket_token': make_socket_token(session, participant_id),
+        'initial_roster': _initial_roster(str(session_id), participant_id),
         'csrf_token': get_token(request),
         'nonce': get_random_string(16),  # CSP用nonce
     }
-    return render(request, 'tracker/share.html', context)
+    response = render(request, 'tracker/share.html', context)
+    remember_participant(response, session, participant_id)
+    return response
+
+def _initial_roster(session_id, participant_id):
+    """共有ページに埋め込む名簿（WebSocket接続前の表示用、同じバージョンの間はキャッシュを共有）"""
+    try:
+        etag, locations = roster_versions.snapshot(session_id, lambda: get_session_locations(session_id))
+        return {
+            'etag': etag,
+            'locations': locations,
+            'distances': distance_matrix.row(session_id, roster_version(locations), locations, participant_id),
+        }
+    except Exception as e:
+        logger.error(f"Initial roster error: {str(e)}")
+        return None
 
 # WebSocket通知用のヘルパー関数
 def notify_location_update(session_id, locations_data):
     """WebSocketで位置情報更新を全参加者に通知"""
+    async_to_sync(anotify_location_update)(session_id, locations_data)
+
+async def anotify_location_update(session_id, locations_data):
+    """WebSocketで位置情報更新を全参加者に通知（非同期ビュー用）"""
     try:
         validate_session_id(session_id)
+        etag, _ = roster_versions.bump(session_id)
         channel_layer = get_channel_layer()
         if channel_layer:
-            async_to_sync(channel_layer.group_send)(
+            await channel_layer.group_send(
                 f'location_{session_id}',
                 {
                     'type': 'location_broadcast',
-                    'locations': locations_data
+                    'locations': locations_data,
+                    'roster_etag': etag
                 }
             )
     except ValidationError:
         logger.error(f'Invalid session_id in notify_location_update: {session_id}')
 
+def serialize_location(location):
+    """位置情報をブロードキャスト用の辞書に変換"""
+    return {
+        'participant_id': str(location.participant_id),  # str()で明示的に変換
+        'participant_name': escape(location.participant_name or f'参加者{str(location.participant_id)[:8]}'),  # str()で明示的に変換
+        'latitude': float(location.latitude) if location.latitude else None,
+        'longitude': float(location.longitude) if location.longitude else None,
+        'accuracy': float(location.accuracy) if location.accuracy else None,
+        'last_updated': location.last_updated.isoformat(),
+        'is_background': location.is_background,
+    }
+
 def get_all_locations_data(session):
     """セッション内の全位置情報を取得"""
     locations = LocationData.objects.filter(session=session, is_active=True)
-    return [
-        {
-            'participant_id': str(location.participant_id),  # str()で明示的に変換
-            'participant_name': escape(location.participant_name or f'参加者{str(location.participant_id)[:8]}'),  # str()で明示的に変換
-            'latitude': float(location.latitude) if location.latitude else None,
-            'longitude': float(location.longitude) if location.longitude else None,
-            'accuracy': float(location.accuracy) if location.accuracy else None,
-            'last_updated': location.last_updated.isoformat(),
-            'is_background': location.is_background,
-        }
-        for location in locations
-    ]
+    return [serialize_location(location) for location in locations]
 
-@csrf_exempt  # WebSocketからのHTTP fallback用
-@require_http_methods(["POST"])
-def api_update_location(request, session_id):
-    """位置情報更新API - セキュリティ強化版"""
+async def aget_all_locations_data(session):
+    """セッション内の全位置情報を取得（非同期ビュー用）"""
+    locations = LocationData.objects.filter(session=session, is_active=True)
+    return [serialize_location(location) async for location in locations]
+
+def async_api_view(methods):
+    """非同期APIビュー用のデコレータ（HTTP fallback用にCSRF除外）
+
+    Django 4.2 の csrf_exempt / require_http_methods は同期ビュー専用のため、
+    非同期ビューではこちらを使う。
+    """
+    def decorator(func):
+        @wraps(func)
+        async def inner(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            return await func(request, *args, **kwargs)
+        inner.csrf_exempt = True
+        return inner
+    return decorator
+
+def roster_conditional(view_func):
+    """名簿バージョンによる条件付きGET
+
+    If-None-Match / If-Modified-Since が現在のバージョンと一致すれば、
+    LocationData を読まずに 304 を返す。期限はキャッシュから読むため、名簿が
+    変わっていなければDBを参照しない。セッションを読み込んだ場合はビューに渡す。
+    期限切れのセッションや、名簿バージョンを共有できない構成では常にビューに渡す。
+    """
+    @wraps(view_func)
+    def inner(request, session_id, *args, **kwargs):
+        if not roster_versions.shared:
+            return view_func(request, session_id, *args, **kwargs)
+        try:
+            validate_session_id(session_id)
+        except ValidationError:
+            return view_func(request, session_id, *args, **kwargs)
+
+        expires_at, session = _session_expires_at(session_id)
+        if expires_at is None or timezone.now() > expires_at:
+            return view_func(request, session_id, *args, session=session, **kwargs)
+
+        etag, last_modified = roster_versions.get(session_id)
+        last_modified = int(last_modified.timestamp())
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = view_func(request, session_id, *args, session=session, **kwargs)
+        if response.status_code in (200, 304):
+            response.headers['ETag'] = etag
+            response.headers['Last-Modified'] = http_date(last_modified)
+        return response
+    return inner
+
+def _session_expires_at(session_id):
+    """セッションの期限（作成後は変わらないため期限までキャッシュ）と、DBから読んだ場合はそのセッション"""
+    key = f'session_expires_at:{session_id}'
+    expires_at = cache.get(key)
+    if expires_at is not None:
+        return expires_at, None
+
+    session = LocationSession.objects.filter(session_id=session_id).first()
+    if session is None:
+        return None, None
+    remaining = int((session.expires_at - timezone.now()).total_seconds())
+    if remaining > 0:
+        cache.set(key, session.expires_at, remaining)
+    return session.expires_at, session
+
+async def aget_session_or_404(session_id):
+    """セッション取得（存在しなければ404）"""
+    try:
+        return await LocationSession.objects.aget(session_id=session_id)
+    except LocationSession.DoesNotExist:
+        raise Http404
+
+@async_api_view(["POST"])  # WebSocketからのHTTP fallback用
+async def api_update_location(request, session_id):
+    """位置情報更新API - セキュリティ強化版（イベントループ上で処理）"""
     # レート制限チェック
-    if not rate_limit_check(request, 'update_location'):
+    if not await arate_limit_check(request, 'update_location'):
         return JsonResponse({'error': 'リクエスト制限に達しました'}, status=429)
     
     try:
@@ -476,7 +586,7 @@ def api_update_location(request, session_id):
     except ValidationError:
         return JsonResponse({'error': '無効なセッションIDです'}, status=400)
     
-    session = get_object_or_404(LocationSession, session_id=session_id)
+    session = await aget_session_or_404(session_id)
     
     if session.is_expired():
         return JsonResponse({'error': 'セッションが期限切れです'}, status=400)
@@ -506,7 +616,8 @@ def api_update_location(request, session_id):
                 accuracy = None
         
         # 位置情報を更新または作成
-        location, created = LocationData.objects.update_or_create(
+        now = timezone.now()
+        location, created = await LocationData.objects.aupdate_or_create(
             session=session,
             participant_id=participant_id,
             defaults={
@@ -516,22 +627,23 @@ def api_update_location(request, session_id):
                 'participant_name': bleach.clean(participant_name, tags=[], strip=True)[:MAX_PARTICIPANT_NAME_LENGTH],
                 'is_background': is_background,
                 'is_active': True,
+                'last_seen_at': now,
+                'offline_after': None,  # HTTP経由でも接続中として扱う
             }
         )
         
-        # 初回参加のログ記録
-        if created:
-            SessionLog.objects.create(
-                session=session,
-                action='joined',
-                participant_id=participant_id,
-                ip_address=get_client_ip(request),
-                user_agent=request.META.get('HTTP_USER_AGENT', '')[:500]
-            )
+        # 初回参加のログ記録（以降の位置更新は間引いて記録）
+        session_log.log(
+            session,
+            'joined' if created else 'location_updated',
+            participant_id=participant_id,
+            ip_address=get_client_ip(request),
+            user_agent=request.META.get('HTTP_USER_AGENT', '')[:500]
+        )
         
         # WebSocketで全参加者に通知
-        locations_data = get_all_locations_data(session)
-        notify_location_update(session_id, locations_data)
+        locations_data = await aget_all_locations_data(session)
+        await anotify_location_update(session_id, locations_data)
         
         return JsonResponse({'success': True, 'message': '位置情報を更新しました'})
         
@@ -543,16 +655,180 @@ def api_update_location(request, session_id):
         logger.error(f'Location update error: {str(e)}')
         return JsonResponse({'error': '位置情報の更新に失敗しました'}, status=500)
 
+@async_api_view(["POST"])  # バックグラウンドでたまった位置情報の一括送信
+async def api_update_locations_batch(request, session_id):
+    """位置情報一括更新API - 測位を時刻順に反映し、最新位置のみ通知"""
+    # レート制限チェック（位置更新と同じ枠を使う）
+    if not await arate_limit_check(request, 'update_location'):
+        return JsonResponse({'error': 'リクエスト制限に達しました'}, status=429)
+    
+    try:
+        validate_session_id(session_id)
+    except ValidationError:
+        return JsonResponse({'error': '無効なセッションIDです'}, status=400)
+    
+    session = await aget_session_or_404(session_id)
+    
+    if session.is_expired():
+        return JsonResponse({'error': 'セッションが期限切れです'}, status=400)
+    
+    try:
+        data = json.loads(request.body)
+        
+        participant_id = data.get('participant_id')
+        participant_name = data.get('participant_name', '')
+        is_background = bool(data.get('is_background', False))
+        
+        # バリデーション
+        validate_participant_id(participant_id)
+        validate_participant_name(participant_name)
+        fixes = parse_fixes(data.get('fixes'), MAX_FIXES_PER_BATCH)
+        
+        defaults = {'is_background': is_background, 'ip_address': get_client_ip(request)}
+        if participant_name:
+            defaults['participant_name'] = bleach.clean(participant_name, tags=[], strip=True)[:MAX_PARTICIPANT_NAME_LENGTH]
+        
+        # 1トランザクションで反映
+        location, created = await sync_to_async(apply_location_fixes)(session, participant_id, fixes, defaults)
+        
+        session_log.log(
+            session,
+            'joined' if created else 'location_updated',
+            participant_id=participant_id,
+            ip_address=get_client_ip(request),
+            user_agent=request.META.get('HTTP_USER_AGENT', '')[:500],
+            additional_data={'fixes': len(fixes)}
+        )
+        
+        # 最新位置のみを1回だけ通知
+        await broadcast_participant(str(session_id), participant_id)
+        
+        return JsonResponse({
+            'success': True,
+            'count': len(fixes),
+            'last_timestamp': fixes[-1].recorded_at.isoformat()
+        })
+        
+    except json.JSONDecodeError:
+        return JsonResponse({'error': '無効なJSONデータです'}, status=400)
+    except ValidationError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except Exception as e:
+        logger.error(f'Location batch update error: {str(e)}')
+        return JsonResponse({'error': '位置情報の更新に失敗しました'}, status=500)
+
+def _sse_frame(event_type, data, event_id=None):
+    """SSEのイベント1件を組み立て"""
+    lines = []
+    if event_id:
+        event_id = event_id.strip('"')  # ETagの引用符を除いてイベントIDにする
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event_type}')
+    lines.append(f'data: {json.dumps(data, ensure_ascii=False, separators=(",", ":"))}')
+    return '\n'.join(lines) + '\n\n'
+
+def _sse_roster_frame(session_id, participant_id, locations, version, etag):
+    """WebSocketの location_update と同じ内容（閲覧者が指定されていれば距離も含める）"""
+    return _sse_frame('location_update', {
+        'type': 'location_update',
+        'locations': locations,
+        'distances': distance_matrix.row(session_id, version, locations, participant_id),
+    }, etag)
+
+async def _location_stream(session_id, participant_id, last_event_id, expires_at):
+    """チャネルレイヤーのグループを購読し、名簿・差分をSSEで送り続ける"""
+    channel_layer = get_channel_layer()
+    group_name = f'location_{session_id}'
+    channel = await channel_layer.new_channel()
+    await channel_layer.group_add(group_name, channel)
+    try:
+        yield f'retry: {SSE_RETRY_MILLISECONDS}\n\n'
+
+        # 再接続時は、見逃した更新がある場合のみ現在の名簿を送る
+        etag, _ = roster_versions.get(session_id)
+        if not roster_versions.shared or last_event_id != etag.strip('"'):
+            locations = await database_sync_to_async(get_session_locations)(session_id)
+            yield _sse_roster_frame(session_id, participant_id, locations, roster_version(locations), etag)
+
+        loop = asyncio.get_running_loop()
+        until_expiry = (expires_at - timezone.now()).total_seconds()
+        deadline = loop.time() + min(SSE_MAX_DURATION_SECONDS, until_expiry)
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                if timezone.now() >= expires_at:
+                    yield _sse_frame('session_expired', {'type': 'session_expired'})
+                break
+            try:
+                event = await asyncio.wait_for(
+                    channel_layer.receive(channel),
+                    timeout=min(SSE_KEEPALIVE_SECONDS, remaining)
+                )
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+
+            event_type = event.get('type')
+            if event_type == 'location_broadcast':
+                locations = event['locations']
+                version = event.get('roster_version') or roster_version(locations)
+                yield _sse_roster_frame(session_id, participant_id, locations, version, event.get('roster_etag'))
+            elif event_type == 'single_participant_broadcast':
+                yield _sse_frame('single_participant_update', {
+                    'type': 'single_participant_update',
+                    'participant_id': event['participant_id'],
+                    'participant_data': event['participant_data'],
+                }, event.get('roster_etag'))
+            elif event_type == 'session_expired_broadcast':
+                yield _sse_frame('session_expired', {'type': 'session_expired'})
+                break
+    finally:
+        await channel_layer.group_discard(group_name, channel)
+
+@async_api_view(["GET"])
+async def api_location_stream(request, session_id):
+    """位置情報のSSEストリーム（WebSocketを維持できないクライアント向け）
+
+    LocationConsumer と同じ location_update / single_participant_update を送る。
+    イベントIDは名簿バージョンで、Last-Event-ID が最新と一致すれば初回の名簿を省略する。
+    """
+    if not await arate_limit_check(request, 'stream'):
+        return JsonResponse({'error': 'リクエスト制限に達しました'}, status=429)
+    
+    try:
+        validate_session_id(session_id)
+        participant_id = request.GET.get('participant_id') or None
+        if participant_id:
+            validate_participant_id(participant_id)
+    except ValidationError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    session = await aget_session_or_404(session_id)
+    
+    if session.is_expired():
+        return JsonResponse({'error': 'セッションが期限切れです'}, status=400)
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    response = StreamingHttpResponse(
+        _location_stream(str(session_id), participant_id, last_event_id, session.expires_at),
+        content_type='text/event-stream; charset=utf-8'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx のバッファリングを無効化
+    return response
+
 @require_http_methods(["GET"])
-@never_cache
-def api_get_locations(request, session_id):
+@cache_control(private=True, no_cache=True)
+@roster_conditional
+def api_get_locations(request, session_id, session=None):
     """セッション内の全位置情報取得API - セキュリティ強化版"""
     try:
         validate_session_id(session_id)
     except ValidationError:
         return JsonResponse({'error': '無効なセッションIDです'}, status=400)
     
-    session = get_object_or_404(LocationSession, session_id=session_id)
+    if session is None:  # roster_conditional が読み込んでいなければ取得
+        session = get_object_or_404(LocationSession, session_id=session_id)
     
     if session.is_expired():
         return JsonResponse({'error': 'セッションが期限切れです'}, status=400)
@@ -583,15 +859,18 @@ def api_leave_session(request, session_id):
         validate_participant_id(participant_id)
         
         # 位置情報を非アクティブに設定
-        LocationData.objects.filter(
-            session=session, 
-            participant_id=participant_id
-        ).update(is_active=False)
+        update_participant(
+            LocationData.objects.filter(
+                session=session, 
+                participant_id=participant_id
+            ),
+            is_active=False
+        )
         
         # ログ記録
-        SessionLog.objects.create(
-            session=session,
-            action='left',
+        session_log.log(
+            session,
+            'left',
             participant_id=participant_id,
             ip_address=get_client_ip(request),
             user_agent=request.META.get('HTTP_USER_AGENT', '')[:500]
@@ -661,10 +940,11 @@ def api_offline_status(request, session_id):
         validate_participant_name(participant_name)
         
         # 参加者をオフライン状態に更新
-        LocationData.objects.filter(
-            session=session,
-            participant_id=participant_id
-        ).update(
+        update_participant(
+            LocationData.objects.filter(
+                session=session,
+                participant_id=participant_id
+            ),
             is_online=False,
             status='offline',
             participant_name=bleach.clean(participant_name, tags=[], strip=True)[:MAX_PARTICIPANT_NAME_LENGTH],
@@ -672,9 +952,9 @@ def api_offline_status(request, session_id):
         )
         
         # ログ記録
-        SessionLog.objects.create(
-            session=session,
-            action='offline',
+        session_log.log(
+            session,
+            'offline',
             participant_id=participant_id,
             ip_address=get_client_ip(request),
             user_agent=request.META.get('HTTP_USER_AGENT', '')[:500]
@@ -748,15 +1028,17 @@ def api_update_name(request, session_id):
 
 
 @require_http_methods(["GET"])
-@never_cache
-def api_session_status(request, session_id):
+@cache_control(private=True, no_cache=True)
+@roster_conditional
+def api_session_status(request, session_id, session=None):
     """セッション状態取得API - セキュリティ強化版"""
     try:
         validate_session_id(session_id)
     except ValidationError:
         return JsonResponse({'error': '無効なセッションIDです'}, status=400)
     
-    session = get_object_or_404(LocationSession, session_id=session_id)
+    if session is None:  # roster_conditional が読み込んでいなければ取得
+        session = get_object_or_404(LocationSession, session_id=session_id)
     
     return JsonResponse({
         'session_id': str(session.session_id),  # str()で明示的に変換
@@ -771,12 +1053,11 @@ def api_session_status(request, session_id):
     })
 
 
-@csrf_exempt
-@require_http_methods(["POST"])
-def api_ping(request, session_id):
-    """参加者の生存確認API - セキュリティ強化版"""
+@async_api_view(["POST"])
+async def api_ping(request, session_id):
+    """参加者の生存確認API - セキュリティ強化版（イベントループ上で処理）"""
     # レート制限チェック（pingは頻繁に呼ばれるため、制限を緩く設定）
-    if not rate_limit_check(request, 'ping'):
+    if not await arate_limit_check(request, 'ping'):
         return JsonResponse({'error': 'リクエスト制限に達しました'}, status=429)
     
     try:
@@ -784,7 +1065,7 @@ def api_ping(request, session_id):
     except ValidationError:
         return JsonResponse({'error': '無効なセッションIDです'}, status=400)
     
-    session = get_object_or_404(LocationSession, session_id=session_id)
+    session = await aget_session_or_404(session_id)
     
     if session.is_expired():
         return JsonResponse({'error': 'セッションが期限切れです'}, status=400)
@@ -798,12 +1079,16 @@ def api_ping(request, session_id):
         # バリデーション
         validate_participant_id(participant_id)
         
-        # 最終更新時刻を更新
-        LocationData.objects.filter(
-            session=session,
-            participant_id=participant_id
-        ).update(
-            last_updated=timezone.now(),
+        # 最終更新時刻を更新（遅延オフライン予定も取り消す）
+        now = timezone.now()
+        await sync_to_async(update_participant)(
+            LocationData.objects.filter(
+                session=session,
+                participant_id=participant_id
+            ),
+            last_updated=now,
+            last_seen_at=now,
+            offline_after=None,
             is_online=True
         )
         
@@ -852,10 +1137,11 @@ def api_stop_sharing(request, session_id):
         validate_participant_name(participant_name)
         
         # 位置情報を削除して待機状態に変更
-        LocationData.objects.filter(
-            session=session,
-            participant_id=participant_id
-        ).update(
+        update_participant(
+            LocationData.objects.filter(
+                session=session,
+                participant_id=participant_id
+            ),
             latitude=None,
             longitude=None,
             accuracy=None,
@@ -866,9 +1152,9 @@ def api_stop_sharing(request, session_id):
         )
         
         # ログ記録
-        SessionLog.objects.create(
-            session=session,
-            action='stopped_sharing',
+        session_log.log(
+            session,
+            'stopped_sharing',
             participant_id=participant_id,
             ip_address=get_client_ip(request),
             user_agent=request.META.get('HTTP_USER_AGENT', '')[:500]
@@ -889,25 +1175,19 @@ def api_stop_sharing(request, session_id):
         return JsonResponse({'error': '共有停止処理に失敗しました'}, status=500)
 
 
-# 既存のrate_limit_check関数を改良版に置き換え
-def rate_limit_check(request, key_suffix='', limit=MAX_REQUESTS_PER_MINUTE):
-    """レート制限チェック（改良版）"""
-    from django.core.cache import cache
-    
-    client_ip = get_client_ip(request)
-    cache_key = f'rate_limit_{client_ip}_{key_suffix}'
-    
-    # pingの場合は制限を緩くする
-    if key_suffix == 'ping':
-        limit = MAX_REQUESTS_PER_MINUTE * 3  # 3倍まで許可
-    
-    requests = cache.get(cache_key, 0)
-    if requests >= limit:
-        logger.warning(f'Rate limit exceeded for {client_ip}, key: {key_suffix}')
-        return False
-    
-    cache.set(cache_key, requests + 1, 60)  # 1分間
-    return True
+def _request_limit(key_suffix):
+    """ビューごとのIP単位の制限"""
+    return VIEW_RATE_LIMITS.get(key_suffix, VIEW_RATE_LIMITS['default'])
+
+
+def rate_limit_check(request, key_suffix=''):
+    """レート制限チェック（IP・ビュー単位のトークンバケット）"""
+    return rate_limiter.allow_sync('ip', f'{get_client_ip(request)}:{key_suffix}', _request_limit(key_suffix))
+
+
+async def arate_limit_check(request, key_suffix=''):
+    """レート制限チェック（非同期ビュー用、イベントループを止めない）"""
+    return await rate_limiter.allow('ip', f'{get_client_ip(request)}:{key_suffix}', _request_limit(key_suffix))
 
 
 # セキュリティ強化: 不正なリクエストを検出する関数
@@ -940,28 +1220,16 @@ def detect_suspicious_activity(request, participant_id=None):
 
 
 @require_http_methods(["GET"])
-@never_cache
+@cache_control(public=True, max_age=15)
 def api_get_stats(request):
-    """統計情報取得API"""
+    """統計情報取得API（メモリ上のカウンタから返す）"""
     try:
-        # アクティブなセッション数を取得
-        active_sessions_count = LocationSession.objects.filter(
-            expires_at__gt=timezone.now()
-        ).count()
-        
-        # 現在の同時接続人数を取得（過去5分以内にアクティブな参加者）
-        five_minutes_ago = timezone.now() - timedelta(minutes=5)
-        online_participants_count = LocationData.objects.filter(
-            session__expires_at__gt=timezone.now(),
-            is_active=True,
-            is_online=True,
-            last_updated__gte=five_minutes_ago
-        ).count()
+        stats = live_stats.snapshot()
         
         return JsonResponse({
             'success': True,
-            'active_sessions_count': active_sessions_count,
-            'online_participants_count': online_participants_count,
+            'active_sessions_count': stats['active_sessions_count'],
+            'online_participants_count': stats['online_participants_count'],
             'timestamp': timezone.now().isoformat()
         })
         